@@ -0,0 +1,138 @@
+# Asset loading off the critical path. Map tiles and sounds are decoded by a
+# background thread while the title screen is up, combat art is only decoded on
+# the first fight, and scaled images are kept in an on-disk cache so later
+# starts skip both the PNG decode and the scale.
+import os
+import glob
+import queue
+import threading
+from time import perf_counter
+import pygame
+
+ASSET_DIR = os.path.dirname(os.path.abspath(__file__))
+TILE_FOLDER = os.path.join(ASSET_DIR, 'tiles')
+SOUND_FOLDER = os.path.join(ASSET_DIR, 'sounds')
+CACHE_FOLDER = os.path.join(ASSET_DIR, '.asset_cache')
+
+COMBAT_KEYS = ('combat_bg', 'player_combat', 'enemy_combat', 'enemy2_combat')  # Loaded on first combat
+MUSIC_FILE = 'background.mp3'
+MUSIC_VOLUME = 0.5
+SOUND_FILES = {
+    'attack': ('attack.mp3', 0.7),
+    'enemy_attack': ('enemy.mp3', 0.7),
+}
+
+def cache_path(path, size):
+    # Entries are keyed by the source mtime and the target size, so an edited
+    # PNG or a new scale simply misses
+    name = os.path.splitext(os.path.basename(path))[0]
+    return os.path.join(CACHE_FOLDER, f"{name}-{size[0]}x{size[1]}-{os.stat(path).st_mtime_ns}.rgba")
+
+def load_scaled(path, size):
+    # Returns an unconverted RGBA surface, convert_alpha needs the display and
+    # is left to the main thread
+    cached = cache_path(path, size)
+    try:
+        with open(cached, 'rb') as f:
+            return pygame.image.frombytes(f.read(), size, 'RGBA')
+    except (OSError, ValueError):
+        pass
+    img = pygame.transform.scale(pygame.image.load(path), size)
+    try:
+        os.makedirs(CACHE_FOLDER, exist_ok=True)
+        # Drop entries for older versions of the same file at this size
+        for stale in glob.glob(cached.rsplit('-', 1)[0] + '-*.rgba'):
+            os.remove(stale)
+        tmp = cached + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(pygame.image.tobytes(img, 'RGBA'))
+        os.replace(tmp, cached)
+    except OSError:
+        pass  # Read-only checkout, go without the cache
+    return img
+
+class AssetManager:
+    # tile_files maps tile keys to file names, tile_size(key) gives the scaled size.
+    # tile_images is only touched from the main thread, poll() moves finished
+    # images into it.
+    def __init__(self, tile_files, tile_size):
+        self.tile_files = tile_files
+        self.tile_size = tile_size
+        self.tile_images = {}
+        self.sounds = {}
+        self.loaded = queue.Queue()
+        self.combat_loaded = False
+        self.ready = threading.Event()
+        self.started_at = None
+        self.ready_at = None
+
+    def start(self):
+        self.started_at = perf_counter()
+        threading.Thread(target=self.load_background, daemon=True).start()
+
+    def tile_path(self, key):
+        return os.path.join(TILE_FOLDER, self.tile_files[key])
+
+    def load_background(self):
+        self.load_map_tiles()
+        self.load_sounds()
+        self.ready_at = perf_counter()
+        self.ready.set()
+
+    def load_map_tiles(self):
+        for key in self.tile_files:
+            if key in COMBAT_KEYS:
+                continue
+            path = self.tile_path(key)
+            if os.path.exists(path):
+                self.loaded.put((key, load_scaled(path, self.tile_size(key))))
+
+    def load_sounds(self):
+        try:
+            if not pygame.mixer.get_init():
+                pygame.mixer.init()
+        except pygame.error:
+            return  # No audio device, play silently
+        music_path = os.path.join(SOUND_FOLDER, MUSIC_FILE)
+        if os.path.exists(music_path):
+            pygame.mixer.music.load(music_path)
+            pygame.mixer.music.set_volume(MUSIC_VOLUME)
+            pygame.mixer.music.play(-1)  # Loop forever
+        for name, (filename, volume) in SOUND_FILES.items():
+            path = os.path.join(SOUND_FOLDER, filename)
+            if os.path.exists(path):
+                sound = pygame.mixer.Sound(path)
+                sound.set_volume(volume)
+                self.sounds[name] = sound
+
+    def poll(self):
+        # Convert images the loader finished since the last call, True if any arrived
+        arrived = False
+        while True:
+            try:
+                key, img = self.loaded.get_nowait()
+            except queue.Empty:
+                return arrived
+            self.tile_images[key] = img.convert_alpha()
+            arrived = True
+
+    def load_combat(self):
+        # Combat backgrounds and sprites are big and most sessions reach them late
+        if self.combat_loaded:
+            return
+        for key in COMBAT_KEYS:
+            if key in self.tile_files and os.path.exists(self.tile_path(key)):
+                self.tile_images[key] = load_scaled(self.tile_path(key), self.tile_size(key)).convert_alpha()
+        self.combat_loaded = True
+
+    def load_all(self):
+        # Synchronous image load for tools that need every tile up front, no sound
+        self.load_map_tiles()
+        self.poll()
+        self.load_combat()
+        return self.tile_images
+
+    def play(self, name):
+        sound = self.sounds.get(name)
+        if sound is not None:
+            sound.play()
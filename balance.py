@@ -0,0 +1,119 @@
+# Monte Carlo combat balance. Plays millions of fights per enemy type and player
+# strategy at once with NumPy, following the same rules and COMBATANTS table as
+# engine.CombatResolver, and prints win rate and HP loss per pairing as CSV.
+#
+#   python balance.py --fights 1000000 --player-hp 100 60 --flee-below 30
+import sys
+import time
+import argparse
+
+import numpy as np
+
+from engine import COMBATANTS, CombatResolver, floor_plan
+
+ATTACK, DEFEND, FLEE = 0, 1, 2
+MAX_ROUNDS = 1000  # Fights still going by then (a defend-only strategy) count as draws
+
+def always_attack(player_hp, enemy_hp, rng, options):
+    return np.zeros(len(player_hp), dtype=np.int8)
+
+def defend_mix(player_hp, enemy_hp, rng, options):
+    # Defend with probability --defend-chance, attack otherwise
+    return np.where(rng.random(len(player_hp)) < options.defend_chance, DEFEND, ATTACK).astype(np.int8)
+
+def flee_threshold(player_hp, enemy_hp, rng, options):
+    # Attack until HP drops below --flee-below, then try to flee every round
+    return np.where(player_hp < options.flee_below, FLEE, ATTACK).astype(np.int8)
+
+STRATEGIES = {
+    "attack": always_attack,
+    "defend_mix": defend_mix,
+    "flee_threshold": flee_threshold,
+}
+
+def simulate(resolver, enemy_type, strategy, fights, player_hp, rng, options):
+    # Runs fights in lockstep, one round per iteration over the fights still
+    # going. Returns per-fight results (1 won, -1 lost, 2 fled, 0 unfinished),
+    # final player HP and rounds played.
+    _, player_min, player_max = resolver.combatants["player"]
+    _, enemy_min, enemy_max = resolver.combatants[enemy_type]
+    result = np.zeros(fights, dtype=np.int8)
+    final_hp = np.empty(fights, dtype=np.int32)
+    rounds = np.zeros(fights, dtype=np.int32)
+    # Arrays below only hold the fights still going, index maps them back
+    index = np.arange(fights)
+    hp = np.full(fights, player_hp, dtype=np.int32)
+    enemy_hp = np.full(fights, resolver.max_hp(enemy_type), dtype=np.int32)
+    defending = np.zeros(fights, dtype=bool)
+    for round_number in range(1, MAX_ROUNDS + 1):
+        if not len(index):
+            break
+        action = strategy(hp, enemy_hp, rng, options)
+        attacking = action == ATTACK
+        enemy_hp -= np.where(attacking, rng.integers(player_min, player_max + 1, len(index)), 0).astype(np.int32)
+        # Defending lasts until the next attack, as in GameState.apply
+        defending = np.where(attacking, False, defending | (action == DEFEND))
+        fled = (action == FLEE) & (rng.random(len(index)) < resolver.flee_chance)
+        # The enemy strikes back unless it is down or the player got away
+        damage = rng.integers(enemy_min, enemy_max + 1, len(index)).astype(np.int32)
+        damage = np.where(defending, np.maximum(1, damage // resolver.defend_divisor), damage)
+        hp -= np.where((enemy_hp > 0) & ~fled, damage, 0).astype(np.int32)
+        outcome = np.where(fled, 2, np.where(enemy_hp <= 0, 1, np.where(hp <= 0, -1, 0)))
+        done = outcome != 0
+        finished = index[done]
+        result[finished] = outcome[done]
+        final_hp[finished] = hp[done]
+        rounds[finished] = round_number
+        going = ~done
+        index, hp, enemy_hp, defending = index[going], hp[going], enemy_hp[going], defending[going]
+    final_hp[index] = hp
+    rounds[index] = MAX_ROUNDS
+    return result, final_hp, rounds
+
+def summarize(result, final_hp, rounds, player_hp):
+    lost_hp = player_hp - np.maximum(final_hp, 0)
+    won = result == 1
+    return {
+        "win_rate": won.mean(),
+        "loss_rate": (result == -1).mean(),
+        "flee_rate": (result == 2).mean(),
+        "mean_hp_lost": lost_hp.mean(),
+        "mean_hp_lost_won": lost_hp[won].mean() if won.any() else float("nan"),
+        "p95_hp_lost_won": np.percentile(lost_hp[won], 95) if won.any() else float("nan"),
+        "mean_rounds": rounds.mean(),
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Simulate fights in bulk and report win rates and HP loss")
+    parser.add_argument("--fights", type=int, default=1000000, help="fights per enemy, strategy and starting HP")
+    parser.add_argument("--enemy", nargs="+", default=[name for name in COMBATANTS if name != "player"],
+                        choices=[name for name in COMBATANTS if name != "player"])
+    parser.add_argument("--strategy", nargs="+", default=list(STRATEGIES), choices=list(STRATEGIES))
+    parser.add_argument("--player-hp", type=int, nargs="+", default=[COMBATANTS["player"][0]],
+                        help="starting HP, fights later in a run start hurt")
+    parser.add_argument("--defend-chance", type=float, default=0.3, help="defend_mix: chance to defend each round")
+    parser.add_argument("--flee-below", type=int, default=30, help="flee_threshold: HP under which the player flees")
+    parser.add_argument("--depth", type=int, default=1, help="fight the enemies of this floor of an endless game")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args(argv)
+
+    resolver = CombatResolver()
+    stat_scale = floor_plan(args.depth, endless=True)[2]
+    if stat_scale != 1:
+        resolver = resolver.scaled(stat_scale)
+    rng = np.random.default_rng(args.seed)
+    fields = ["win_rate", "loss_rate", "flee_rate", "mean_hp_lost", "mean_hp_lost_won", "p95_hp_lost_won", "mean_rounds"]
+    print(",".join(["enemy", "strategy", "player_hp"] + fields))
+    total = 0
+    start = time.perf_counter()
+    for enemy_type in args.enemy:
+        for name in args.strategy:
+            for player_hp in args.player_hp:
+                stats = summarize(*simulate(resolver, enemy_type, STRATEGIES[name], args.fights, player_hp, rng, args), player_hp)
+                print(",".join([enemy_type, name, str(player_hp)] + [f"{stats[field]:.4f}" for field in fields]))
+                total += args.fights
+    elapsed = time.perf_counter() - start
+    print(f"{total} fights in {elapsed:.2f}s ({total / elapsed:,.0f}/s)", file=sys.stderr)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,319 @@
+# Benchmarks for the hot paths: dungeon generation, enemy AI, map and combat
+# rendering and the whole main() frame. Rendering goes through SDL's dummy video
+# driver, so this runs headless. Results are JSON; pass an earlier run as
+# --baseline to get a comparison and a non-zero exit on regressions.
+#
+#   python bench.py --output before.json
+#   python bench.py --baseline before.json --output after.json
+import os
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")  # Keep stdout pure JSON
+import sys
+import json
+import time
+import random
+import platform
+import argparse
+import tempfile
+import subprocess
+
+import pygame
+import engine
+import replay
+import main as game
+from engine import FLOOR, COMBATANTS, GameState, DescendPolicy, DistanceMap, Occupancy, create_dungeon, move_enemies
+
+GROUPS = ("create_dungeon", "move_enemies", "draw_grid", "draw_combat_ui", "frame")
+DUNGEON_SIZES = [(30, 22), (100, 100), (400, 400)]
+ENDLESS_DEPTHS = [1, 10, 50]  # Endless floors timed on the way down
+ENEMY_COUNTS = [3, 100, 1000]
+AI_MAP_SIZE = (200, 200)  # Room for 1000 enemies
+FRAME_MAP_SIZES = [(30, 22), (200, 200)]
+FRAME_SECONDS = 5.0  # Real time main() runs per frame benchmark
+FRAME_REPLAY_SPEED = 4  # Game speed of the replay it draws, so more changes per frame
+ACTION_EVERY = 6  # Ticks between the recorded bot's actions, about a key press per 200 ms
+REGRESSION_THRESHOLD = 0.10  # Slower than the baseline by more than this is a regression
+
+def backend_for(width, height):
+    # The backend main() picks for a map of this size
+    return "array" if engine.np is not None and width * height > engine.GRID_WIDTH * engine.GRID_HEIGHT else "list"
+
+def summarize(name, params, samples_ns):
+    samples = sorted(samples_ns)
+    pick = lambda fraction: samples[min(len(samples) - 1, int(fraction * len(samples)))] / 1000
+    return {
+        "name": name,
+        "params": params,
+        "runs": len(samples),
+        "mean_us": round(sum(samples) / len(samples) / 1000, 2),
+        "p50_us": round(pick(0.50), 2),
+        "p95_us": round(pick(0.95), 2),
+        "min_us": round(samples[0] / 1000, 2),
+    }
+
+def timed(function, runs, setup=None):
+    # Run function runs times, setup (untimed) before each, and return the timings
+    samples = []
+    for _ in range(runs):
+        arg = setup() if setup is not None else None
+        start = time.perf_counter_ns()
+        function(arg)
+        samples.append(time.perf_counter_ns() - start)
+    return samples
+
+def bench_create_dungeon(scale):
+    results = []
+    for width, height in DUNGEON_SIZES:
+        backend = backend_for(width, height)
+        # Fewer seeds on big maps, each one is already a long call
+        seeds = range(max(3, int(200 * scale * 30 * 22 / (width * height) ** 0.75)))
+        for floor in (1, 5):
+            samples = []
+            for seed in seeds:
+                start = time.perf_counter_ns()
+                create_dungeon(seed, floor, width=width, height=height, backend=backend)
+                samples.append(time.perf_counter_ns() - start)
+            results.append(summarize("create_dungeon", {"size": f"{width}x{height}", "floor": floor, "backend": backend}, samples))
+        # The BSP generator on the same maps
+        samples = []
+        for seed in seeds:
+            start = time.perf_counter_ns()
+            create_dungeon(seed, 1, width=width, height=height, backend=backend, generator="bsp")
+            samples.append(time.perf_counter_ns() - start)
+        results.append(summarize("create_dungeon", {"size": f"{width}x{height}", "floor": 1, "backend": backend, "generator": "bsp"}, samples))
+    # Endless floors at a few depths, each is built on its own from (seed, floor)
+    size = f"{engine.GRID_WIDTH}x{engine.GRID_HEIGHT}"
+    for depth in ENDLESS_DEPTHS:
+        samples = []
+        for seed in range(max(3, int(20 * scale))):
+            start = time.perf_counter_ns()
+            create_dungeon(seed, depth, endless=True)
+            samples.append(time.perf_counter_ns() - start)
+        results.append(summarize("create_dungeon", {"size": size, "floor": depth, "backend": "list", "endless": True}, samples))
+    return results
+
+def scatter_enemies(grid, count, rng, player_pos):
+    cells = [(x, y) for y in range(len(grid)) for x in range(len(grid[0]))
+             if grid[y][x] == FLOOR and (x, y) != player_pos]
+    return rng.sample(cells, min(count, len(cells)))
+
+def bench_move_enemies(scale):
+    width, height = AI_MAP_SIZE
+    backend = "array" if engine.np is not None else "list"
+    grid, player_pos = create_dungeon(1, 1, width=width, height=height, backend=backend)[:2]
+    results = []
+    for count in ENEMY_COUNTS:
+        rng = random.Random(count)
+        enemies = scatter_enemies(grid, count, rng, player_pos)
+        # The player moves between enemy turns in play, so every turn rebuilds the distance map
+        players = scatter_enemies(grid, 2, rng, None)
+        distance_map = DistanceMap()
+        turn = [0]
+
+        def setup():
+            turn[0] += 1
+            player = players[turn[0] % 2]
+            return enemies, player, Occupancy.from_floor(enemies, None, None, player)
+
+        def run(arg):
+            positions, player, occupancy = arg
+            move_enemies(grid, positions, None, player, occupancy, None, distance_map, rng=rng)
+
+        results.append(summarize("move_enemies", {"enemies": len(enemies), "map": f"{width}x{height}"},
+                                 timed(run, max(5, int(200 * scale)), setup)))
+    return results
+
+def render_state(width, height):
+    # A new game with the whole floor explored, so every cell in view gets drawn
+    state = GameState(seed=7, width=width, height=height, backend=backend_for(width, height))
+    state.explored[:] = b"\1" * len(state.explored)
+    state.update_fov()
+    return state
+
+def bench_draw_grid(scale, tile_images):
+    screen = pygame.display.get_surface()
+    atlas = game.TileAtlas(tile_images)
+    results = []
+    runs = max(10, int(300 * scale))
+    for width, height in FRAME_MAP_SIZES:
+        state = render_state(width, height)
+        camera = game.camera_origin(state.grid, state.player_x, state.player_y)
+        size = f"{width}x{height}"
+
+        def draw(terrain, dirty_rects=None):
+            return game.draw_grid(screen, terrain, camera, state.player_x, state.player_y, state.enemies, state.enemy2,
+                                  state.boss_pos, dirty_rects, state.visible)
+
+        # Cold: every chunk in view baked from scratch, as on arriving at a floor
+        cold = timed(lambda terrain: draw(terrain), max(5, runs // 10), lambda: game.TerrainCache(state.grid, atlas, state.explored))
+        results.append(summarize("draw_grid", {"map": size, "mode": "cold"}, cold))
+        terrain = game.TerrainCache(state.grid, atlas, state.explored)
+        sprite_rects = draw(terrain)
+        results.append(summarize("draw_grid", {"map": size, "mode": "full"}, timed(lambda _: draw(terrain), runs)))
+        results.append(summarize("draw_grid", {"map": size, "mode": "dirty"}, timed(lambda _: draw(terrain, sprite_rects), runs)))
+    return results
+
+def bench_draw_combat_ui(scale, tile_images):
+    screen = pygame.display.get_surface()
+    ui_font = pygame.font.SysFont("monospace", game.UI_FONT_SIZE)
+    renderer = game.CombatRenderer(ui_font, tile_images, game.TextCache())
+    player_max_hp = COMBATANTS["player"][0]
+    results = []
+    runs = max(10, int(300 * scale))
+    for enemy_type in ("enemy", "enemy2", "boss"):
+        enemy_max_hp = COMBATANTS[enemy_type][0]
+        hp = [0]
+
+        def changed(_):
+            # New HP every call, so the popup is recomposed each time
+            hp[0] = (hp[0] + 1) % enemy_max_hp
+            renderer.draw(screen, enemy_type, player_max_hp, hp[0] + 1, player_max_hp, enemy_max_hp, "player_turn", 12)
+
+        def unchanged(_):
+            renderer.draw(screen, enemy_type, player_max_hp, enemy_max_hp, player_max_hp, enemy_max_hp, "player_turn", 12)
+
+        results.append(summarize("draw_combat_ui", {"enemy": enemy_type, "mode": "recompose"}, timed(changed, runs)))
+        results.append(summarize("draw_combat_ui", {"enemy": enemy_type, "mode": "cached"}, timed(unchanged, runs)))
+    return results
+
+def record_session(path, width, height, ticks):
+    # A bot play session recorded like main() records a player, for main() to replay
+    state = GameState(seed=7, width=width, height=height, backend=backend_for(width, height))
+    recorder = replay.Recorder(state, path)
+    policy = DescendPolicy()
+    rng = random.Random(7)
+    for tick in range(ticks):
+        if tick % ACTION_EVERY == 0:
+            action = policy(state, rng)
+            if action is not None:
+                recorder.apply(action)
+                state.apply(action)
+        state.tick()
+        recorder.tick()
+    recorder.close()
+
+def run_frames(replay_path, profile_path, seconds):
+    # Child process entry: main() replays the session uncapped and quits after seconds
+    pygame.init()
+    pygame.time.set_timer(pygame.QUIT, int(seconds * 1000), 1)
+    try:
+        game.main(["--replay", replay_path, "--replay-speed", str(FRAME_REPLAY_SPEED), "--fps", "0",
+                   "--profile-out", profile_path, "--record", ""])
+    except SystemExit:
+        pass
+
+def bench_frame(scale):
+    # main() runs in a child process: it owns the display and quits pygame on exit
+    results = []
+    seconds = max(1.0, FRAME_SECONDS * scale)
+    with tempfile.TemporaryDirectory() as tmp:
+        for width, height in FRAME_MAP_SIZES:
+            replay_path = os.path.join(tmp, "session.replay")
+            profile_path = os.path.join(tmp, "frames.jsonl")
+            record_session(replay_path, width, height, int((seconds + 1) * engine.TICK_RATE * FRAME_REPLAY_SPEED))
+            subprocess.run([sys.executable, os.path.abspath(__file__), "--run-frames", replay_path, profile_path, str(seconds)],
+                           check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            with open(profile_path) as f:
+                frames = [json.loads(line) for line in f]
+            # The first frames wait on asset loading, leave them out
+            frames = frames[len(frames) // 10:]
+            if not frames:
+                continue
+            # One record per drawn frame, frames skipped while nothing changed aren't timed
+            params = {"map": f"{width}x{height}", "replay_speed": FRAME_REPLAY_SPEED}
+            results.append(summarize("frame", params, [frame["total_ns"] for frame in frames]))
+            for phase in game.PHASES:
+                results.append(summarize(f"frame.{phase}", params, [frame[f"{phase}_ns"] for frame in frames]))
+    return results
+
+def result_key(result):
+    return result["name"] + json.dumps(result["params"], sort_keys=True)
+
+def compare(results, baseline, threshold, metric):
+    # Print metric against the baseline per benchmark, returns how many got slower than threshold
+    previous = {result_key(result): result for result in baseline["results"]}
+    regressions = 0
+    print(f"{'benchmark':<62}{'base':>12}{metric:>12}{'change':>9}", file=sys.stderr)
+    for result in results:
+        old = previous.get(result_key(result))
+        label = result["name"] + " " + " ".join(f"{k}={v}" for k, v in result["params"].items())
+        if old is None or not old[metric]:
+            print(f"{label:<62}{'-':>12}{result[metric]:>12.1f}{'new':>9}", file=sys.stderr)
+            continue
+        change = result[metric] / old[metric] - 1
+        flag = ""
+        # Phases of a few microseconds are noise, only whole benchmarks count
+        if change > threshold and not result["name"].startswith("frame."):
+            flag = "  REGRESSION"
+            regressions += 1
+        print(f"{label:<62}{old[metric]:>12.1f}{result[metric]:>12.1f}{change:>+9.1%}{flag}", file=sys.stderr)
+    return regressions
+
+def environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "pygame": pygame.version.ver,
+        "numpy": engine.np.__version__ if engine.np is not None else None,
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark generation, AI and rendering hot paths")
+    parser.add_argument("--only", nargs="+", choices=GROUPS, default=list(GROUPS), help="benchmark groups to run")
+    parser.add_argument("--scale", type=float, default=1.0, help="multiplies the run counts, 0.1 for a quick check")
+    parser.add_argument("--output", metavar="PATH", help="write the JSON results here instead of stdout")
+    parser.add_argument("--baseline", metavar="PATH", help="earlier --output to compare against")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD,
+                        help="relative slowdown reported as a regression")
+    parser.add_argument("--metric", choices=["p50_us", "min_us", "mean_us"], default="p50_us",
+                        help="statistic compared against the baseline, min_us is steadiest on a busy machine")
+    parser.add_argument("--run-frames", nargs=3, metavar=("REPLAY", "PROFILE", "SECONDS"), help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    if args.run_frames:
+        replay_path, profile_path, seconds = args.run_frames
+        run_frames(replay_path, profile_path, float(seconds))
+        return 0
+
+    results = []
+    if {"draw_grid", "draw_combat_ui"} & set(args.only):
+        pygame.init()
+        pygame.display.set_mode((game.WINDOW_WIDTH, game.WINDOW_HEIGHT))
+        tile_images = game.load_tile_images()
+    for group in args.only:
+        print(f"running {group}", file=sys.stderr)
+        if group == "create_dungeon":
+            results += bench_create_dungeon(args.scale)
+        elif group == "move_enemies":
+            results += bench_move_enemies(args.scale)
+        elif group == "draw_grid":
+            results += bench_draw_grid(args.scale, tile_images)
+        elif group == "draw_combat_ui":
+            results += bench_draw_combat_ui(args.scale, tile_images)
+        elif group == "frame":
+            results += bench_frame(args.scale)
+
+    report = {"environment": environment(), "results": results}
+    text = json.dumps(report, indent=1)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.threshold, args.metric):
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,1373 @@
+# Game logic with no pygame dependency: dungeon generation, enemy movement,
+# combat and the GameState that main.py renders. Runs headless for batch play-throughs.
+import sys
+import random
+import logging
+import queue
+import threading
+import argparse
+import time
+import heapq
+from bisect import bisect_right
+from collections import OrderedDict, Counter
+from contextlib import nullcontext
+from math import isqrt
+
+try:
+    import numpy as np
+except ImportError:  # Only needed for the "array" grid backend
+    np = None
+
+logger = logging.getLogger(__name__)
+
+GRID_WIDTH = 30
+GRID_HEIGHT = 22
+
+# Map symbols
+PLAYER = '@'
+WALL = '#'
+FLOOR = '.'
+STAIRS_DOWN = '>'
+STAIRS_UP = '<'
+ENEMY = 'E'
+ENEMY2 = 'F'
+BOSS = 'B'
+
+# Dungeon generation parameters
+GRID_BACKEND = "list"  # "list" of symbol lists, or "array" for a NumPy uint8 grid
+NUM_ROOMS = 8
+ROOM_MIN_SIZE = 4
+ROOM_MAX_SIZE = 8
+MIN_MAP_SIZE = ROOM_MAX_SIZE + 2  # Smallest side that fits the biggest room inside the outer wall
+ENEMIES_PER_FLOOR = 3
+FLOOR_CACHE_SIZE = 8  # Generated floors kept per session, least recently used dropped first
+LAST_FLOOR = 5  # The boss floor, beating its boss wins the game
+
+# Endless mode: no last floor, every floor down has more rooms and enemies and
+# stronger enemies, with a boss every ENDLESS_BOSS_EVERY floors that doesn't end the run
+ENDLESS_BOSS_EVERY = 5
+ENDLESS_FLOORS_PER_ROOM = 2  # One more room every 2 floors down...
+ENDLESS_MAX_ROOM_FACTOR = 2  # ...up to twice the classic room count
+ENDLESS_FLOORS_PER_ENEMY = 2
+ENDLESS_MAX_ENEMIES = 12  # On the standard map, more on bigger ones
+ENDLESS_STAT_GROWTH = 0.05  # Enemy HP and attack grow 5% a floor...
+ENDLESS_MAX_STAT_SCALE = 20.0  # ...up to 20x, which keeps HP in the protocol's int16
+ENDLESS_WINDOW = 3  # Floors kept resident above and below the player, further ones are rebuilt from the seed
+
+# Combat settings
+PLAYER_MAX_HP = 100
+PLAYER_ATTACK_MIN = 15
+PLAYER_ATTACK_MAX = 25
+ENEMY_ATTACK_MIN = 10
+ENEMY_ATTACK_MAX = 20
+ENEMY2_ATTACK_MIN = 15
+ENEMY2_ATTACK_MAX = 30
+ENEMY_MAX_HP = 60
+ENEMY2_MAX_HP = 80
+BOSS_ATTACK_MIN = 25
+BOSS_ATTACK_MAX =40
+BOSS_MAX_HP = 200
+FLEE_CHANCE = 0.7
+DEFEND_DIVISOR = 2  # Defending divides the damage taken, never below 1
+# Per fighter: (max hp, attack min, attack max). CombatResolver and balance.py
+# both read this table, retune balance here.
+COMBATANTS = {
+    "player": (PLAYER_MAX_HP, PLAYER_ATTACK_MIN, PLAYER_ATTACK_MAX),
+    "enemy": (ENEMY_MAX_HP, ENEMY_ATTACK_MIN, ENEMY_ATTACK_MAX),
+    "enemy2": (ENEMY2_MAX_HP, ENEMY2_ATTACK_MIN, ENEMY2_ATTACK_MAX),
+    "boss": (BOSS_MAX_HP, BOSS_ATTACK_MIN, BOSS_ATTACK_MAX),
+}
+
+# Timing, in ticks. main.py runs TICK_RATE ticks per second of real time
+# whatever the frame rate, so these are fixed durations.
+TICK_RATE = 30
+ENEMY_MOVE_DELAY = 50  # Move enemies every 50 ticks
+ENEMY_TURN_DELAY = 30  # 1 second delay at TICK_RATE
+
+# Enemy AI. Every enemy reads the same distance map from the player, behaviors:
+# "chase" steps downhill and attacks by stepping onto the player, "flee" steps
+# uphill, "wander" picks any free neighbour. Enemies further than AI_SIGHT
+# steps from the player wander.
+AI_SIGHT = 40
+ENEMY_BEHAVIORS = {"enemy": "chase", "enemy2": "chase", "boss": "chase"}
+ENTITY_SIZES = {"enemy": 1, "enemy2": 1, "boss": 2}  # The boss covers 2x2 cells from its position
+STEPS = [(-1,0), (1,0), (0,-1), (0,1)]
+
+FOV_RADIUS = 8  # Cells the player can see, walls block sight
+
+# Actions accepted by GameState.apply / GameState.step
+MOVES = {
+    "up": (0, -1),
+    "down": (0, 1),
+    "left": (-1, 0),
+    "right": (1, 0),
+}
+COMBAT_ACTIONS = ("attack", "defend", "flee")
+ACTIONS = tuple(MOVES) + COMBAT_ACTIONS + ("continue", "restart")
+
+SEED_MIN, SEED_MAX = -2 ** 63, 2 ** 63 - 1  # Saves, replays and the network protocol store seeds as int64
+
+def check_seed(seed):
+    # The seed back if it fits those formats, ValueError if it doesn't
+    if not SEED_MIN <= seed <= SEED_MAX:
+        raise ValueError(f"seed {seed} is outside the 64-bit range")
+    return seed
+
+def subsystem_rng(seed, name):
+    # Independent stream per subsystem ("ai", "combat") of a game. Seeding from a
+    # string goes through SHA-512, so it is stable across processes, unlike hash().
+    return random.Random(f"{seed}:{name}")
+
+def floor_seed(seed, floor):
+    # The value random.seed((seed, floor)) hashed the tuple to before Python 3.11
+    # stopped accepting tuple seeds, so existing seeds keep their layouts
+    return hash((seed, floor)) & 0xFFFFFFFFFFFFFFFF
+
+# Tile codes for ArrayGrid, indexed back to map symbols by TILE_SYMBOLS
+TILE_SYMBOLS = (WALL, FLOOR, STAIRS_DOWN, STAIRS_UP)
+TILE_CODES = {symbol: code for code, symbol in enumerate(TILE_SYMBOLS)}
+
+class ArrayGridRow:
+    # One row of an ArrayGrid, read and written as map symbols
+    def __init__(self, cells):
+        self.cells = cells
+
+    def __len__(self):
+        return len(self.cells)
+
+    def __getitem__(self, x):
+        return TILE_SYMBOLS[self.cells[x]]
+
+    def __setitem__(self, x, symbol):
+        self.cells[x] = TILE_CODES[symbol]
+
+    def __iter__(self):
+        for code in self.cells.tolist():
+            yield TILE_SYMBOLS[code]
+
+    def count(self, symbol):
+        return int((self.cells == TILE_CODES[symbol]).sum())
+
+class ArrayGrid:
+    # Compact grid backend: a (height, width) uint8 array of tile codes.
+    # grid[y][x] still reads and writes map symbols, so callers written for
+    # the list-of-lists grid keep working unchanged.
+    def __init__(self, width, height):
+        if np is None:
+            raise ImportError("the array grid backend needs numpy")
+        self.cells = np.full((height, width), TILE_CODES[WALL], dtype=np.uint8)
+
+    def __len__(self):
+        return self.cells.shape[0]
+
+    def __getitem__(self, y):
+        return ArrayGridRow(self.cells[y])
+
+    def __iter__(self):
+        for y in range(self.cells.shape[0]):
+            yield ArrayGridRow(self.cells[y])
+
+    def fill(self, x0, y0, x1, y1, symbol):
+        self.cells[y0:y1, x0:x1] = TILE_CODES[symbol]
+
+    def walkable(self):
+        return self.cells != TILE_CODES[WALL]
+
+def create_empty_grid(width=GRID_WIDTH, height=GRID_HEIGHT, backend=None):
+    if (backend or GRID_BACKEND) == "array":
+        return ArrayGrid(width, height)
+    return [[WALL for _ in range(width)] for _ in range(height)]
+
+def place_room(grid, x, y, w, h):
+    # Carve floor over the rectangle, clipped to inside the outer wall
+    height, width = len(grid), len(grid[0])
+    x0, x1 = max(x, 1), min(x + w, width - 1)
+    y0, y1 = max(y, 1), min(y + h, height - 1)
+    if x0 >= x1 or y0 >= y1:
+        return
+    if isinstance(grid, ArrayGrid):
+        grid.fill(x0, y0, x1, y1, FLOOR)
+    else:
+        for i in range(y0, y1):
+            row = grid[i]
+            for j in range(x0, x1):
+                row[j] = FLOOR
+
+def carve_corridor(grid, x0, y0, x1, y1):
+    # Straight corridor between two cells sharing a row or a column
+    place_room(grid, min(x0, x1), min(y0, y1), abs(x1 - x0) + 1, abs(y1 - y0) + 1)
+
+def rooms_for_area(width, height):
+    # NUM_ROOMS for the standard map, scaled up with area for bigger maps
+    return NUM_ROOMS * max(1, (width * height) // (GRID_WIDTH * GRID_HEIGHT))
+
+def floor_plan(floor, endless=False, width=GRID_WIDTH, height=GRID_HEIGHT):
+    # What goes on a floor: (rooms, enemies, enemy stat scale, boss floor). A
+    # classic game uses the fixed settings, an endless one scales them with depth.
+    rooms = rooms_for_area(width, height)
+    if not endless:
+        return rooms, ENEMIES_PER_FLOOR, 1.0, floor == LAST_FLOOR
+    depth = floor - 1
+    area_factor = rooms // NUM_ROOMS
+    return (min(rooms + depth // ENDLESS_FLOORS_PER_ROOM, rooms * ENDLESS_MAX_ROOM_FACTOR),
+            min(ENEMIES_PER_FLOOR + depth // ENDLESS_FLOORS_PER_ENEMY, ENDLESS_MAX_ENEMIES * area_factor),
+            min(1.0 + depth * ENDLESS_STAT_GROWTH, ENDLESS_MAX_STAT_SCALE),
+            floor % ENDLESS_BOSS_EVERY == 0)
+
+class RoomIndex:
+    # Accepted rooms bucketed by ROOM_MAX_SIZE-wide cells, so an overlap check
+    # only looks at rooms in the buckets the candidate covers instead of all of them
+    def __init__(self):
+        self.buckets = {}
+
+    def bucket_range(self, x, y, w, h):
+        for by in range(y // ROOM_MAX_SIZE, (y + h - 1) // ROOM_MAX_SIZE + 1):
+            for bx in range(x // ROOM_MAX_SIZE, (x + w - 1) // ROOM_MAX_SIZE + 1):
+                yield bx, by
+
+    def add(self, room):
+        for bucket in self.bucket_range(*room):
+            self.buckets.setdefault(bucket, []).append(room)
+
+    def overlaps(self, x, y, w, h):
+        for bucket in self.bucket_range(x, y, w, h):
+            for ox, oy, ow, oh in self.buckets.get(bucket, ()):
+                if (x < ox + ow and x + w > ox and y < oy + oh and y + h > oy):
+                    return True
+        return False
+
+def find_free_2x2(grid, blocked):
+    # First (x, y) in row-major order whose 2x2 block is all floor and clear of blocked cells
+    height, width = len(grid), len(grid[0])
+    if isinstance(grid, ArrayGrid):
+        floor = grid.cells == TILE_CODES[FLOOR]
+        fits = floor[:-1, :-1] & floor[1:, :-1] & floor[:-1, 1:] & floor[1:, 1:]
+        # Same search window as the list scan below: 1 <= x < width - 2, 1 <= y < height - 2
+        for y, x in np.argwhere(fits[1:height - 2, 1:width - 2]).tolist():
+            x, y = x + 1, y + 1
+            if not any((x + dx, y + dy) in blocked for dx in range(2) for dy in range(2)):
+                return x, y
+        return None
+    for y in range(1, height - 2):
+        for x in range(1, width - 2):
+            # Check if 2x2 area is available
+            can_place = True
+            for dx in range(2):
+                for dy in range(2):
+                    nx, ny = x + dx, y + dy
+                    if grid[ny][nx] != FLOOR or (nx, ny) in blocked:
+                        can_place = False
+                        break
+                if not can_place:
+                    break
+            if can_place:
+                return x, y
+    return None
+
+def connect_rooms(grid, room_a, room_b, rng):
+    # L-shaped corridor between the centres of two rooms, bending either way
+    ax, ay, aw, ah = room_a
+    bx, by, bw, bh = room_b
+    prev_cx = ax + aw // 2
+    prev_cy = ay + ah // 2
+    new_cx = bx + bw // 2
+    new_cy = by + bh // 2
+    if rng.choice([True, False]):
+        # Horizontal then vertical
+        carve_corridor(grid, prev_cx, prev_cy, new_cx, prev_cy)
+        carve_corridor(grid, new_cx, prev_cy, new_cx, new_cy)
+    else:
+        # Vertical then horizontal
+        carve_corridor(grid, prev_cx, prev_cy, prev_cx, new_cy)
+        carve_corridor(grid, prev_cx, new_cy, new_cx, new_cy)
+
+def classic_rooms(grid, rng, count, rooms):
+    # count random rectangles, the ones overlapping an earlier room dropped, each
+    # kept one joined to the one before it. The default, every seed's layout
+    # depends on its exact sequence of rolls.
+    height, width = len(grid), len(grid[0])
+    room_index = RoomIndex()
+    for _ in range(count):
+        w = rng.randint(ROOM_MIN_SIZE, ROOM_MAX_SIZE)
+        h = rng.randint(ROOM_MIN_SIZE, ROOM_MAX_SIZE)
+        x = rng.randint(1, width - w - 1)
+        y = rng.randint(1, height - h - 1)
+        new_room = (x, y, w, h)
+        # Check for overlap
+        if not room_index.overlaps(x, y, w, h):
+            place_room(grid, x, y, w, h)
+            if rooms:
+                # Connect to previous room with a corridor
+                connect_rooms(grid, rooms[-1], new_room, rng)
+            rooms.append(new_room)
+            room_index.add(new_room)
+
+def split_leaves(width, height, count, rng):
+    # Binary space partition of the map inside the outer wall into up to count
+    # leaves, always splitting the biggest leaf left across its longer side.
+    # Cuts fall on whole multiples of the smallest leaf (plus the remainder
+    # spread at random), so a split never wastes a slot: count leaves come out
+    # whenever count <= (inner width // smallest) * (inner height // smallest).
+    smallest = ROOM_MIN_SIZE + 1  # A room plus the wall between it and the next leaf
+    heap = [(-(width - 2) * (height - 2), 0, (1, 1, width - 2, height - 2))]
+    leaves = []
+    order = 1  # Tie-break so equal areas pop in creation order
+    while heap and len(heap) + len(leaves) < count:
+        _, _, (x, y, w, h) = heapq.heappop(heap)
+        vertical = w > h if w != h else rng.random() < 0.5
+        if (w if vertical else h) < 2 * smallest:
+            vertical = not vertical
+            if (w if vertical else h) < 2 * smallest:
+                leaves.append((x, y, w, h))
+                continue
+        size = w if vertical else h
+        slots = size // smallest
+        cut = rng.randint(1, slots - 1) * smallest + rng.randint(0, size - slots * smallest)
+        if vertical:
+            halves = ((x, y, cut, h), (x + cut, y, w - cut, h))
+        else:
+            halves = ((x, y, w, cut), (x, y + cut, w, h - cut))
+        for leaf in halves:
+            heapq.heappush(heap, (-leaf[2] * leaf[3], order, leaf))
+            order += 1
+    return leaves + [leaf for _, _, leaf in sorted(heap, key=lambda item: item[1])]
+
+def touching_leaves(leaves):
+    # (i, j) for every two leaves sharing part of an edge. Leaves ending on the
+    # same line are sorted by position along it and bisected, not compared pairwise.
+    pairs = []
+    for axis in (0, 1):
+        # Leaves whose right (axis 0) or bottom (axis 1) edge lies on each line
+        ends = {}
+        for i, leaf in enumerate(leaves):
+            ends.setdefault(leaf[axis] + leaf[axis + 2], []).append((leaf[1 - axis], leaf[1 - axis] + leaf[3 - axis], i))
+        for line in ends.values():
+            line.sort()
+        for j, leaf in enumerate(leaves):
+            line = ends.get(leaf[axis])
+            if not line:
+                continue
+            start, stop = leaf[1 - axis], leaf[1 - axis] + leaf[3 - axis]
+            # First leaf on the line ending after this one starts
+            k = max(bisect_right(line, (start, float("inf"))) - 1, 0)
+            while k < len(line) and line[k][0] < stop:
+                if line[k][1] > start:
+                    pairs.append((line[k][2], j))
+                k += 1
+    return pairs
+
+def spanning_corridors(rooms, pairs):
+    # Minimum spanning tree (Kruskal) over the candidate pairs, weighted by the
+    # Manhattan distance between room centres
+    centres = [(x + w // 2, y + h // 2) for x, y, w, h in rooms]
+    def length(pair):
+        (ax, ay), (bx, by) = centres[pair[0]], centres[pair[1]]
+        return abs(ax - bx) + abs(ay - by)
+    parent = list(range(len(rooms)))
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+    tree = []
+    for a, b in sorted(pairs, key=length):
+        root_a, root_b = find(a), find(b)
+        if root_a != root_b:
+            parent[root_a] = root_b
+            tree.append((a, b))
+    return tree
+
+def bsp_rooms(grid, rng, count, rooms):
+    # Exactly count rooms where the map has space for them: one room per leaf of a
+    # binary space partition, so rooms never overlap and no roll is thrown away.
+    # Leaves tile the map, so joining rooms of touching leaves along a minimum
+    # spanning tree connects every room with the least corridor. Rooms come out
+    # in tree order from the first, the last one the furthest along the tree,
+    # which is where create_dungeon puts the up and down stairs.
+    height, width = len(grid), len(grid[0])
+    leaves = split_leaves(width, height, count, rng)
+    placed = []
+    for x, y, w, h in leaves:
+        # Keep the leaf's last row and column as wall
+        room_w = rng.randint(ROOM_MIN_SIZE, min(ROOM_MAX_SIZE, w - 1))
+        room_h = rng.randint(ROOM_MIN_SIZE, min(ROOM_MAX_SIZE, h - 1))
+        room = (rng.randint(x, x + w - 1 - room_w), rng.randint(y, y + h - 1 - room_h), room_w, room_h)
+        place_room(grid, *room)
+        placed.append(room)
+    links = {i: [] for i in range(len(placed))}
+    for a, b in spanning_corridors(placed, touching_leaves(leaves)):
+        connect_rooms(grid, placed[a], placed[b], rng)
+        links[a].append(b)
+        links[b].append(a)
+    # Breadth-first from the first room
+    order = [0] if placed else []
+    seen = {0}
+    for i in order:
+        for j in links[i]:
+            if j not in seen:
+                seen.add(j)
+                order.append(j)
+    rooms.extend(placed[i] for i in order)
+
+# Room placement per generator, chosen per game. Saves store the index in this order.
+GENERATORS = {"classic": classic_rooms, "bsp": bsp_rooms}
+
+def create_dungeon(seed, floor, place_up_stairs=True, place_down_stairs=True, rooms=None,
+                   width=GRID_WIDTH, height=GRID_HEIGHT, backend=None, endless=False, generator="classic"):
+    # Pass a list as rooms to get back the (x, y, w, h) of every room that was placed.
+    # backend picks the grid representation, GRID_BACKEND by default. endless
+    # scales the floor with depth, see floor_plan(). generator names the
+    # GENERATORS entry that places the rooms.
+    room_count, enemy_count, _, is_boss_floor = floor_plan(floor, endless, width, height)
+    # Only a classic game's boss floor is a dead end
+    is_last_floor = is_boss_floor and not endless
+    # Unique per-floor stream of its own, so floors generate the same in any order or thread
+    rng = random.Random(floor_seed(seed, floor))
+    grid = create_empty_grid(width, height, backend)
+    if rooms is None:
+        rooms = []
+    GENERATORS[generator](grid, rng, room_count, rooms)
+    # Place stairs
+    stairs_up_pos = None
+    stairs_down_pos = None
+    if rooms:
+        # Place stairs in different rooms
+        first_room = rooms[0]
+        last_room = rooms[-1]
+        if place_up_stairs:
+            up_x = first_room[0] + first_room[2] // 2
+            up_y = first_room[1] + first_room[3] // 2
+            stairs_up_pos = (up_x, up_y)
+        if place_down_stairs and not is_last_floor:
+            # Try to place stairs down in a different room than stairs up
+            down_room = last_room
+            if place_up_stairs and len(rooms) > 1:
+                # Find a room that is not the first room
+                for room in reversed(rooms):
+                    rx, ry, rw, rh = room
+                    candidate = (rx + rw // 2, ry + rh // 2)
+                    if candidate != stairs_up_pos:
+                        down_room = room
+                        break
+            down_x = down_room[0] + down_room[2] // 2
+            down_y = down_room[1] + down_room[3] // 2
+            stairs_down_pos = (down_x, down_y)
+        # Place tiles
+        if stairs_up_pos:
+            grid[stairs_up_pos[1]][stairs_up_pos[0]] = STAIRS_UP
+        if stairs_down_pos:
+            grid[stairs_down_pos[1]][stairs_down_pos[0]] = STAIRS_DOWN
+    # Player starts at up stairs (or down stairs if no up stairs)
+    if stairs_up_pos:
+        player_start = stairs_up_pos
+    elif stairs_down_pos:
+        player_start = stairs_down_pos
+    else:
+        player_start = (1, 1)
+    # Cells nothing else may spawn on, kept as a set so each check is O(1)
+    taken = {player_start}
+    if stairs_up_pos is not None:
+        taken.add(stairs_up_pos)
+    if stairs_down_pos is not None:
+        taken.add(stairs_down_pos)
+    # Place enemies
+    enemies = []
+    attempts = 0
+    max_attempts = max(100, enemy_count * 20)
+    while len(enemies) < enemy_count and attempts < max_attempts:
+        ex = rng.randint(1, width - 2)
+        ey = rng.randint(1, height - 2)
+        if grid[ey][ex] == FLOOR and (ex, ey) not in taken:
+            enemies.append((ex, ey))
+            taken.add((ex, ey))
+        attempts += 1
+
+    # Place enemy2 (one per floor)
+    enemy2 = None
+    attempts = 0
+    while enemy2 is None and attempts < 100:
+        ex = rng.randint(1, width - 2)
+        ey = rng.randint(1, height - 2)
+        if grid[ey][ex] == FLOOR and (ex, ey) not in taken:
+            enemy2 = (ex, ey)
+            taken.add(enemy2)
+        attempts += 1
+
+    # Place the boss on a boss floor
+    boss_pos = None
+    if is_boss_floor:
+        # Find a room with enough space for 2x2s
+        for room in rooms:
+            rx, ry, rw, rh = room
+            # Check if room is big enough for boss (needs 2x2 space)
+            if rw >= 2 and rh >= 2:
+                # Try to place boss in center of room
+                boss_x = rx + (rw //2 - 1)  # Center, but ensure 2x2 fits
+                boss_y = ry + (rh // 2) - 1
+                
+                # Check if 2x2 area is all floor tiles
+                can_place = True
+                for dx in range(2):
+                    for dy in range(2):
+                        nx, ny = boss_x + dx, boss_y + dy
+                        if (nx < 0 or nx >= width or ny < 0 or ny >= height or
+                            grid[ny][nx] != FLOOR or
+                            (nx, ny) in taken):
+                            can_place = False
+                            break
+                    if not can_place:
+                        break
+                
+                if can_place:
+                    boss_pos = (boss_x, boss_y)
+                    break
+        
+        # If no suitable room found, try placing in any available space
+        if boss_pos is None:
+            boss_pos = find_free_2x2(grid, taken)
+
+    return grid, player_start, stairs_up_pos, stairs_down_pos, enemies, enemy2, boss_pos
+
+def can_move(grid, x, y, enemies=None, enemy2=None):
+    if 0 <= x < len(grid[0]) and 0 <= y < len(grid):
+        if grid[y][x] == WALL:
+            return False
+        # Removed enemy collision - player can now pass through enemies
+        return True
+    return False
+
+def calculate_damage(min_damage, max_damage, is_defending=False, rng=random, defend_divisor=DEFEND_DIVISOR):
+    base_damage = rng.randint(min_damage, max_damage)
+    if is_defending:
+        base_damage = max(1, base_damage // defend_divisor)  # Defending reduces damage
+    return base_damage
+
+class CombatResolver:
+    # The combat rules, driven by a COMBATANTS-style table. GameState resolves
+    # every roll of a fight through one of these; balance.py simulates the same
+    # table in bulk. A fight goes: the player attacks, defends or tries to flee,
+    # then the enemy attacks if it still stands, then outcome() decides.
+    def __init__(self, combatants=COMBATANTS, flee_chance=FLEE_CHANCE, defend_divisor=DEFEND_DIVISOR):
+        self.combatants = combatants
+        self.flee_chance = flee_chance
+        self.defend_divisor = defend_divisor
+
+    def scaled(self, factor):
+        # The same rules with every enemy's HP and attack multiplied by factor,
+        # for deeper floors of an endless game. The player stays as is.
+        combatants = {name: stats if name == "player" else tuple(max(1, round(value * factor)) for value in stats)
+                      for name, stats in self.combatants.items()}
+        return type(self)(combatants, self.flee_chance, self.defend_divisor)
+
+    def max_hp(self, fighter):
+        return self.combatants[fighter][0]
+
+    def attack(self, attacker, rng, defending=False):
+        # Damage one attack by attacker deals, defending is the target's stance
+        _, min_damage, max_damage = self.combatants[attacker]
+        return calculate_damage(min_damage, max_damage, defending, rng, self.defend_divisor)
+
+    def flee(self, rng):
+        return rng.random() < self.flee_chance
+
+    def outcome(self, player_hp, enemy_hp):
+        # After the enemy's half of a round, None while the fight goes on
+        if enemy_hp <= 0:
+            return "victory"
+        if player_hp <= 0:
+            return "defeat"
+        return None
+
+
+def find_adjacent_floor(grid, x, y):
+    # Try to find a neighboring floor tile (up, down, left, right)
+    for dx, dy in [(-1,0), (1,0), (0,-1), (0,1)]:
+        nx, ny = x + dx, y + dy
+        if 0 <= nx < len(grid[0]) and 0 <= ny < len(grid):
+            if grid[ny][nx] == FLOOR:
+                return nx, ny
+    return x, y  # No adjacent floor found, stay in place
+
+class Occupancy:
+    # Who stands where. Enemies, enemy2 and the boss are keyed by position and the
+    # player is kept alongside, so "is anything on this cell" is a dict lookup
+    # instead of a scan over the enemies list. The rest of a bigger entity's
+    # footprint (see ENTITY_SIZES) maps back to its position in covered.
+    def __init__(self, player_pos=None):
+        self.cells = {}
+        self.covered = {}
+        self.player_pos = player_pos
+
+    @classmethod
+    def from_floor(cls, enemies, enemy2, boss_pos, player_pos=None):
+        occupancy = cls(player_pos)
+        for pos in enemies:
+            occupancy.place(pos, "enemy")
+        if enemy2 is not None:
+            occupancy.place(enemy2, "enemy2")
+        if boss_pos is not None:
+            occupancy.place(boss_pos, "boss")
+        return occupancy
+
+    def place(self, pos, kind):
+        self.cells[pos] = kind
+        size = ENTITY_SIZES[kind]
+        for y in range(pos[1], pos[1] + size):
+            for x in range(pos[0], pos[0] + size):
+                if (x, y) != pos:
+                    self.covered[(x, y)] = pos
+
+    def at(self, pos):
+        # "enemy", "enemy2", "boss" or None, by the entity's own position only
+        return self.cells.get(pos)
+
+    def owner(self, pos):
+        # Position of the entity whose footprint includes pos, or None
+        return pos if pos in self.cells else self.covered.get(pos)
+
+    def blocked(self, pos):
+        return pos in self.cells or pos in self.covered or pos == self.player_pos
+
+    def move(self, old_pos, new_pos):
+        kind = self.cells[old_pos]
+        self.remove(old_pos)
+        self.place(new_pos, kind)
+
+    def remove(self, pos):
+        kind = self.cells.pop(pos, None)
+        if kind is None:
+            return
+        size = ENTITY_SIZES[kind]
+        for y in range(pos[1], pos[1] + size):
+            for x in range(pos[0], pos[0] + size):
+                if self.covered.get((x, y)) == pos:
+                    del self.covered[(x, y)]
+
+def walkable_neighbours(grid):
+    # {cell: [walkable neighbour, ...]} for every walkable cell, in STEPS order.
+    # Read straight from the array on the NumPy backend.
+    height, width = len(grid), len(grid[0])
+    if isinstance(grid, ArrayGrid):
+        walkable = set(map(tuple, np.argwhere(grid.walkable().T).tolist()))
+    else:
+        walkable = {(x, y) for y, row in enumerate(grid) for x, cell in enumerate(row) if cell != WALL}
+    return {(x, y): [(x + dx, y + dy) for dx, dy in STEPS if (x + dx, y + dy) in walkable]
+            for (x, y) in walkable}
+
+class DistanceMap:
+    # Steps from the player to every walkable cell within max_distance, by one
+    # breadth-first search. Rebuilt only when the player or the grid changes and
+    # shared by all enemies, so a turn costs one search however many enemies move.
+    # The walkable neighbours of every cell are worked out once per grid.
+    def __init__(self, max_distance=AI_SIGHT):
+        self.max_distance = max_distance
+        self.grid = None
+        self.origin = None
+        self.distances = {}
+        self.neighbours = {}
+
+    def update(self, grid, player_pos):
+        if grid is self.grid and player_pos == self.origin:
+            return
+        if grid is not self.grid:
+            self.neighbours = walkable_neighbours(grid)
+        self.grid = grid
+        self.origin = player_pos
+        neighbours = self.neighbours
+        distances = {player_pos: 0}
+        frontier = [player_pos]
+        for distance in range(1, self.max_distance + 1):
+            next_frontier = []
+            for cell in frontier:
+                for step in neighbours.get(cell, ()):
+                    if step not in distances:
+                        distances[step] = distance
+                        next_frontier.append(step)
+            if not next_frontier:
+                break
+            frontier = next_frontier
+        self.distances = distances
+
+    def get(self, pos):
+        # None for cells out of sight or unreachable
+        return self.distances.get(pos)
+
+def choose_step(grid, distances, occupancy, pos, behavior, size=1, rng=random):
+    # Next position of the entity at pos. Cells under the whole size x size footprint
+    # must be free floor, except that a chaser may step onto the player to attack.
+    height, width = len(grid), len(grid[0])
+    player_pos = occupancy.player_pos
+    moves = []
+    for dx, dy in STEPS:
+        nx, ny = pos[0] + dx, pos[1] + dy
+        if not (0 <= nx and nx + size <= width and 0 <= ny and ny + size <= height):
+            continue
+        free = True
+        for cy in range(ny, ny + size):
+            for cx in range(nx, nx + size):
+                cell = (cx, cy)
+                if occupancy.owner(cell) == pos:
+                    continue  # Its own footprint
+                if cell == player_pos == (nx, ny) and behavior == "chase":
+                    free = free and occupancy.owner(cell) is None
+                elif grid[cy][cx] != FLOOR or occupancy.blocked(cell):
+                    free = False
+        if free:
+            moves.append((nx, ny))
+    if not moves:
+        return pos
+    here = distances.get(pos)
+    if behavior == "wander" or here is None:
+        return rng.choice(moves)
+    if behavior == "chase" and player_pos in moves:
+        return player_pos
+    scored = [(distances.get(move), move) for move in moves if distances.get(move) is not None]
+    if behavior == "chase":
+        best = min((d for d, _ in scored), default=None)
+        better = [move for d, move in scored if d == best and d < here]
+    else:
+        best = max((d for d, _ in scored), default=None)
+        better = [move for d, move in scored if d == best and d > here]
+    return rng.choice(better) if better else pos
+
+def move_enemies(grid, enemies, enemy2, player_pos, occupancy=None, boss_pos=None, distance_map=None, behaviors=ENEMY_BEHAVIORS, rng=random):
+    # Each enemy takes one step according to its behavior, reading the shared
+    # distance map. occupancy is updated as enemies move, so two enemies never
+    # end up on the same cell. Returns the new (enemies, enemy2, boss_pos).
+    if occupancy is None:
+        occupancy = Occupancy.from_floor(enemies, enemy2, boss_pos, player_pos)
+    if distance_map is None:
+        distance_map = DistanceMap()
+    distance_map.update(grid, player_pos)
+    new_enemies = []
+    for pos in enemies:
+        new_pos = choose_step(grid, distance_map, occupancy, pos, behaviors["enemy"], rng=rng)
+        if new_pos != pos:
+            occupancy.move(pos, new_pos)
+        new_enemies.append(new_pos)
+    new_enemy2 = enemy2
+    if enemy2:
+        new_enemy2 = choose_step(grid, distance_map, occupancy, enemy2, behaviors["enemy2"], rng=rng)
+        if new_enemy2 != enemy2:
+            occupancy.move(enemy2, new_enemy2)
+    new_boss_pos = boss_pos
+    if boss_pos:
+        new_boss_pos = choose_step(grid, distance_map, occupancy, boss_pos, behaviors["boss"], ENTITY_SIZES["boss"], rng)
+        if new_boss_pos != boss_pos:
+            occupancy.move(boss_pos, new_boss_pos)
+    return new_enemies, new_enemy2, new_boss_pos
+
+# Quadrant transforms for shadowcasting, (row, col) -> map offset
+# (row * rx + col * cx, row * ry + col * cy) as (rx, ry, cx, cy)
+FOV_QUADRANTS = (
+    (0, -1, 1, 0),  # north
+    (0, 1, 1, 0),   # south
+    (1, 0, 0, 1),   # east
+    (-1, 0, 0, 1),  # west
+)
+
+def compute_fov(grid, origin, radius=FOV_RADIUS):
+    # Symmetric shadowcasting (Albert Ford's formulation): returns the set of cells
+    # visible from origin within radius. Slopes are kept as integer (num, den)
+    # pairs instead of Fractions, the rounding rules are the same.
+    height, width = len(grid), len(grid[0])
+    ox, oy = origin
+    visible = {origin}
+    radius_squared = radius * radius
+    for rx, ry, cx, cy in FOV_QUADRANTS:
+        # Rows still to scan: (depth, start slope, end slope)
+        rows = [(1, (-1, 1), (1, 1))]
+        while rows:
+            depth, start, end = rows.pop()
+            if depth > radius:
+                continue
+            # Columns between the slopes, rounding ties towards the centre line, and
+            # inside the sight circle. Cells outside it only shape shadows further out.
+            bound = isqrt(radius_squared - depth * depth)
+            min_col = max((2 * depth * start[0] + start[1]) // (2 * start[1]), -bound)
+            max_col = min(-((end[1] - 2 * depth * end[0]) // (2 * end[1])), bound)
+            prev_wall = None
+            row_x, row_y = ox + depth * rx, oy + depth * ry
+            for col in range(min_col, max_col + 1):
+                x, y = row_x + col * cx, row_y + col * cy
+                inside = 0 <= x < width and 0 <= y < height
+                wall = not inside or grid[y][x] == WALL
+                # Walls are always shown, floors only when symmetric (centre within the slopes)
+                if inside and (wall or (col * start[1] >= depth * start[0] and col * end[1] <= depth * end[0])):
+                    visible.add((x, y))
+                if prev_wall and not wall:
+                    start = (2 * col - 1, 2 * depth)
+                if prev_wall is False and wall:
+                    rows.append((depth + 1, start, (2 * col - 1, 2 * depth)))
+                prev_wall = wall
+            if prev_wall is False:
+                rows.append((depth + 1, start, end))
+    return visible
+
+class FloorCache:
+    # Generated floors keyed by (seed, floor, place_up_stairs, place_down_stairs).
+    # Each entry keeps the grid plus the live entity state and the floor's explored
+    # bitmap, so revisiting a floor is a dict lookup, enemies killed there stay
+    # dead and the map is remembered.
+    # With pregenerate, prefetch() queues floors for a worker thread that builds
+    # them ahead of time and hands them back through a queue, get() then finds
+    # them ready instead of running create_dungeon on the caller's thread.
+    def __init__(self, max_floors=FLOOR_CACHE_SIZE, width=GRID_WIDTH, height=GRID_HEIGHT, backend=None, pregenerate=False,
+                 endless=False, generator="classic"):
+        self.max_floors = max_floors
+        self.width = width
+        self.height = height
+        self.backend = backend
+        self.pregenerate = pregenerate
+        self.endless = endless
+        self.generator = generator
+        self.floors = OrderedDict()
+        self.deltas = {}     # Saved entity state and explored bitmap of floors not rebuilt yet
+        self.jobs = None     # Keys for the worker, None stops it
+        self.ready = None    # (key, entry) built by the worker
+        self.pending = set()
+        self.hits = 0
+        self.misses = 0
+        self.prefetched = 0
+
+    def generate(self, seed, floor, place_up_stairs, place_down_stairs):
+        entry = create_dungeon(seed, floor, place_up_stairs, place_down_stairs,
+                               width=self.width, height=self.height, backend=self.backend, endless=self.endless,
+                               generator=self.generator)
+        return entry + (bytearray(self.width * self.height),)
+
+    def add(self, key, entry):
+        delta = self.deltas.pop(key, None)
+        if delta is not None:
+            # A floor restored from a save: the layout is regenerated, what changed on it is not
+            enemies, enemy2, boss_pos, explored = delta
+            entry = entry[:4] + (list(enemies), enemy2, boss_pos, bytearray(explored))
+        self.floors[key] = entry
+        while len(self.floors) > self.max_floors:
+            self.floors.popitem(last=False)
+        return entry
+
+    def prefetch(self, seed, floor, place_up_stairs=True, place_down_stairs=True):
+        if not self.pregenerate:
+            return
+        key = (seed, floor, place_up_stairs, place_down_stairs)
+        if key in self.floors or key in self.pending:
+            return
+        if self.jobs is None:
+            self.jobs = queue.Queue()
+            self.ready = queue.Queue()
+            threading.Thread(target=self.generate_ahead, daemon=True).start()
+        self.pending.add(key)
+        self.jobs.put(key)
+
+    def generate_ahead(self):
+        # Worker thread. Floors have their own RNG streams, so building them here
+        # gives the same layouts as building them on the main thread.
+        while True:
+            key = self.jobs.get()
+            if key is None:
+                return
+            self.ready.put((key, self.generate(*key)))
+
+    def collect(self, wait_for=None):
+        # Move finished floors into the cache, blocking only if wait_for is still being built
+        while self.pending:
+            try:
+                key, entry = self.ready.get(block=wait_for in self.pending)
+            except queue.Empty:
+                return
+            self.pending.discard(key)
+            self.prefetched += 1
+            # A floor the player already changed stays as it is
+            if key not in self.floors:
+                self.add(key, entry)
+
+    def get(self, seed, floor, place_up_stairs=True, place_down_stairs=True):
+        key = (seed, floor, place_up_stairs, place_down_stairs)
+        self.collect(key)
+        entry = self.floors.get(key)
+        if entry is not None:
+            self.hits += 1
+            self.floors.move_to_end(key)
+        else:
+            self.misses += 1
+            entry = self.add(key, self.generate(*key))
+        logger.debug("floor cache %s", self.stats())
+        grid, player_start, stairs_up_pos, stairs_down_pos, enemies, enemy2, boss_pos, explored = entry
+        # explored (one byte per cell, row-major) is shared with the cache and updated in place
+        return grid, player_start, stairs_up_pos, stairs_down_pos, list(enemies), enemy2, boss_pos, explored
+
+    def store(self, seed, floor, place_up_stairs, place_down_stairs, enemies, enemy2, boss_pos):
+        # Remember where the surviving entities were when the player left the floor
+        key = (seed, floor, place_up_stairs, place_down_stairs)
+        entry = self.floors.get(key)
+        if entry is not None:
+            grid, player_start, stairs_up_pos, stairs_down_pos = entry[:4]
+            self.floors[key] = (grid, player_start, stairs_up_pos, stairs_down_pos, list(enemies), enemy2, boss_pos, entry[7])
+
+    def evict_beyond(self, floor, window):
+        # Drop floors more than window floors from floor, with whatever changed on
+        # them. An endless game only keeps the floors around the player; going back
+        # to one further away rebuilds it from (seed, floor) as it was first generated.
+        for floors in (self.floors, self.deltas):
+            for key in [key for key in floors if abs(key[1] - floor) > window]:
+                del floors[key]
+
+    def clear(self):
+        self.floors.clear()
+        self.deltas.clear()
+
+    def changed_floors(self):
+        # (key, enemies, enemy2, boss_pos, explored) of every floor the player has
+        # seen, the only ones a save needs beyond the seed
+        for key, entry in self.floors.items():
+            if any(entry[7]):
+                yield (key,) + entry[4:]
+        for key, delta in self.deltas.items():
+            yield (key,) + delta
+
+    def close(self):
+        if self.jobs is not None:
+            self.jobs.put(None)
+            self.jobs = None
+
+    def stats(self):
+        return f"hits={self.hits} misses={self.misses} prefetched={self.prefetched} size={len(self.floors)}/{self.max_floors}"
+
+class GameState:
+    # Everything main() used to keep in locals. apply() handles one player action,
+    # tick() advances one tick of game time, and sound cues land in self.events.
+    def __init__(self, seed=42, floor_cache_size=FLOOR_CACHE_SIZE, width=GRID_WIDTH, height=GRID_HEIGHT, backend=None, pregenerate=False,
+                 start=True, combat=None, endless=False, generator="classic"):
+        # start=False leaves the state empty for resume(), combat is a CombatResolver.
+        # endless games go down forever instead of ending on LAST_FLOOR, generator
+        # picks how floors are laid out (see GENERATORS) and goes with the seed.
+        self.combat = combat or CombatResolver()
+        self.endless = endless
+        self.generator = generator
+        self.floor_cache = FloorCache(floor_cache_size, width, height, backend, pregenerate, endless, generator)
+        self.distance_map = DistanceMap()
+        self.visible = set()
+        self.fov_key = None
+        self.explored_version = 0  # Bumped whenever new cells get explored
+        self.events = []
+        self.seed = seed
+        self.rng_epoch = 0  # See seed_streams()
+        self.tick_count = 0  # Ticks run by this GameState, replays count in these
+        if start:
+            self.new_game()
+
+    def new_game(self, seed=None):
+        if seed is not None:
+            self.seed = seed
+        self.floor = 1
+        self.place_up_stairs = True
+        self.seed_streams(0)
+        self.floor_cache.clear()
+        self.player_x, self.player_y = self.enter_floor()
+        self.occupancy = Occupancy.from_floor(self.enemies, self.enemy2, self.boss_pos, (self.player_x, self.player_y))
+        self.prefetch_neighbours()
+        self.player_hp = self.combat.max_hp("player")
+        self.player_max_hp = self.player_hp
+        self.enemy_hp = 0
+        self.enemy_max_hp = 0
+        self.enemy_move_counter = 0
+        self.enemy_turn_delay = 0  # Counter for enemy turn delay
+        self.game_over = False
+        self.game_won = False
+        self.end_combat()
+
+    def seed_streams(self, epoch):
+        # Enemy AI and combat rolls draw from their own streams, so neither depends
+        # on how many numbers the other (or floor generation) used. Random states
+        # are not saved, a resumed game moves on to the streams of a new epoch.
+        self.rng_epoch = epoch
+        suffix = f":{epoch}" if epoch else ""
+        self.ai_rng = subsystem_rng(self.seed, "ai" + suffix)
+        self.combat_rng = subsystem_rng(self.seed, "combat" + suffix)
+
+    def resume(self, seed, floor, place_up_stairs, player_pos, player_hp, enemy_move_counter, rng_epoch, floors):
+        # Restore a saved game. floors holds (key, enemies, enemy2, boss_pos, explored)
+        # per changed floor. Only the current floor is regenerated now, the others
+        # pick up their saved state when the cache builds them.
+        self.seed = seed
+        self.floor = floor
+        self.place_up_stairs = place_up_stairs
+        self.seed_streams(rng_epoch)
+        self.floor_cache.clear()
+        for key, enemies, enemy2, boss_pos, explored in floors:
+            self.floor_cache.deltas[key] = (enemies, enemy2, boss_pos, explored)
+        self.enter_floor()
+        self.player_x, self.player_y = player_pos
+        self.occupancy = Occupancy.from_floor(self.enemies, self.enemy2, self.boss_pos, player_pos)
+        self.prefetch_neighbours()
+        self.player_hp = player_hp
+        self.player_max_hp = self.combat.max_hp("player")
+        self.enemy_hp = 0
+        self.enemy_max_hp = 0
+        self.enemy_move_counter = enemy_move_counter
+        self.enemy_turn_delay = 0
+        self.game_over = False
+        self.game_won = False
+        self.end_combat()
+
+    def changed_floors(self):
+        # What a save needs per floor, with the live entities of the current one
+        current = (self.seed, self.floor, self.place_up_stairs, True)
+        yield current, list(self.enemies), self.enemy2, self.boss_pos, self.explored
+        for floor in self.floor_cache.changed_floors():
+            if floor[0] != current:
+                yield floor
+
+    def end_combat(self):
+        self.in_combat = False
+        self.combat_enemy_type = None
+        self.combat_enemy_pos = None
+        self.combat_state = "player_turn"  # player_turn, enemy_turn, victory, defeat, fled
+        self.damage_dealt = None
+        self.player_defending = False
+
+    def remove_combat_enemy(self):
+        if self.combat_enemy_type == "enemy":
+            if self.occupancy.at(self.combat_enemy_pos) == "enemy":
+                self.enemies.remove(self.combat_enemy_pos)
+                self.occupancy.remove(self.combat_enemy_pos)
+        elif self.combat_enemy_type == "enemy2":
+            self.occupancy.remove(self.enemy2)
+            self.enemy2 = None
+
+    def set_player_pos(self, x, y):
+        self.player_x, self.player_y = x, y
+        self.occupancy.player_pos = (x, y)
+
+    def change_floor(self, floor, place_up_stairs):
+        # Stash the surviving entities of the floor being left, then fetch the new one
+        self.floor_cache.store(self.seed, self.floor, self.place_up_stairs, True, self.enemies, self.enemy2, self.boss_pos)
+        self.floor = floor
+        self.place_up_stairs = place_up_stairs
+        self.enter_floor()
+        self.occupancy = Occupancy.from_floor(self.enemies, self.enemy2, self.boss_pos)
+        self.prefetch_neighbours()
+
+    def enter_floor(self):
+        # Fetch self.floor from the cache and set up its fights, returns where a new game starts on it
+        (self.grid, player_start, self.stairs_up_pos, self.stairs_down_pos,
+         self.enemies, self.enemy2, self.boss_pos, self.explored) = self.floor_cache.get(self.seed, self.floor, self.place_up_stairs, True)
+        stat_scale = floor_plan(self.floor, self.endless, self.floor_cache.width, self.floor_cache.height)[2]
+        self.floor_combat = self.combat if stat_scale == 1 else self.combat.scaled(stat_scale)
+        if self.endless:
+            self.floor_cache.evict_beyond(self.floor, ENDLESS_WINDOW)
+        return player_start
+
+    def prefetch_neighbours(self):
+        # Floors one step down and up, with the stairs change_floor will ask for
+        self.floor_cache.prefetch(self.seed, self.floor + 1, True)
+        if self.floor > 1:
+            self.floor_cache.prefetch(self.seed, self.floor - 1, True)
+
+    def apply(self, action):
+        if self.game_won or self.game_over:
+            if action == "restart":
+                self.new_game()
+        elif self.in_combat:
+            if self.combat_state == "player_turn":
+                if action == "attack":
+                    self.events.append("attack")
+                    damage = self.floor_combat.attack("player", self.combat_rng)
+                    self.enemy_hp -= damage
+                    self.damage_dealt = damage
+                    self.combat_state = "enemy_turn"
+                    self.player_defending = False
+                    self.enemy_turn_delay = ENEMY_TURN_DELAY
+                elif action == "defend":
+                    self.player_defending = True
+                    self.combat_state = "enemy_turn"
+                    self.enemy_turn_delay = ENEMY_TURN_DELAY
+                elif action == "flee":
+                    if self.floor_combat.flee(self.combat_rng):
+                        self.combat_state = "fled"
+                        for dx, dy in [(-1,0), (1,0), (0,-1), (0,1)]:
+                            nx, ny = self.player_x + dx, self.player_y + dy
+                            if (0 <= nx < len(self.grid[0]) and 0 <= ny < len(self.grid) and
+                                self.grid[ny][nx] == FLOOR and
+                                self.occupancy.at((nx, ny)) is None):
+                                self.set_player_pos(nx, ny)
+                                break
+                    else:
+                        self.combat_state = "enemy_turn"
+                        self.enemy_turn_delay = ENEMY_TURN_DELAY
+            elif action is not None:
+                # Any key skips the enemy turn delay or closes the combat popup
+                if self.combat_state == "enemy_turn":
+                    self.enemy_turn()
+                else:
+                    # Combat ended, return to game
+                    if self.combat_state == "victory":
+                        # Check if boss was defeated
+                        if self.combat_enemy_type == "boss" and not self.endless:
+                            self.game_won = True
+                        elif self.combat_enemy_type == "boss":
+                            # An endless run goes on past its bosses
+                            self.occupancy.remove(self.boss_pos)
+                            self.boss_pos = None
+                        else:
+                            # Remove defeated enemy
+                            self.remove_combat_enemy()
+                    elif self.combat_state == "defeat":
+                        # Game over when player is defeated
+                        self.game_over = True
+                        self.remove_combat_enemy()
+                    self.end_combat()
+        elif action in MOVES:
+            dx, dy = MOVES[action]
+            if can_move(self.grid, self.player_x + dx, self.player_y + dy, self.enemies, self.enemy2):
+                self.set_player_pos(self.player_x + dx, self.player_y + dy)
+
+    def enemy_turn(self):
+        # Enemy attacks
+        if self.enemy_hp > 0:
+            damage = self.floor_combat.attack(self.combat_enemy_type, self.combat_rng, self.player_defending)
+            self.player_hp -= damage
+            self.damage_dealt = damage
+            self.events.append("enemy_attack")
+
+        # Check combat result
+        outcome = self.floor_combat.outcome(self.player_hp, self.enemy_hp)
+        if outcome == "victory":
+            self.combat_state = "victory"
+        elif outcome == "defeat":
+            # Go straight to game over, skip defeat message
+            self.game_over = True
+            self.remove_combat_enemy()
+            self.end_combat()
+        else:
+            self.combat_state = "player_turn"
+
+    def start_combat(self, enemy_type, enemy_pos):
+        self.in_combat = True
+        self.combat_enemy_type = enemy_type
+        self.combat_enemy_pos = enemy_pos
+        self.enemy_hp = self.floor_combat.max_hp(enemy_type)
+        self.enemy_max_hp = self.enemy_hp
+        self.combat_state = "player_turn"
+
+    def tick(self, profiler=None):
+        # profiler (a profiler.FrameProfiler) optionally times the combat, stairs and enemy phases
+        timed = profiler.phase if profiler is not None else nullcontext
+        self.tick_count += 1
+        if self.game_over or self.game_won:
+            return  # Nothing moves behind the end screen until a restart
+        with timed("combat"):
+            # Handle automatic enemy turn
+            if self.in_combat and self.combat_state == "enemy_turn":
+                if self.enemy_turn_delay > 0:
+                    self.enemy_turn_delay -= 1
+                else:
+                    self.enemy_turn()
+
+        with timed("stairs"):
+            # Handle stairs and move off stairs if needed
+            transitioned = False
+            if not self.in_combat:
+                if (self.player_x, self.player_y) == self.stairs_down_pos:
+                    self.change_floor(self.floor + 1, True)
+                    self.set_player_pos(*(self.stairs_up_pos if self.stairs_up_pos else (1, 1)))
+                    transitioned = True
+                elif (self.player_x, self.player_y) == self.stairs_up_pos and self.floor > 1:
+                    # Every floor is built with up stairs, floor 1 included, as new_game()
+                    # builds it. A different key would miss the cached floor 1 and undo it.
+                    self.change_floor(self.floor - 1, True)
+                    self.set_player_pos(*(self.stairs_down_pos if self.stairs_down_pos else (1, 1)))
+                    transitioned = True
+            # Move off stairs if needed
+            if transitioned and self.grid[self.player_y][self.player_x] in (STAIRS_UP, STAIRS_DOWN):
+                self.set_player_pos(*find_adjacent_floor(self.grid, self.player_x, self.player_y))
+
+        with timed("combat"):
+            # Check for combat
+            if not self.in_combat:
+                player_pos = (self.player_x, self.player_y)
+                occupant = self.occupancy.at(player_pos)
+                if occupant == "enemy":
+                    self.start_combat("enemy", player_pos)
+                elif occupant == "enemy2":
+                    self.start_combat("enemy2", player_pos)
+                # Boss combat
+                elif occupant == "boss":
+                    self.start_combat("boss", self.boss_pos)
+
+        with timed("enemies"):
+            # Move enemies every ENEMY_MOVE_DELAY ticks
+            if not self.in_combat:
+                self.enemy_move_counter += 1
+                if self.enemy_move_counter >= ENEMY_MOVE_DELAY:
+                    self.enemies, self.enemy2, self.boss_pos = move_enemies(self.grid, self.enemies, self.enemy2, (self.player_x, self.player_y), self.occupancy,
+                                                                            self.boss_pos, self.distance_map, rng=self.ai_rng)
+                    self.enemy_move_counter = 0
+
+    def update_fov(self):
+        # Recompute what the player sees, only when the player or the grid changed.
+        # Returns the cells explored for the first time.
+        player_pos = (self.player_x, self.player_y)
+        if self.fov_key is not None and self.fov_key[0] is self.grid and self.fov_key[1] == player_pos:
+            return []
+        self.fov_key = (self.grid, player_pos)
+        self.visible = compute_fov(self.grid, player_pos)
+        width = len(self.grid[0])
+        explored = self.explored
+        revealed = [(x, y) for (x, y) in self.visible if not explored[y * width + x]]
+        for x, y in revealed:
+            explored[y * width + x] = 1
+        if revealed:
+            self.explored_version += 1
+        return revealed
+
+    def ticks_until_change(self):
+        # Ticks until tick() next changes the state without any input, None when
+        # it is waiting for the player. Lets a front-end sleep while nothing happens.
+        if self.game_over or self.game_won:
+            return None
+        if self.in_combat:
+            if self.combat_state == "enemy_turn":
+                return self.enemy_turn_delay + 1
+            return None
+        player_pos = (self.player_x, self.player_y)
+        # A move onto stairs or an enemy is resolved by the next tick
+        if player_pos == self.stairs_down_pos or (player_pos == self.stairs_up_pos and self.floor > 1) or self.occupancy.at(player_pos):
+            return 1
+        return ENEMY_MOVE_DELAY - self.enemy_move_counter
+
+    def skip_ticks(self, count):
+        # The same as count calls to tick() when nothing changes in them, that is
+        # while count is below ticks_until_change() (or it is None): only the
+        # counters move. Lets a server advance idle sessions lazily.
+        self.tick_count += count
+        if self.game_over or self.game_won:
+            return
+        if self.in_combat:
+            if self.combat_state == "enemy_turn":
+                self.enemy_turn_delay -= count
+        else:
+            self.enemy_move_counter += count
+
+    def step(self, action=None):
+        # One frame: the player's action (if any) followed by a tick. Returns the sound cues.
+        self.events = []
+        if action is not None:
+            self.apply(action)
+        self.tick()
+        return self.events
+
+
+def route_to(grid, goal, blocked=()):
+    # Breadth-first search outwards from goal. Maps every reachable cell to its next
+    # cell on a shortest walkable path to goal, avoiding the blocked cells.
+    height, width = len(grid), len(grid[0])
+    next_cell = {goal: None}
+    frontier = [goal]
+    while frontier:
+        next_frontier = []
+        for (x, y) in frontier:
+            for dx, dy in [(-1,0), (1,0), (0,-1), (0,1)]:
+                nx, ny = x + dx, y + dy
+                if (nx, ny) in next_cell or not (0 <= nx < width and 0 <= ny < height):
+                    continue
+                if grid[ny][nx] == WALL or (nx, ny) in blocked:
+                    continue
+                next_cell[(nx, ny)] = (x, y)
+                next_frontier.append((nx, ny))
+        frontier = next_frontier
+    return next_cell
+
+class DescendPolicy:
+    # Walks to the down stairs (the boss on the last floor), always attacks and
+    # skips every popup. A simple baseline bot for balance runs.
+    def __init__(self):
+        self.route_key = None
+        self.route = {}
+
+    def __call__(self, state, rng):
+        if state.game_over or state.game_won:
+            return None
+        if state.in_combat:
+            return "attack" if state.combat_state == "player_turn" else "continue"
+        goal = state.stairs_down_pos or state.boss_pos
+        if goal is None:
+            return rng.choice(tuple(MOVES))
+        # The route only depends on the floor layout, so search once per floor
+        if self.route_key != (state.grid, goal):
+            # Stepping on the up stairs would undo progress
+            blocked = (state.stairs_up_pos,) if state.stairs_up_pos else ()
+            self.route = route_to(state.grid, goal, blocked)
+            self.route_key = (state.grid, goal)
+        step = self.route.get((state.player_x, state.player_y))
+        if step is None:
+            return rng.choice(tuple(MOVES))
+        move = (step[0] - state.player_x, step[1] - state.player_y)
+        for action, delta in MOVES.items():
+            if delta == move:
+                return action
+        return None
+
+def play_through(seed, policy=None, max_ticks=20000, endless=False, generator="classic"):
+    # Run one seeded game to a win, a loss or the tick limit
+    if policy is None:
+        policy = DescendPolicy()
+    state = GameState(seed, endless=endless, generator=generator)
+    rng = random.Random(seed)
+    ticks = 0
+    while not (state.game_over or state.game_won) and ticks < max_ticks:
+        state.step(policy(state, rng))
+        ticks += 1
+    if state.game_won:
+        result = "won"
+    elif state.game_over:
+        result = "lost"
+    else:
+        result = "timeout"
+    return {
+        "seed": seed,
+        "result": result,
+        "floor": state.floor,
+        "player_hp": state.player_hp,
+        "ticks": ticks,
+    }
+
+def parse_map_size(text):
+    # argparse type for --map-size in main.py and server.py, WIDTHxHEIGHT as (width, height)
+    width, _, height = text.lower().partition("x")
+    try:
+        width, height = int(width), int(height)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected WIDTHxHEIGHT, got {text!r}")
+    if width < MIN_MAP_SIZE or height < MIN_MAP_SIZE:
+        # create_dungeon can't lay its rooms out on anything smaller
+        raise argparse.ArgumentTypeError(f"map size must be at least {MIN_MAP_SIZE}x{MIN_MAP_SIZE}, got {text}")
+    return width, height
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run seeded headless play-throughs")
+    parser.add_argument("--start-seed", type=int, default=0)
+    parser.add_argument("--runs", type=int, default=1000)
+    parser.add_argument("--max-ticks", type=int, default=20000)
+    parser.add_argument("--endless", action="store_true", help="play endless games, which only end in a loss or at the tick limit")
+    parser.add_argument("--generator", choices=list(GENERATORS), default="classic", help="dungeon layout generator")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    results = Counter()
+    floors = Counter()
+    for seed in range(args.start_seed, args.start_seed + args.runs):
+        outcome = play_through(seed, max_ticks=args.max_ticks, endless=args.endless, generator=args.generator)
+        results[outcome["result"]] += 1
+        floors[outcome["floor"]] += 1
+    elapsed = time.perf_counter() - start
+
+    print(f"{args.runs} play-throughs in {elapsed:.2f}s ({args.runs / elapsed * 60:.0f}/min)")
+    for result in ("won", "lost", "timeout"):
+        print(f"  {result}: {results[result]}")
+    for floor in sorted(floors):
+        print(f"  ended on floor {floor}: {floors[floor]}")
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,54 @@
+# Time compute_fov against the sight radius on large generated maps, to keep the
+# field of view off the hot path as radius and map size grow.
+#
+#   python fovbench.py --size 500x500 --radius 4 8 16 32 64
+import sys
+import time
+import random
+import argparse
+
+import engine
+from engine import WALL, create_dungeon, compute_fov
+
+def parse_size(text):
+    width, _, height = text.lower().partition("x")
+    return int(width), int(height)
+
+def sample_origins(grid, count, rng):
+    # Random walkable cells, the places a player can actually stand
+    height, width = len(grid), len(grid[0])
+    origins = []
+    while len(origins) < count:
+        x, y = rng.randrange(width), rng.randrange(height)
+        if grid[y][x] != WALL:
+            origins.append((x, y))
+    return origins
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark compute_fov against the sight radius")
+    parser.add_argument("--size", type=parse_size, nargs="+", default=[(100, 100), (500, 500)], help="map sizes as WIDTHxHEIGHT")
+    parser.add_argument("--radius", type=int, nargs="+", default=[4, 8, 16, 32, 64])
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--samples", type=int, default=200, help="player positions timed per radius")
+    args = parser.parse_args(argv)
+
+    backend = "array" if engine.np is not None else "list"
+    print("size,radius,mean_us,p95_us,max_us,visible_cells")
+    for width, height in args.size:
+        grid = create_dungeon(args.seed, 1, width=width, height=height, backend=backend)[0]
+        origins = sample_origins(grid, args.samples, random.Random(args.seed))
+        for radius in args.radius:
+            timings = []
+            visible = 0
+            for origin in origins:
+                start = time.perf_counter_ns()
+                cells = compute_fov(grid, origin, radius)
+                timings.append(time.perf_counter_ns() - start)
+                visible += len(cells)
+            timings.sort()
+            mean = sum(timings) / len(timings) / 1000
+            p95 = timings[int(0.95 * (len(timings) - 1))] / 1000
+            print(f"{width}x{height},{radius},{mean:.1f},{p95:.1f},{timings[-1] / 1000:.1f},{visible / len(origins):.0f}")
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
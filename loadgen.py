@@ -0,0 +1,140 @@
+# Load generator for server.py: opens many sessions, each playing like a
+# keyboard player (a key press every few hundred ms, attacking in fights and
+# restarting on game over), and reports throughput and input-to-update latency.
+# Run it next to `python server.py`, whose own stats show the tick cost.
+#
+#   python loadgen.py --connect 127.0.0.1:7777 --sessions 2000 --seconds 30
+import sys
+import time
+import random
+import socket
+import asyncio
+import argparse
+
+import protocol
+from engine import MOVES
+
+ACTIONS_PER_SECOND = 3  # Per session, a brisk human
+CONNECT_BATCH = 200  # Connections opened at a time while ramping up
+SLOT_SECONDS = 0.01  # Sessions are split over slots of this length, each acting in its own
+
+class LoadClient(asyncio.Protocol):
+    def __init__(self, stats):
+        self.stats = stats
+        self.mirror = protocol.StateMirror()
+        self.transport = None
+        self.sent_at = None  # When the last action went out, cleared by the next update
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def data_received(self, data):
+        self.stats.bytes_in += len(data)
+        before = self.mirror.messages
+        self.mirror.feed(data)
+        self.stats.messages_in += self.mirror.messages - before
+        if self.sent_at is not None and self.mirror.messages > before:
+            self.stats.latencies.append(time.perf_counter() - self.sent_at)
+            self.sent_at = None
+
+    def connection_lost(self, exc):
+        self.stats.disconnected += 1
+        self.transport = None
+
+    def next_action(self, rng):
+        mirror = self.mirror
+        if mirror.grid is None:
+            return None
+        if mirror.game_over or mirror.game_won:
+            return "restart"
+        if mirror.in_combat:
+            if mirror.combat_state == "player_turn":
+                return "attack" if rng.random() < 0.8 else rng.choice(("defend", "flee"))
+            return "continue"
+        return rng.choice(tuple(MOVES))
+
+    def act(self, rng):
+        action = self.next_action(rng)
+        if action is not None and self.transport is not None:
+            self.transport.write(protocol.action_message(action))
+            self.stats.actions += 1
+            if self.sent_at is None:
+                self.sent_at = time.perf_counter()
+
+class Stats:
+    def __init__(self):
+        self.bytes_in = 0
+        self.messages_in = 0
+        self.actions = 0
+        self.disconnected = 0
+        self.latencies = []
+
+async def connect(address, stats):
+    loop = asyncio.get_running_loop()
+    family, target = protocol.parse_address(address)
+    if family == socket.AF_UNIX:
+        _, client = await loop.create_unix_connection(lambda: LoadClient(stats), target)
+    else:
+        _, client = await loop.create_connection(lambda: LoadClient(stats), *target)
+    return client
+
+async def run(args):
+    stats = Stats()
+    clients = []
+    start = time.perf_counter()
+    for first in range(0, args.sessions, CONNECT_BATCH):
+        batch = range(first, min(first + CONNECT_BATCH, args.sessions))
+        clients += await asyncio.gather(*(connect(args.connect, stats) for _ in batch))
+    for seed, client in enumerate(clients, args.seed):
+        client.transport.write(protocol.join_message(seed))
+    print(f"{len(clients)} sessions connected in {time.perf_counter() - start:.1f}s", flush=True)
+
+    # Each session acts once per interval, in the slot its index falls in
+    rng = random.Random(args.seed)
+    slots = max(1, round(1 / args.actions_per_second / SLOT_SECONDS))
+    start = time.perf_counter()
+    report_at = start + args.report_seconds
+    since = snapshot(stats)
+    slot = 0
+    while time.perf_counter() - start < args.seconds:
+        for client in clients[slot::slots]:
+            client.act(rng)
+        slot = (slot + 1) % slots
+        now = time.perf_counter()
+        if now >= report_at:
+            report(stats, since, now - report_at + args.report_seconds, len(clients))
+            since = snapshot(stats)
+            report_at = now + args.report_seconds
+        await asyncio.sleep(SLOT_SECONDS)
+    print("total:", flush=True)
+    report(stats, (0, 0, 0, 0), time.perf_counter() - start, len(clients))
+    for client in clients:
+        if client.transport is not None:
+            client.transport.close()
+
+def snapshot(stats):
+    return stats.actions, stats.messages_in, stats.bytes_in, len(stats.latencies)
+
+def report(stats, since, seconds, sessions):
+    # Rates since the snapshot since, latency from an action to the next update it gets back
+    actions, messages_in, bytes_in, latency_count = since
+    latencies = sorted(stats.latencies[latency_count:])
+    pick = lambda fraction: latencies[min(len(latencies) - 1, int(fraction * len(latencies)))] * 1000 if latencies else float("nan")
+    print(f"sessions={sessions - stats.disconnected} actions/s={(stats.actions - actions) / seconds:.0f} "
+          f"updates/s={(stats.messages_in - messages_in) / seconds:.0f} "
+          f"in_kB/s={(stats.bytes_in - bytes_in) / seconds / 1024:.1f} "
+          f"latency_ms p50={pick(0.5):.1f} p95={pick(0.95):.1f} p99={pick(0.99):.1f}", flush=True)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Drive server.py with many simulated players")
+    parser.add_argument("--connect", default="127.0.0.1:7777", help="HOST:PORT, or unix:PATH for a UNIX socket")
+    parser.add_argument("--sessions", type=int, default=1000)
+    parser.add_argument("--seconds", type=float, default=30)
+    parser.add_argument("--actions-per-second", type=float, default=ACTIONS_PER_SECOND, help="per session")
+    parser.add_argument("--report-seconds", type=float, default=5)
+    parser.add_argument("--seed", type=int, default=0, help="game seed of the first session, the rest count up")
+    args = parser.parse_args(argv)
+    asyncio.run(run(args))
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -1,31 +1,35 @@
+from time import perf_counter
+START_TIME = perf_counter()  # Taken before the pygame import, which is part of the cold start
 import pygame
 import sys
-import random
 import os
-
-pygame.init()
-pygame.mixer.init()
-
-# Load and play background music
-pygame.mixer.music.load(os.path.join('sounds', 'background.mp3'))
-pygame.mixer.music.set_volume(0.5)
-pygame.mixer.music.play(-1)  # Loop forever
-
-# Load attack sound
-attack_sound = pygame.mixer.Sound(os.path.join('sounds', 'attack.mp3'))
-attack_sound.set_volume(0.7)
-
-# Load enemy attack sound
-enemy_attack_sound = pygame.mixer.Sound(os.path.join('sounds', 'enemy.mp3'))
-enemy_attack_sound.set_volume(0.7)
+import argparse
+from collections import OrderedDict
+import engine
+import replay
+import protocol
+import savegame
+from assets import AssetManager
+from profiler import FrameProfiler, PHASES
+from engine import (
+    GRID_WIDTH, GRID_HEIGHT, TICK_RATE,
+    PLAYER, WALL, FLOOR, STAIRS_DOWN, STAIRS_UP, ENEMY, ENEMY2, BOSS, TILE_SYMBOLS,
+    GameState,
+)
 
 # Game settings
 CELL_SIZE = 32
-GRID_WIDTH = 30
-GRID_HEIGHT = 22
-WINDOW_WIDTH = CELL_SIZE * GRID_WIDTH
-WINDOW_HEIGHT = CELL_SIZE * GRID_HEIGHT + 40  # Extra space for UI
+VIEW_WIDTH = GRID_WIDTH    # Map cells visible in the window, bigger maps scroll
+VIEW_HEIGHT = GRID_HEIGHT
+CHUNK_SIZE = 16  # Terrain is baked in CHUNK_SIZE x CHUNK_SIZE cell blocks
+WINDOW_WIDTH = CELL_SIZE * VIEW_WIDTH
+WINDOW_HEIGHT = CELL_SIZE * VIEW_HEIGHT + 40  # Extra space for UI
 UI_FONT_SIZE = 24
+TICK_SECONDS = 1 / TICK_RATE
+MAX_TICKS_PER_FRAME = 15  # After a longer stall the simulation skips ahead instead of catching up
+RENDER_FPS = 60  # Default render cap, vsync may hold it lower
+TITLE_FADE_RATE = 150  # Title alpha per second
+TEXT_CACHE_SIZE = 256  # Rendered strings kept, least recently used dropped first
 
 # Colors
 BLACK = (0, 0, 0)
@@ -41,36 +45,6 @@ ENEMY2_COLOR = (150, 0, 150)  # Purple
 GREEN = (0, 255, 0)
 RED = (255, 0, 0)
 
-# Map symbols
-PLAYER = '@'
-WALL = '#'
-FLOOR = '.'
-STAIRS_DOWN = '>'
-STAIRS_UP = '<'
-ENEMY = 'E'
-ENEMY2 = 'F'
-BOSS = 'B'
-
-# Dungeon generation parameters
-NUM_ROOMS = 8
-ROOM_MIN_SIZE = 4
-ROOM_MAX_SIZE = 8
-ENEMIES_PER_FLOOR = 3
-
-# Combat settings
-PLAYER_MAX_HP = 100
-PLAYER_ATTACK_MIN = 15
-PLAYER_ATTACK_MAX = 25
-ENEMY_ATTACK_MIN = 10
-ENEMY_ATTACK_MAX = 20
-ENEMY2_ATTACK_MIN = 15
-ENEMY2_ATTACK_MAX = 30
-ENEMY_MAX_HP = 60
-ENEMY2_MAX_HP = 80
-BOSS_ATTACK_MIN = 25
-BOSS_ATTACK_MAX =40
-BOSS_MAX_HP = 200
-
 TILE_IMAGE_FILES = {
     PLAYER: 'player.png',
     WALL: 'wall.png',
@@ -86,257 +60,148 @@ TILE_IMAGE_FILES = {
     'enemy2_combat': 'enemy2_combat.png',  # Detailed enemy2 sprite for combat
 }
 
+def tile_size(key):
+    if key == 'combat_bg':
+        # Scale combat background to window size
+        return (WINDOW_WIDTH, WINDOW_HEIGHT)
+    if key in ['player_combat', 'enemy_combat', 'enemy2_combat']:
+        # Scale combat sprites to reasonable size (e.g., 128x128)
+        return (128, 128)
+    return (CELL_SIZE, CELL_SIZE)
+
 def load_tile_images():
-    tile_images = {}
-    tile_folder = os.path.join(os.path.dirname(__file__), 'tiles')
-    for key, filename in TILE_IMAGE_FILES.items():
-        path = os.path.join(tile_folder, filename)
-        if os.path.exists(path):
-            img = pygame.image.load(path).convert_alpha()
-            if key == 'combat_bg':
-                # Scale combat background to window size
-                img = pygame.transform.scale(img, (WINDOW_WIDTH, WINDOW_HEIGHT))
-            elif key in ['player_combat', 'enemy_combat', 'enemy2_combat']:
-                # Scale combat sprites to reasonable size (e.g., 128x128)
-                img = pygame.transform.scale(img, (128, 128))
-            else:
-                img = pygame.transform.scale(img, (CELL_SIZE, CELL_SIZE))
-            tile_images[key] = img
-    return tile_images
-
-def create_empty_grid():
-    return [[WALL for _ in range(GRID_WIDTH)] for _ in range(GRID_HEIGHT)]
-
-def place_room(grid, x, y, w, h):
-    for i in range(y, y + h):
-        for j in range(x, x + w):
-            if 0 < i < GRID_HEIGHT-1 and 0 < j < GRID_WIDTH-1:
-                grid[i][j] = FLOOR
-
-def create_dungeon(seed, floor, place_up_stairs=True, place_down_stairs=True):
-    # Check if this is the boss floor
-    is_boss_floor = (floor == 5)
-    random.seed((seed, floor))  # Use tuple for unique per-floor
-    grid = create_empty_grid()
-    rooms = []
-    for _ in range(NUM_ROOMS):
-        w = random.randint(ROOM_MIN_SIZE, ROOM_MAX_SIZE)
-        h = random.randint(ROOM_MIN_SIZE, ROOM_MAX_SIZE)
-        x = random.randint(1, GRID_WIDTH - w - 1)
-        y = random.randint(1, GRID_HEIGHT - h - 1)
-        new_room = (x, y, w, h)
-        # Check for overlap
-        failed = False
-        for other in rooms:
-            ox, oy, ow, oh = other
-            if (x < ox + ow and x + w > ox and y < oy + oh and y + h > oy):
-                failed = True
-                break
-        if not failed:
-            place_room(grid, x, y, w, h)
-            if rooms:
-                # Connect to previous room with a corridor
-                prev_x, prev_y, prev_w, prev_h = rooms[-1]
-                prev_cx = prev_x + prev_w // 2
-                prev_cy = prev_y + prev_h // 2
-                new_cx = x + w // 2
-                new_cy = y + h // 2
-                if random.choice([True, False]):
-                    # Horizontal then vertical
-                    for j in range(min(prev_cx, new_cx), max(prev_cx, new_cx) + 1):
-                        if 0 < j < GRID_WIDTH-1 and 0 < prev_cy < GRID_HEIGHT-1:
-                            grid[prev_cy][j] = FLOOR
-                    for i in range(min(prev_cy, new_cy), max(prev_cy, new_cy) + 1):
-                        if 0 < new_cx < GRID_WIDTH-1 and 0 < i < GRID_HEIGHT-1:
-                            grid[i][new_cx] = FLOOR
-                else:
-                    # Vertical then horizontal
-                    for i in range(min(prev_cy, new_cy), max(prev_cy, new_cy) + 1):
-                        if 0 < prev_cx < GRID_WIDTH-1 and 0 < i < GRID_HEIGHT-1:
-                            grid[i][prev_cx] = FLOOR
-                    for j in range(min(prev_cx, new_cx), max(prev_cx, new_cx) + 1):
-                        if 0 < j < GRID_WIDTH-1 and 0 < new_cy < GRID_HEIGHT-1:
-                            grid[new_cy][j] = FLOOR
-            rooms.append(new_room)
-    # Place stairs
-    stairs_up_pos = None
-    stairs_down_pos = None
-    if rooms:
-        # Place stairs in different rooms
-        first_room = rooms[0]
-        last_room = rooms[-1]
-        if place_up_stairs:
-            up_x = first_room[0] + first_room[2] // 2
-            up_y = first_room[1] + first_room[3] // 2
-            stairs_up_pos = (up_x, up_y)
-        if place_down_stairs and floor != 5:
-            # Try to place stairs down in a different room than stairs up
-            down_room = last_room
-            if place_up_stairs and len(rooms) > 1:
-                # Find a room that is not the first room
-                for room in reversed(rooms):
-                    rx, ry, rw, rh = room
-                    candidate = (rx + rw // 2, ry + rh // 2)
-                    if candidate != stairs_up_pos:
-                        down_room = room
-                        break
-            down_x = down_room[0] + down_room[2] // 2
-            down_y = down_room[1] + down_room[3] // 2
-            stairs_down_pos = (down_x, down_y)
-        # Place tiles
-        if stairs_up_pos:
-            grid[stairs_up_pos[1]][stairs_up_pos[0]] = STAIRS_UP
-        if stairs_down_pos:
-            grid[stairs_down_pos[1]][stairs_down_pos[0]] = STAIRS_DOWN
-    # Player starts at up stairs (or down stairs if no up stairs)
-    if stairs_up_pos:
-        player_start = stairs_up_pos
-    elif stairs_down_pos:
-        player_start = stairs_down_pos
-    else:
-        player_start = (1, 1)
-    # Place enemies
-    enemies = []
-    attempts = 0
-    while len(enemies) < ENEMIES_PER_FLOOR and attempts < 100:
-        ex = random.randint(1, GRID_WIDTH - 2)
-        ey = random.randint(1, GRID_HEIGHT - 2)
-        if (grid[ey][ex] == FLOOR and
-            (ex, ey) != player_start and
-            (stairs_up_pos is None or (ex, ey) != stairs_up_pos) and
-            (stairs_down_pos is None or (ex, ey) != stairs_down_pos) and
-            (ex, ey) not in enemies):
-            enemies.append((ex, ey))
-        attempts += 1
-
-    # Place enemy2 (one per floor)
-    enemy2 = None
-    attempts = 0
-    while enemy2 is None and attempts < 100:
-        ex = random.randint(1, GRID_WIDTH - 2)
-        ey = random.randint(1, GRID_HEIGHT - 2)
-        if (grid[ey][ex] == FLOOR and
-            (ex, ey) != player_start and
-            (stairs_up_pos is None or (ex, ey) != stairs_up_pos) and
-            (stairs_down_pos is None or (ex, ey) != stairs_down_pos) and
-            (ex, ey) not in enemies):
-            enemy2 = (ex, ey)
-        attempts += 1
-
-    # Place boss on floor 5
-    boss_pos = None
-    if is_boss_floor:
-        # Find a room with enough space for 2x2s
-        for room in rooms:
-            rx, ry, rw, rh = room
-            # Check if room is big enough for boss (needs 2x2 space)
-            if rw >= 2 and rh >= 2:
-                # Try to place boss in center of room
-                boss_x = rx + (rw //2 - 1)  # Center, but ensure 2x2 fits
-                boss_y = ry + (rh // 2) - 1
-                
-                # Check if 2x2 area is all floor tiles
-                can_place = True
-                for dx in range(2):
-                    for dy in range(2):
-                        nx, ny = boss_x + dx, boss_y + dy
-                        if (nx < 0 or nx >= GRID_WIDTH or ny < 0 or ny >= GRID_HEIGHT or
-                            grid[ny][nx] != FLOOR or
-                            (nx, ny) == player_start or
-                            (nx, ny) in enemies or
-                            (enemy2 is not None and (nx, ny) == enemy2)):
-                            can_place = False
-                            break
-                    if not can_place:
-                        break
-                
-                if can_place:
-                    boss_pos = (boss_x, boss_y)
-                    break
-        
-        # If no suitable room found, try placing in any available22ce
-        if boss_pos is None:
-            for y in range(1, GRID_HEIGHT - 2):
-                for x in range(1, GRID_WIDTH - 2):
-                    # Check if 2x2 area is available
-                    can_place = True
-                    for dx in range(2):
-                        for dy in range(2):
-                            nx, ny = x + dx, y + dy
-                            if (grid[ny][nx] != FLOOR or
-                                (nx, ny) == player_start or
-                                (nx, ny) in enemies or
-                                (enemy2 is not None and (nx, ny) == enemy2)):
-                                can_place = False
-                                break
-                        if not can_place:
-                            break
-                    
-                    if can_place:
-                        boss_pos = (x, y)
-                        break
-                if boss_pos:
-                    break
-
-    return grid, player_start, stairs_up_pos, stairs_down_pos, enemies, enemy2, boss_pos
-
-
-
-def draw_grid(screen, grid, player_x, player_y, enemies, enemy2, tile_images, boss_pos=None):
-    for y, row in enumerate(grid):
-        for x, cell in enumerate(row):
-            rect = pygame.Rect(x * CELL_SIZE, y * CELL_SIZE + 40, CELL_SIZE, CELL_SIZE)
-            # Draw base tile (floor or wall)
-            if cell == WALL:
-                if WALL in tile_images:
-                    screen.blit(tile_images[WALL], rect)
-                else:
-                    pygame.draw.rect(screen, WALL_COLOR, rect)
-            elif cell == FLOOR:
-                if FLOOR in tile_images:
-                    screen.blit(tile_images[FLOOR], rect)
-                else:
-                    pygame.draw.rect(screen, FLOOR_COLOR, rect)
-            elif cell == STAIRS_DOWN:
-                if STAIRS_DOWN in tile_images:
-                    screen.blit(tile_images[STAIRS_DOWN], rect)
-                else:
-                    pygame.draw.rect(screen, STAIRS_DOWN_COLOR, rect)
-            elif cell == STAIRS_UP:
-                if STAIRS_UP in tile_images:
-                    screen.blit(tile_images[STAIRS_UP], rect)
-                else:
-                    pygame.draw.rect(screen, STAIRS_UP_COLOR, rect)
-            # Draw enemy or player on top
-            if (x, y) in enemies:
-                if ENEMY in tile_images:
-                    screen.blit(tile_images[ENEMY], rect)
-                else:
-                    pygame.draw.rect(screen, ENEMY_COLOR, rect)
-            if enemy2 and (x, y) == enemy2:
-                if ENEMY2 in tile_images:
-                    screen.blit(tile_images[ENEMY2], rect)
-                else:
-                    pygame.draw.rect(screen, ENEMY2_COLOR, rect)
-            # Draw boss (32x32 like other enemies)
-            if boss_pos and (x, y) == boss_pos:
-                if BOSS in tile_images:
-                    screen.blit(tile_images[BOSS], rect)
-                else:
-                    pygame.draw.rect(screen, (255, 0, 0), rect)
-            if x == player_x and y == player_y:
-                if PLAYER in tile_images:
-                    screen.blit(tile_images[PLAYER], rect)
-                else:
-                    pygame.draw.rect(screen, PLAYER_COLOR, rect)
+    # Every image at once, for tools that render without the title screen.
+    # The game itself loads through an AssetManager in the background.
+    return AssetManager(TILE_IMAGE_FILES, tile_size).load_all()
+
+# Map tiles packed into the atlas, with the color drawn when a tile has no image
+ATLAS_TILES = {
+    WALL: WALL_COLOR,
+    FLOOR: FLOOR_COLOR,
+    STAIRS_DOWN: STAIRS_DOWN_COLOR,
+    STAIRS_UP: STAIRS_UP_COLOR,
+    PLAYER: PLAYER_COLOR,
+    ENEMY: ENEMY_COLOR,
+    ENEMY2: ENEMY2_COLOR,
+    BOSS: RED,
+}
 
-def can_move(grid, x, y, enemies=None, enemy2=None):
-    if 0 <= x < GRID_WIDTH and 0 <= y < GRID_HEIGHT:
-        if grid[y][x] == WALL:
-            return False
-        # Removed enemy collision - player can now pass through enemies
-        return True
-    return False
+class TileAtlas:
+    # Every map tile in one surface in the display's pixel format, a missing
+    # image is a block of its fallback color. areas maps a map symbol to its
+    # cell in the atlas, so drawing a cell is a dict lookup and a (surface,
+    # dest, area) entry for Surface.blits, never a branch per tile type.
+    # Terrain is only ever baked onto black, so terrain_surface holds the same
+    # tiles flattened onto black without alpha, which blits as a plain copy.
+    def __init__(self, tile_images):
+        self.surface = pygame.Surface((len(ATLAS_TILES) * CELL_SIZE, CELL_SIZE), pygame.SRCALPHA)
+        self.areas = {}
+        for i, (key, color) in enumerate(ATLAS_TILES.items()):
+            area = pygame.Rect(i * CELL_SIZE, 0, CELL_SIZE, CELL_SIZE)
+            if key in tile_images:
+                self.surface.blit(tile_images[key], area)
+            else:
+                self.surface.fill(color, area)
+            self.areas[key] = area
+        self.surface = self.surface.convert_alpha()
+        self.terrain_surface = pygame.Surface(self.surface.get_size())
+        self.terrain_surface.fill(BLACK)
+        self.terrain_surface.blit(self.surface, (0, 0))
+        self.terrain_surface = self.terrain_surface.convert()
+        # The same lookup by tile code, for reading ArrayGrid cells directly
+        self.code_areas = [self.areas[symbol] for symbol in TILE_SYMBOLS]
+
+def build_terrain_surface(grid, atlas, x0, y0, w, h, explored=None):
+    # Bake the static terrain of a block of cells. Cells not yet explored (per the
+    # floor's explored bitmap) stay black and are not drawn at all.
+    surface = pygame.Surface((w * CELL_SIZE, h * CELL_SIZE))
+    surface.fill(BLACK)
+    width = len(grid[0])
+    x1 = min(x0 + w, width)
+    tiles = atlas.terrain_surface
+    cells = getattr(grid, "cells", None)
+    blits = []
+    for y in range(y0, min(y0 + h, len(grid))):
+        if cells is not None:
+            # Array backend: tile codes straight from the array, skipping the symbol wrapper
+            row, areas = cells[y, x0:x1].tolist(), atlas.code_areas
+        else:
+            row, areas = grid[y][x0:x1], atlas.areas
+        dest_y = (y - y0) * CELL_SIZE
+        row_start = y * width + x0
+        for i, cell in enumerate(row):
+            if explored is not None and not explored[row_start + i]:
+                continue
+            area = areas[cell]
+            blits.append((tiles, (i * CELL_SIZE, dest_y), area))
+    surface.blits(blits, False)
+    return surface
+
+class TerrainCache:
+    # Baked terrain for one floor. Chunks are built the first time the camera
+    # reaches them, so a huge map never needs one huge surface, and rebuilt when
+    # cells in them get explored.
+    def __init__(self, grid, atlas, explored=None):
+        self.grid = grid
+        self.atlas = atlas
+        self.explored = explored
+        self.chunks = {}
+
+    def chunk(self, cx, cy):
+        surface = self.chunks.get((cx, cy))
+        if surface is None:
+            surface = build_terrain_surface(self.grid, self.atlas, cx * CHUNK_SIZE, cy * CHUNK_SIZE, CHUNK_SIZE, CHUNK_SIZE, self.explored)
+            self.chunks[(cx, cy)] = surface
+        return surface
+
+    def invalidate(self, cells):
+        for x, y in cells:
+            self.chunks.pop((x // CHUNK_SIZE, y // CHUNK_SIZE), None)
+
+    def draw(self, screen, camera, area):
+        # Blit the chunks under a window-space area (already clipped by the caller)
+        cam_x, cam_y = camera
+        first_x = cam_x + area.left // CELL_SIZE
+        first_y = cam_y + (area.top - 40) // CELL_SIZE
+        last_x = min(cam_x + (area.right - 1) // CELL_SIZE, len(self.grid[0]) - 1)
+        last_y = min(cam_y + (area.bottom - 41) // CELL_SIZE, len(self.grid) - 1)
+        screen.blits([(self.chunk(cx, cy), ((cx * CHUNK_SIZE - cam_x) * CELL_SIZE, (cy * CHUNK_SIZE - cam_y) * CELL_SIZE + 40))
+                      for cy in range(first_y // CHUNK_SIZE, last_y // CHUNK_SIZE + 1)
+                      for cx in range(first_x // CHUNK_SIZE, last_x // CHUNK_SIZE + 1)], False)
+
+def camera_origin(grid, player_x, player_y):
+    # Top-left map cell of the view, centered on the player and clamped to the map
+    cam_x = min(max(player_x - VIEW_WIDTH // 2, 0), max(len(grid[0]) - VIEW_WIDTH, 0))
+    cam_y = min(max(player_y - VIEW_HEIGHT // 2, 0), max(len(grid) - VIEW_HEIGHT, 0))
+    return cam_x, cam_y
+
+def draw_grid(screen, terrain, camera, player_x, player_y, enemies, enemy2, boss_pos=None, dirty_rects=None, visible=None):
+    # Draw the baked terrain in view, either whole or only under last frame's sprites
+    view_rect = pygame.Rect(0, 40, VIEW_WIDTH * CELL_SIZE, VIEW_HEIGHT * CELL_SIZE)
+    for area in ([view_rect] if dirty_rects is None else dirty_rects):
+        area = area.clip(view_rect)
+        screen.set_clip(area)
+        terrain.draw(screen, camera, area)
+    screen.set_clip(None)
+    # Draw enemies and player on top, returning the rects they cover
+    sprites = [(ENEMY, pos) for pos in enemies]
+    if enemy2:
+        sprites.append((ENEMY2, enemy2))
+    # Draw boss (32x32 like other enemies)
+    if boss_pos:
+        sprites.append((BOSS, boss_pos))
+    if visible is not None:
+        # Enemies outside the field of view are hidden
+        sprites = [sprite for sprite in sprites if sprite[1] in visible]
+    sprites.append((PLAYER, (player_x, player_y)))
+    atlas = terrain.atlas
+    blits = []
+    for key, (x, y) in sprites:
+        sx, sy = x - camera[0], y - camera[1]
+        if 0 <= sx < VIEW_WIDTH and 0 <= sy < VIEW_HEIGHT:
+            blits.append((atlas.surface, pygame.Rect(sx * CELL_SIZE, sy * CELL_SIZE + 40, CELL_SIZE, CELL_SIZE), atlas.areas[key]))
+    screen.blits(blits, False)
+    return [dest for _, dest, _ in blits]
 
 def draw_health_bar(surface, x, y, width, height, current_hp, max_hp, color):
     # Background
@@ -347,545 +212,575 @@ def draw_health_bar(surface, x, y, width, height, current_hp, max_hp, color):
     # Border
     pygame.draw.rect(surface, WHITE, (x, y, width, height), 2)
 
-def draw_combat_ui(screen, ui_font, enemy_type, tile_images, player_hp, enemy_hp, player_max_hp, enemy_max_hp, combat_state, damage_dealt=None):
-    # Combat popup dimensions and position
-    combat_width = 600
-    combat_height = 400
-    combat_x = (WINDOW_WIDTH - combat_width) // 2
-    combat_y = (WINDOW_HEIGHT - combat_height) // 2
-    
-    # Create combat popup surface
-    combat_surface = pygame.Surface((combat_width, combat_height))
-    combat_surface.fill(BLACK)
-    
-    # Draw combat background if available, otherwise use solid color
-    if 'combat_bg' in tile_images:
-        # Scale background to fit combat popup
-        scaled_bg = pygame.transform.scale(tile_images['combat_bg'], (combat_width, combat_height))
-        combat_surface.blit(scaled_bg, (0, 0))
-    else:
-        # Use a dark background as fallback
-        combat_surface.fill((40, 40, 40))
-    
-    # Draw player sprite (left side of combat popup)
-    if 'player_combat' in tile_images:
-        player_sprite = tile_images['player_combat']
-        # Scale sprite to fit combat popup (make it larger)
-        scaled_player = pygame.transform.scale(player_sprite, (150, 150))
-        player_x = 100
-        player_y = combat_height // 2 - 20  # Move lower
-        combat_surface.blit(scaled_player, (player_x, player_y))
-    
-    # Draw enemy sprite (right side of combat popup)
-    if enemy_type == "boss":
-        if BOSS in tile_images:
-            enemy_sprite = pygame.transform.scale(tile_images[BOSS], (180, 180))
-            enemy_x = combat_width - 100 - enemy_sprite.get_width()
-            enemy_y = combat_height // 2 - 40
-            combat_surface.blit(enemy_sprite, (enemy_x, enemy_y))
+# Combat popup dimensions
+COMBAT_WIDTH = 600
+COMBAT_HEIGHT = 400
+
+class CombatRenderer:
+    # Draws the combat popup. Sprites are scaled and fonts created once, the
+    # background/sprites/title layer is built once per enemy type, and the popup
+    # is only recomposed when HP, damage or the combat state change.
+    def __init__(self, ui_font, tile_images, text_cache):
+        self.ui_font = ui_font
+        self.tile_images = tile_images
+        self.text_cache = text_cache
+        self.small_font = pygame.font.SysFont("monospace", 14)
+        self.victory_font = pygame.font.SysFont("monospace", 48)
+        self.rect = pygame.Rect((WINDOW_WIDTH - COMBAT_WIDTH) // 2, (WINDOW_HEIGHT - COMBAT_HEIGHT) // 2, COMBAT_WIDTH, COMBAT_HEIGHT)
+        self.layers = {}
+        self.surface = pygame.Surface((COMBAT_WIDTH, COMBAT_HEIGHT))
+        self.surface_key = None
+
+    def reset(self):
+        # Sprites arrived since the layers were built
+        self.layers = {}
+        self.surface_key = None
+
+    def static_layer(self, enemy_type):
+        layer = self.layers.get(enemy_type)
+        if layer is not None:
+            return layer
+        tile_images = self.tile_images
+        layer = pygame.Surface((COMBAT_WIDTH, COMBAT_HEIGHT))
+        layer.fill(BLACK)
+
+        # Draw combat background if available, otherwise use solid color
+        if 'combat_bg' in tile_images:
+            # Scale background to fit combat popup
+            layer.blit(pygame.transform.scale(tile_images['combat_bg'], (COMBAT_WIDTH, COMBAT_HEIGHT)), (0, 0))
         else:
-            enemy_x = combat_width - 180
-            enemy_y = combat_height // 2 - 40
-            pygame.draw.rect(combat_surface, (255, 0, 0), (enemy_x, enemy_y, 180, 180))
-    else:
-        enemy_sprite_key = 'enemy2_combat' if enemy_type == "enemy2" else 'enemy_combat'
-        if enemy_sprite_key in tile_images:
-            enemy_sprite = tile_images[enemy_sprite_key]
-            scaled_enemy = pygame.transform.scale(enemy_sprite, (150, 150))
-            enemy_x = combat_width - 100 - scaled_enemy.get_width()
-            enemy_y = combat_height // 2 - 20
-            combat_surface.blit(scaled_enemy, (enemy_x, enemy_y))
-    
-    # Combat title
-    title = ui_font.render("EN GARDE!", True, WHITE)
-    title_rect = title.get_rect(center=(combat_width // 2, 30))
-    combat_surface.blit(title, title_rect)
-    
-    # Health bars - moved higher
-    # Player health bar
-    draw_health_bar(combat_surface, 100, 120, 150, 20, player_hp, player_max_hp, GREEN)
-    player_hp_text = ui_font.render(f"HP: {max(0, player_hp)}/{player_max_hp}", True, WHITE)
-    combat_surface.blit(player_hp_text, (100, 145))
-    
-    # Enemy health bar
-    if enemy_type == "boss":
-        enemy_hp_color = (255, 0, 0)
-    else:
-        enemy_hp_color = ENEMY2_COLOR if enemy_type == "enemy2" else ENEMY_COLOR
-    draw_health_bar(combat_surface, 350, 120, 150, 20, enemy_hp, enemy_max_hp, enemy_hp_color)
-    enemy_hp_text = ui_font.render(f"HP: {max(0, enemy_hp)}/{enemy_max_hp}", True, WHITE)
-    combat_surface.blit(enemy_hp_text, (350, 145))
-    
-    # Create smaller font for instructions
-    small_font = pygame.font.SysFont("monospace", 14)
-    
-    # Combat info consolidated to bottom left
-    info_x = 10
-    info_y = combat_height - 40
-    line_height = 18
-    
-    # Damage display
-    if damage_dealt is not None:
-        damage_text = small_font.render(f"Damage: {damage_dealt}", True, RED)
-        combat_surface.blit(damage_text, (info_x, info_y))
-        info_y += line_height
-    
-    # Combat state and instructions
-    if combat_state == "player_turn":
-        # All options on one line
-        options_text = small_font.render("A: Attack | D: Defend | F: Flee", True, WHITE)
-        combat_surface.blit(options_text, (info_x, info_y))
-    elif combat_state == "enemy_turn":
-        instructions = small_font.render("Enemy attacks!", True, WHITE)
-        combat_surface.blit(instructions, (info_x, info_y))
-    elif combat_state == "victory":   # Large victory message in center
-        victory_font = pygame.font.SysFont("monospace", 48)
-        victory_text = victory_font.render("VICTORY!", True, GREEN)
-        victory_rect = victory_text.get_rect(center=(combat_width // 2, combat_height // 2))
-        combat_surface.blit(victory_text, victory_rect)
-        # Small instruction below
-        instructions2 = small_font.render("Press any key", True, WHITE)
-        instructions2_rect = instructions2.get_rect(center=(combat_width // 2, combat_height // 2 + 60))
-        combat_surface.blit(instructions2, instructions2_rect)
-    elif combat_state == "fled":
-        instructions = small_font.render("You fled! Press Any Key to Continue", True, WHITE)
-        combat_surface.blit(instructions, (info_x, info_y))
-        info_y += line_height
-       
-    
-    # Draw combat popup on main screen
-    screen.blit(combat_surface, (combat_x, combat_y))
-
-def draw_game_over_screen(screen, ui_font):
-    # Create a semi-transparent overlay
-    overlay = pygame.Surface((WINDOW_WIDTH, WINDOW_HEIGHT))
-    overlay.set_alpha(128)
-    overlay.fill(BLACK)
-    screen.blit(overlay, (0, 0))
-    
-    # Large game over text
-    game_over_font = pygame.font.SysFont("monospace",72)
-    game_over_text = game_over_font.render("GAME OVER", True, RED)
-    game_over_rect = game_over_text.get_rect(center=(WINDOW_WIDTH // 2, WINDOW_HEIGHT // 2 - 50))
-    screen.blit(game_over_text, game_over_rect)
-    
-    # Instructions
-    instruction_text = ui_font.render("Press SPACE to start a new game", True, WHITE)
-    instruction_rect = instruction_text.get_rect(center=(WINDOW_WIDTH // 2, WINDOW_HEIGHT // 2 + 50))
-    screen.blit(instruction_text, instruction_rect)
-
-def calculate_damage(min_damage, max_damage, is_defending=False):
-    base_damage = random.randint(min_damage, max_damage)
-    if is_defending:
-        base_damage = max(1, base_damage // 2)  # Defending reduces damage by half
-    return base_damage
-
-
-
-
-def draw_ui(screen, ui_font, seed, seed_input_mode, seed_input, floor):
+            # Use a dark background as fallback
+            layer.fill((40, 40, 40))
+
+        # Draw player sprite (left side of combat popup)
+        if 'player_combat' in tile_images:
+            # Scale sprite to fit combat popup (make it larger)
+            scaled_player = pygame.transform.scale(tile_images['player_combat'], (150, 150))
+            layer.blit(scaled_player, (100, COMBAT_HEIGHT // 2 - 20))  # Move lower
+
+        # Draw enemy sprite (right side of combat popup)
+        if enemy_type == "boss":
+            if BOSS in tile_images:
+                enemy_sprite = pygame.transform.scale(tile_images[BOSS], (180, 180))
+                layer.blit(enemy_sprite, (COMBAT_WIDTH - 100 - enemy_sprite.get_width(), COMBAT_HEIGHT // 2 - 40))
+            else:
+                pygame.draw.rect(layer, (255, 0, 0), (COMBAT_WIDTH - 180, COMBAT_HEIGHT // 2 - 40, 180, 180))
+        else:
+            enemy_sprite_key = 'enemy2_combat' if enemy_type == "enemy2" else 'enemy_combat'
+            if enemy_sprite_key in tile_images:
+                scaled_enemy = pygame.transform.scale(tile_images[enemy_sprite_key], (150, 150))
+                layer.blit(scaled_enemy, (COMBAT_WIDTH - 100 - scaled_enemy.get_width(), COMBAT_HEIGHT // 2 - 20))
+
+        # Combat title
+        title = self.ui_font.render("EN GARDE!", True, WHITE)
+        layer.blit(title, title.get_rect(center=(COMBAT_WIDTH // 2, 30)))
+        self.layers[enemy_type] = layer
+        return layer
+
+    def compose(self, enemy_type, player_hp, enemy_hp, player_max_hp, enemy_max_hp, combat_state, damage_dealt):
+        combat_surface = self.surface
+        combat_surface.blit(self.static_layer(enemy_type), (0, 0))
+
+        # Health bars - moved higher
+        # Player health bar
+        draw_health_bar(combat_surface, 100, 120, 150, 20, player_hp, player_max_hp, GREEN)
+        player_hp_text = self.text_cache.render(self.ui_font, f"HP: {max(0, player_hp)}/{player_max_hp}", WHITE)
+        combat_surface.blit(player_hp_text, (100, 145))
+
+        # Enemy health bar
+        if enemy_type == "boss":
+            enemy_hp_color = (255, 0, 0)
+        else:
+            enemy_hp_color = ENEMY2_COLOR if enemy_type == "enemy2" else ENEMY_COLOR
+        draw_health_bar(combat_surface, 350, 120, 150, 20, enemy_hp, enemy_max_hp, enemy_hp_color)
+        enemy_hp_text = self.text_cache.render(self.ui_font, f"HP: {max(0, enemy_hp)}/{enemy_max_hp}", WHITE)
+        combat_surface.blit(enemy_hp_text, (350, 145))
+
+        # Combat info consolidated to bottom left
+        small_font = self.small_font
+        text = self.text_cache.render
+        info_x = 10
+        info_y = COMBAT_HEIGHT - 40
+        line_height = 18
+
+        # Damage display
+        if damage_dealt is not None:
+            damage_text = text(small_font, f"Damage: {damage_dealt}", RED)
+            combat_surface.blit(damage_text, (info_x, info_y))
+            info_y += line_height
+
+        # Combat state and instructions
+        if combat_state == "player_turn":
+            # All options on one line
+            options_text = text(small_font, "A: Attack | D: Defend | F: Flee", WHITE)
+            combat_surface.blit(options_text, (info_x, info_y))
+        elif combat_state == "enemy_turn":
+            instructions = text(small_font, "Enemy attacks!", WHITE)
+            combat_surface.blit(instructions, (info_x, info_y))
+        elif combat_state == "victory":   # Large victory message in center
+            victory_text = text(self.victory_font, "VICTORY!", GREEN)
+            victory_rect = victory_text.get_rect(center=(COMBAT_WIDTH // 2, COMBAT_HEIGHT // 2))
+            combat_surface.blit(victory_text, victory_rect)
+            # Small instruction below
+            instructions2 = text(small_font, "Press any key", WHITE)
+            instructions2_rect = instructions2.get_rect(center=(COMBAT_WIDTH // 2, COMBAT_HEIGHT // 2 + 60))
+            combat_surface.blit(instructions2, instructions2_rect)
+        elif combat_state == "fled":
+            instructions = text(small_font, "You fled! Press Any Key to Continue", WHITE)
+            combat_surface.blit(instructions, (info_x, info_y))
+
+    def draw(self, screen, enemy_type, player_hp, enemy_hp, player_max_hp, enemy_max_hp, combat_state, damage_dealt=None):
+        # Blit the popup, recomposing it first only if something on it changed. Returns its rect.
+        key = (enemy_type, player_hp, enemy_hp, player_max_hp, enemy_max_hp, combat_state, damage_dealt)
+        if key != self.surface_key:
+            self.compose(*key)
+            self.surface_key = key
+        screen.blit(self.surface, self.rect)
+        return self.rect
+
+class TextCache:
+    # Rendered text surfaces keyed by (font, text, color), so strings that stay
+    # the same from frame to frame are rendered once
+    def __init__(self, max_entries=TEXT_CACHE_SIZE):
+        self.max_entries = max_entries
+        self.surfaces = OrderedDict()
+
+    def render(self, font, text, color):
+        key = (font, text, color)
+        surface = self.surfaces.get(key)
+        if surface is None:
+            surface = font.render(text, True, color)
+            self.surfaces[key] = surface
+            if len(self.surfaces) > self.max_entries:
+                self.surfaces.popitem(last=False)
+        else:
+            self.surfaces.move_to_end(key)
+        return surface
+
+class EndScreen:
+    # Game over / win overlay. The semi-transparent layer and both lines of text
+    # are built once instead of every frame the screen is up.
+    def __init__(self, big_font, ui_font, alpha, title, title_color, instruction):
+        self.overlay = pygame.Surface((WINDOW_WIDTH, WINDOW_HEIGHT))
+        self.overlay.set_alpha(alpha)
+        self.overlay.fill(BLACK)
+        self.title_text = big_font.render(title, True, title_color)
+        self.title_rect = self.title_text.get_rect(center=(WINDOW_WIDTH // 2, WINDOW_HEIGHT // 2 - 50))
+        self.instruction_text = ui_font.render(instruction, True, WHITE)
+        self.instruction_rect = self.instruction_text.get_rect(center=(WINDOW_WIDTH // 2, WINDOW_HEIGHT // 2 + 50))
+
+    def draw(self, screen):
+        screen.blit(self.overlay, (0, 0))
+        screen.blit(self.title_text, self.title_rect)
+        screen.blit(self.instruction_text, self.instruction_rect)
+
+def draw_ui(screen, ui_font, text_cache, seed, seed_input_mode, seed_input, floor):
     if seed_input_mode:
         msg = f"Enter new seed: {seed_input}"  # Show what user is typing
         color = GRAY
     else:
         msg = f"Seed: {seed} (press 'S' to change)" if floor == 1 else f"Seed: {seed} (locked)"
         color = WHITE
-    text = ui_font.render(msg, True, color)
+    text = text_cache.render(ui_font, msg, color)
     screen.blit(text, (10, 5))
     floor_msg = f"Floor: {floor}"
-    floor_text = ui_font.render(floor_msg, True, WHITE)
+    floor_text = text_cache.render(ui_font, floor_msg, WHITE)
     screen.blit(floor_text, (WINDOW_WIDTH - 120, 5))
 
-def find_adjacent_floor(grid, x, y):
-    # Try to find a neighboring floor tile (up, down, left, right)
-    for dx, dy in [(-1,0), (1,0), (0,-1), (0,1)]:
-        nx, ny = x + dx, y + dy
-        if 0 <= nx < GRID_WIDTH and 0 <= ny < GRID_HEIGHT:
-            if grid[ny][nx] == FLOOR:
-                return nx, ny
-    return x, y  # No adjacent floor found, stay in place
-
-def move_enemies(grid, enemies, enemy2, player_pos):
-    new_enemies = []
-    for (ex, ey) in enemies:
-        possible_moves = []
-        for dx, dy in [(-1,0), (1,0), (0,-1), (0,1)]:
-            nx, ny = ex + dx, ey + dy
-            if 0 <= nx < GRID_WIDTH and 0 <= ny < GRID_HEIGHT:
-                if grid[ny][nx] == FLOOR and (nx, ny) != player_pos and (nx, ny) not in enemies and (enemy2 is None or (nx, ny) != enemy2):
-                    possible_moves.append((nx, ny))
-        if possible_moves:
-            new_pos = random.choice(possible_moves)
-            new_enemies.append(new_pos)
-        else:
-            new_enemies.append((ex, ey))
-    
-    # Move enemy2
-    new_enemy2 = enemy2
-    if enemy2:
-        ex, ey = enemy2
-        possible_moves = []
-        for dx, dy in [(-1,0), (1,0), (0,-1), (0,1)]:
-            nx, ny = ex + dx, ey + dy
-            if 0 <= nx < GRID_WIDTH and 0 <= ny < GRID_HEIGHT:
-                if grid[ny][nx] == FLOOR and (nx, ny) != player_pos and (nx, ny) not in enemies and (nx, ny) != enemy2:
-                    possible_moves.append((nx, ny))
-        if possible_moves:
-            new_enemy2 = random.choice(possible_moves)
-    
-    return new_enemies, new_enemy2
-
-def main():
-    seed = 42
-    floor = 1
-    grid, (player_x, player_y), stairs_up_pos, stairs_down_pos, enemies, enemy2, boss_pos = create_dungeon(seed, floor, place_up_stairs=True, place_down_stairs=True)
+PROFILE_FONT_SIZE = 14
+PROFILE_REFRESH = 15  # Frames between overlay text updates, the numbers are unreadable if they change every frame
+PROFILE_BG = (20, 20, 20)
+
+class ProfileOverlay:
+    # Fixed-size opaque panel with per-phase p50/p95/p99 frame times, re-rendered
+    # every PROFILE_REFRESH frames and blitted as is in between
+    def __init__(self, font, profiler):
+        self.font = font
+        self.profiler = profiler
+        self.line_height = font.get_linesize()
+        width = font.size(self.format_row("draw_combat_ui", 999.99, 999.99, 999.99))[0] + 12
+        self.surface = pygame.Surface((width, (len(PHASES) + 2) * self.line_height + 8))
+        self.frames = 0
+
+    def format_row(self, name, p50, p95, p99):
+        return f"{name:<15}{p50:>7.2f}{p95:>7.2f}{p99:>7.2f}"
+
+    def refresh(self):
+        self.surface.fill(PROFILE_BG)
+        stats = self.profiler.stats()
+        header = f"{'ms':<15}{'p50':>7}{'p95':>7}{'p99':>7}"
+        rows = [header] + [self.format_row(name, *stats[name]) for name in PHASES + ("frame",)]
+        for i, row in enumerate(rows):
+            self.surface.blit(self.font.render(row, True, WHITE if i else GRAY), (6, 4 + i * self.line_height))
+
+    def draw(self, screen, pos):
+        if self.frames % PROFILE_REFRESH == 0:
+            self.refresh()
+        self.frames += 1
+        return screen.blit(self.surface, pos)
+
+# Keys mapped to GameState actions
+MOVE_KEYS = {
+    pygame.K_UP: "up",
+    pygame.K_DOWN: "down",
+    pygame.K_LEFT: "left",
+    pygame.K_RIGHT: "right",
+}
+COMBAT_KEYS = {
+    pygame.K_a: "attack",
+    pygame.K_d: "defend",
+    pygame.K_f: "flee",
+}
+
+def idle_timeout(state, accumulator):
+    # Milliseconds until the next tick that changes anything on screen, 0 (wait
+    # for input) when nothing is scheduled
+    ticks = state.ticks_until_change()
+    if ticks is None:
+        return 0
+    return max(1, int((ticks * TICK_SECONDS - accumulator) * 1000) + 1)
+
+def tick_timeout(accumulator, tick_speed):
+    # Milliseconds until the next tick at tick_speed, 0 (wait for input) when stopped
+    if not tick_speed:
+        return 0
+    return max(1, int((TICK_SECONDS - accumulator) / tick_speed * 1000) + 1)
+
+def open_window(fps):
+    # Returns the screen and the frame cap for clock.tick, 0 meaning none.
+    # Without --fps, presentation is synced to the display if the driver allows
+    # it, with RENDER_FPS as a backstop in case vsync is silently ignored.
+    if fps is None:
+        try:
+            return pygame.display.set_mode((WINDOW_WIDTH, WINDOW_HEIGHT), pygame.SCALED, vsync=1), RENDER_FPS
+        except pygame.error:
+            fps = RENDER_FPS
+    return pygame.display.set_mode((WINDOW_WIDTH, WINDOW_HEIGHT)), fps
+
+def quit_game(state, profiler, save_writer, recorder, save):
+    profiler.close()
+    if save_writer is not None:
+        if save and not state.game_over and not state.game_won:
+            save_writer.save(state)
+        save_writer.close()
+    if recorder is not None:
+        recorder.close()
+    pygame.quit()
+    sys.exit()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="ASCII Roguelike")
+    parser.add_argument("--map-size", type=engine.parse_map_size, default=(GRID_WIDTH, GRID_HEIGHT),
+                        help="map size in cells as WIDTHxHEIGHT, the window scrolls over bigger maps")
+    parser.add_argument("--grid-backend", choices=["list", "array"],
+                        help="grid representation, defaults to array (NumPy) for maps bigger than the window")
+    parser.add_argument("--fps", type=int,
+                        help="render frame cap without vsync, 0 for uncapped; default is vsync capped at 60 (game speed is fixed either way)")
+    parser.add_argument("--profile", action="store_true",
+                        help="start with the frame-time overlay shown (F3 toggles it)")
+    parser.add_argument("--profile-out", metavar="PATH",
+                        help="write per-frame phase timings to PATH as JSON lines")
+    parser.add_argument("--save", metavar="PATH", default=savegame.SAVE_PATH,
+                        help="save file, resumed on start and written on stairs and quit")
+    parser.add_argument("--new-game", action="store_true", help="ignore an existing save")
+    parser.add_argument("--endless", action="store_true",
+                        help="new games go down forever, each floor bigger and harder; a resumed save keeps its own mode")
+    parser.add_argument("--generator", choices=list(engine.GENERATORS), default="classic",
+                        help="dungeon layout for new games: classic (the layouts seeds always had) or bsp (every room placed, corridors along a spanning tree)")
+    parser.add_argument("--record", metavar="PATH", default=replay.REPLAY_PATH,
+                        help="record the session's input for replay, '' to turn off")
+    parser.add_argument("--replay", metavar="PATH", help="play back a recorded session instead of reading the keyboard")
+    parser.add_argument("--replay-speed", type=float, default=1.0, metavar="N",
+                        help="play back at N times game speed (replay.py replays headless at full speed)")
+    parser.add_argument("--connect", metavar="ADDRESS",
+                        help="play a session on server.py at HOST:PORT or unix:PATH, nothing is saved or recorded")
+    args = parser.parse_args(argv)
+    map_width, map_height = args.map_size
+    backend = args.grid_backend
+    if backend is None and engine.np is not None and map_width * map_height > GRID_WIDTH * GRID_HEIGHT:
+        backend = "array"
+
+    # Neighbouring floors are built on a worker thread so stairs never wait for create_dungeon
+    state = None
+    player = None
+    if args.replay:
+        player = replay.ReplayPlayer(args.replay, backend=backend, pregenerate=True)
+        state = player.state
+    elif args.connect:
+        try:
+            state = protocol.RemoteState(args.connect)
+        except OSError as e:
+            print(f"Could not connect to {args.connect}: {e}", file=sys.stderr)
+            sys.exit(1)
+    elif not args.new_game and os.path.exists(args.save):
+        try:
+            state = savegame.load(args.save, backend=backend, pregenerate=True)
+        except (OSError, ValueError) as e:
+            print(f"Could not resume from {args.save}: {e}", file=sys.stderr)
+    if state is None:
+        state = GameState(seed=42, width=map_width, height=map_height, backend=backend, pregenerate=True, endless=args.endless,
+                          generator=args.generator)
+    # A replay leaves the save alone, a remote game lives on the server
+    local = player is None and not args.connect
+    save_writer = savegame.SaveWriter(args.save) if local else None
+    saved_key = (state.seed, state.floor)
+    recorder = replay.Recorder(state, args.record) if args.record and local else None
+    tick_speed = args.replay_speed if player is not None else 1.0
     pygame.init()
-    screen = pygame.display.set_mode((WINDOW_WIDTH, WINDOW_HEIGHT))
-    tile_images = load_tile_images()
+    screen, fps = open_window(args.fps)
     pygame.display.set_caption("ASCII Roguelike")
+    # Map tiles and sounds load while the title screen shows, tile_images fills in as they arrive
+    assets = AssetManager(TILE_IMAGE_FILES, tile_size)
+    assets.start()
+    tile_images = assets.tile_images
+    # Fonts, overlays and renderers are created once, SysFont lookups are slow
     ui_font = pygame.font.SysFont("monospace", UI_FONT_SIZE)
+    big_font = pygame.font.SysFont("monospace", 72)
+    text_cache = TextCache()
+    game_over_screen = EndScreen(big_font, ui_font, 128, "GAME OVER", RED, "Press SPACE to start a new game")
+    game_win_screen = EndScreen(big_font, ui_font, 180, "YOU WIN!", (0, 255, 0), "Press SPACE to play again")
     clock = pygame.time.Clock()
+    combat_renderer = CombatRenderer(ui_font, tile_images, text_cache)
+    profiler = FrameProfiler(record_path=args.profile_out)
+    profile_overlay = ProfileOverlay(pygame.font.SysFont("monospace", PROFILE_FONT_SIZE), profiler)
+    show_profile = args.profile
+    report_startup = args.profile
+    first_frame_at = None
     seed_input_mode = False
     seed_input = ""
-    enemy_move_counter = 0
-    ENEMY_MOVE_DELAY = 50  # Move enemies every 15 frames
-    
-    # Combat state
-    in_combat = False
-    combat_enemy_type = None
-    combat_enemy_pos = None
-    player_hp = PLAYER_MAX_HP
-    player_max_hp = PLAYER_MAX_HP
-    enemy_hp = 0
-    enemy_max_hp = 0
-    combat_state = "player_turn"  # player_turn, enemy_turn, victory, defeat, fled
-    damage_dealt = None
-    player_defending = False
-    enemy_turn_delay = 0  # Counter for enemy turn delay
-    
-    # Game over state
-    game_over = False
-    game_won = False
-
-    title_screen = True
+
+    # Render state: the tile atlas, baked terrain for the current floor and last frame's sprite rects
+    atlas = TileAtlas(tile_images)
+    terrain = None
+    prev_sprite_rects = []
+    last_frame_key = None
+    last_overlay_active = False
+    last_view_key = None
+    waited_event = None  # Event that woke an idle wait, handled with the next batch
+    idle_seconds = 0.0
+
+    title_screen = player is None
+    last_time = perf_counter()
+    accumulator = 0.0
     while True:
         if title_screen:
-            fade_alpha = 0
+            fade_start = perf_counter()
             fade_in_done = False
             # Prepare title and prompt surfaces
-            title_font = pygame.font.SysFont("monospace", 72)
-            title_text = title_font.render("ENTER THE DUNGEON", True, (255, 0, 0))
+            title_text = big_font.render("ENTER THE DUNGEON", True, (255, 0, 0))
             title_rect = title_text.get_rect(center=(WINDOW_WIDTH // 2, WINDOW_HEIGHT // 2 - 50))
             prompt_font = pygame.font.SysFont("monospace", 32)
             prompt_text = prompt_font.render("Press SPACE to start", True, (255, 255, 255))
             prompt_rect = prompt_text.get_rect(center=(WINDOW_WIDTH // 2, WINDOW_HEIGHT // 2 + 50))
-            # Create a surface for fade-in
+            # Create a surface for fade-in, composed once and only its alpha changes
             fade_surface = pygame.Surface((WINDOW_WIDTH, WINDOW_HEIGHT), pygame.SRCALPHA)
+            fade_surface.fill((0, 0, 0, 0))
+            fade_surface.blit(title_text, title_rect)
+            fade_surface.blit(prompt_text, prompt_rect)
             while title_screen:
                 screen.fill((0, 0, 0))
-                fade_surface.fill((0, 0, 0, 0))
-                fade_surface.blit(title_text, title_rect)
-                fade_surface.blit(prompt_text, prompt_rect)
                 if not fade_in_done:
-                    fade_surface.set_alpha(fade_alpha)
-                    fade_alpha += 5  # Increase for faster/slower fade
+                    # Fade by elapsed time, not frames, so it takes the same time at any frame rate
+                    fade_alpha = int((perf_counter() - fade_start) * TITLE_FADE_RATE)
                     if fade_alpha >= 255:
                         fade_alpha = 255
                         fade_in_done = True
+                    fade_surface.set_alpha(fade_alpha)
                 else:
                     fade_surface.set_alpha(255)
                 screen.blit(fade_surface, (0, 0))
                 pygame.display.flip()
-                for event in pygame.event.get():
+                if first_frame_at is None:
+                    first_frame_at = perf_counter()
+                    if report_startup:
+                        print(f"startup: first frame after {(first_frame_at - START_TIME) * 1000:.1f} ms", file=sys.stderr)
+                if assets.poll():
+                    atlas = TileAtlas(tile_images)
+                events = pygame.event.get()
+                if fade_in_done and not events:
+                    # The title is static once faded in, sleep until a key arrives
+                    events = [pygame.event.wait()]
+                for event in events:
                     if event.type == pygame.QUIT:
-                        pygame.quit()
-                        sys.exit()
+                        quit_game(state, profiler, save_writer, recorder, False)
                     elif fade_in_done and event.type == pygame.KEYDOWN and event.key == pygame.K_SPACE:
                         title_screen = False
-                pygame.time.Clock().tick(30)
+                clock.tick(fps)
+            # The simulation clock starts when the game does
+            last_time = perf_counter()
+            accumulator = 0.0
             continue
 
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                pygame.quit()
-                sys.exit()
-            elif event.type == pygame.KEYDOWN:
-                if game_won:
-                    if event.key == pygame.K_SPACE:
-                        # Start new game
-                        game_won = False
-                        game_over = False
-                        floor = 1
-                        grid, (player_x, player_y), stairs_up_pos, stairs_down_pos, enemies, enemy2, boss_pos = create_dungeon(seed, floor, place_up_stairs=True, place_down_stairs=True)
-                        player_hp = PLAYER_MAX_HP
-                        in_combat = False
-                        combat_enemy_type = None
-                        combat_enemy_pos = None
-                        combat_state = "player_turn"
-                        damage_dealt = None
-                        player_defending = False
-                elif game_over:
-                    if event.key == pygame.K_SPACE:
-                        # Start new game
-                        game_over = False
-                        floor = 1
-                        grid, (player_x, player_y), stairs_up_pos, stairs_down_pos, enemies, enemy2, boss_pos = create_dungeon(seed, floor, place_up_stairs=True, place_down_stairs=True)
-                        player_hp = PLAYER_MAX_HP
-                        in_combat = False
-                        combat_enemy_type = None
-                        combat_enemy_pos = None
-                        combat_state = "player_turn"
-                        damage_dealt = None
-                        player_defending = False
-                elif in_combat:
-                    if combat_state == "player_turn":
-                        if event.key == pygame.K_a:  # Attack
-                            attack_sound.play()
-                            damage = calculate_damage(PLAYER_ATTACK_MIN, PLAYER_ATTACK_MAX)
-                            enemy_hp -= damage
-                            damage_dealt = damage
-                            combat_state = "enemy_turn"
-                            player_defending = False
-                            enemy_turn_delay = 30  # 1 second delay at 30 FPS
-                        elif event.key == pygame.K_d:  # Defend
-                            player_defending = True
-                            combat_state = "enemy_turn"
-                            enemy_turn_delay = 30  # 1 second delay at 30 FPS
-                        elif event.key == pygame.K_f:  # Flee
-                            if random.random() < 0.7:  # 70% chance to flee
-                                combat_state = "fled"
-                                for dx, dy in [(-1,0), (1,0), (0,-1), (0,1)]:
-                                    nx, ny = player_x + dx, player_y + dy
-                                    if (0 <= nx < GRID_WIDTH and 0 <= ny < GRID_HEIGHT and
-                                        grid[ny][nx] == FLOOR and
-                                        (nx, ny) not in enemies and
-                                        (enemy2 is None or (nx, ny) != enemy2) and
-                                        (boss_pos is None or (nx, ny) != boss_pos)):
-                                        player_x, player_y = nx, ny
-                                        break
-                            else:
-                                combat_state = "enemy_turn"
-                                enemy_turn_delay = 30  # 1 second delay at 30 FPS
-                    elif combat_state in ["enemy_turn", "victory", "defeat", "fled"]:
-                        if combat_state == "enemy_turn":
-                            # Enemy attacks
-                            if enemy_hp > 0:
-                                if combat_enemy_type == "boss":
-                                    min_dmg = BOSS_ATTACK_MIN
-                                    max_dmg = BOSS_ATTACK_MAX
-                                elif combat_enemy_type == "enemy2":
-                                    min_dmg = ENEMY2_ATTACK_MIN
-                                    max_dmg = ENEMY2_ATTACK_MAX
-                                else:
-                                    min_dmg = ENEMY_ATTACK_MIN
-                                    max_dmg = ENEMY_ATTACK_MAX
-                                damage = calculate_damage(min_dmg, max_dmg, player_defending)
-                                player_hp -= damage
-                                damage_dealt = damage
-                                enemy_attack_sound.play() # Play enemy attack sound
-                            
-                            # Check combat result
-                            if enemy_hp <= 0:
-                                combat_state = "victory"
-                            elif player_hp <= 0:
-                                # Go straight to game over, skip defeat message
-                                game_over = True
-                                if combat_enemy_type == "enemy":
-                                    if combat_enemy_pos in enemies:
-                                        enemies.remove(combat_enemy_pos)
-                                elif combat_enemy_type == "enemy2":
-                                    enemy2 = None
-                                in_combat = False
-                                combat_enemy_type = None
-                                combat_enemy_pos = None
-                                combat_state = "player_turn"
-                                damage_dealt = None
-                                player_defending = False
+        state.events = []
+        with profiler.phase("events"):
+            events = pygame.event.get()
+            if waited_event is not None:
+                events.insert(0, waited_event)
+                waited_event = None
+            for event in events:
+                if event.type == pygame.QUIT:
+                    quit_game(state, profiler, save_writer, recorder, True)
+                elif event.type == pygame.KEYDOWN and event.key == pygame.K_F3:
+                    show_profile = not show_profile
+                elif event.type == pygame.KEYDOWN and player is None:
+                    action = None
+                    if state.game_won or state.game_over:
+                        if event.key == pygame.K_SPACE:
+                            # Start new game
+                            action = "restart"
+                    elif state.in_combat:
+                        if state.combat_state == "player_turn":
+                            action = COMBAT_KEYS.get(event.key)
+                        else:
+                            action = "continue"
+                    elif seed_input_mode:
+                        if event.key == pygame.K_RETURN:
+                            # Try to set new seed
+                            try:
+                                seed = engine.check_seed(int(seed_input))
+                            except ValueError:
+                                pass  # Ignore invalid input, out of range seeds included
                             else:
-                                combat_state = "player_turn"
+                                if recorder is not None:
+                                    recorder.new_game(seed)
+                                state.new_game(seed)
+                            seed_input_mode = False
+                            seed_input = ""
+                        elif event.key == pygame.K_BACKSPACE:
+                            seed_input = seed_input[:-1]
+                        elif event.key == pygame.K_ESCAPE:
+                            seed_input_mode = False
+                            seed_input = ""
                         else:
-                            # Combat ended, return to game
-                            if combat_state == "victory":
-                                # Check if boss was defeated
-                                if combat_enemy_type == "boss":
-                                    game_won = True
-                                else:
-                                    # Remove defeated enemy
-                                    if combat_enemy_type == "enemy":
-                                        if combat_enemy_pos in enemies:
-                                            enemies.remove(combat_enemy_pos)
-                                    elif combat_enemy_type == "enemy2":
-                                        enemy2 = None
-                            elif combat_state == "defeat":
-                                # Game over when player is defeated
-                                game_over = True
-                                if combat_enemy_type == "enemy":
-                                    if combat_enemy_pos in enemies:
-                                        enemies.remove(combat_enemy_pos)
-                                elif combat_enemy_type == "enemy2":
-                                    enemy2 = None
-                            
-                            in_combat = False
-                            combat_enemy_type = None
-                            combat_enemy_pos = None
-                            combat_state = "player_turn"
-                            damage_dealt = None
-                            player_defending = False
-                elif seed_input_mode:
-                    if event.key == pygame.K_RETURN:
-                        # Try to set new seed
-                        try:
-                            new_seed = int(seed_input)
-                            seed = new_seed
-                            floor = 1
-                            grid, (player_x, player_y), stairs_up_pos, stairs_down_pos, enemies, enemy2, boss_pos = create_dungeon(seed, floor, place_up_stairs=True, place_down_stairs=True)
-                            player_hp = PLAYER_MAX_HP
-                        except ValueError:
-                            pass  # Ignore invalid input
-                        seed_input_mode = False
-                        seed_input = ""
-                    elif event.key == pygame.K_BACKSPACE:
-                        seed_input = seed_input[:-1]
-                    elif event.key == pygame.K_ESCAPE:
-                        seed_input_mode = False
-                        seed_input = ""
-                    else:
-                        if event.unicode.isdigit() or (event.unicode == '-' and len(seed_input) == 0):
-                            seed_input += event.unicode
-                else:
-                    dx, dy = 0, 0
-                    if event.key == pygame.K_UP:
-                        dy = -1
-                    elif event.key == pygame.K_DOWN:
-                        dy = 1
-                    elif event.key == pygame.K_LEFT:
-                        dx = -1
-                    elif event.key == pygame.K_RIGHT:
-                        dx = 1
-                    elif event.key == pygame.K_s and floor == 1:
+                            if event.unicode.isdigit() or (event.unicode == '-' and len(seed_input) == 0):
+                                seed_input += event.unicode
+                    elif event.key == pygame.K_s and state.floor == 1:
                         seed_input_mode = True
                         seed_input = ""
-                    if not seed_input_mode and can_move(grid, player_x + dx, player_y + dy, enemies, enemy2):
-                        player_x += dx
-                        player_y += dy
-        
-        # Handle automatic enemy turn
-        if in_combat and combat_state == "enemy_turn":
-            if enemy_turn_delay > 0:
-                enemy_turn_delay -= 1
-            else:
-                # Enemy attacks
-                if enemy_hp > 0:
-                    if combat_enemy_type == "boss":
-                        min_dmg = BOSS_ATTACK_MIN
-                        max_dmg = BOSS_ATTACK_MAX
-                    elif combat_enemy_type == "enemy2":
-                        min_dmg = ENEMY2_ATTACK_MIN
-                        max_dmg = ENEMY2_ATTACK_MAX
                     else:
-                        min_dmg = ENEMY_ATTACK_MIN
-                        max_dmg = ENEMY_ATTACK_MAX
-                    damage = calculate_damage(min_dmg, max_dmg, player_defending)
-                    player_hp -= damage
-                    damage_dealt = damage
-                    enemy_attack_sound.play() # Play enemy attack sound
-                
-                # Check combat result
-                if enemy_hp <= 0:
-                    combat_state = "victory"
-                elif player_hp <= 0:
-                    # Go straight to game over, skip defeat message
-                    game_over = True
-                    if combat_enemy_type == "enemy":
-                        if combat_enemy_pos in enemies:
-                            enemies.remove(combat_enemy_pos)
-                    elif combat_enemy_type == "enemy2":
-                        enemy2 = None
-                    in_combat = False
-                    combat_enemy_type = None
-                    combat_enemy_pos = None
-                    combat_state = "player_turn"
-                    damage_dealt = None
-                    player_defending = False
-                else:
-                    combat_state = "player_turn"
-        
-        # Handle stairs and move off stairs if needed
-        transitioned = False
-        if not seed_input_mode and not in_combat:
-            if (player_x, player_y) == stairs_down_pos:
-                floor += 1
-                grid, _, stairs_up_pos, stairs_down_pos, enemies, enemy2, boss_pos = create_dungeon(seed, floor, place_up_stairs=True, place_down_stairs=True)
-                player_x, player_y = stairs_up_pos if stairs_up_pos else (1, 1)
-                transitioned = True
-            elif (player_x, player_y) == stairs_up_pos and floor > 1:
-                floor -= 1
-                grid, _, stairs_up_pos, stairs_down_pos, enemies, enemy2, boss_pos = create_dungeon(seed, floor, place_up_stairs=(floor > 1), place_down_stairs=True)
-                player_x, player_y = stairs_down_pos if stairs_down_pos else (1, 1)
-                transitioned = True
-        # Move off stairs if needed
-        if transitioned and grid[player_y][player_x] in (STAIRS_UP, STAIRS_DOWN):
-            new_x, new_y = find_adjacent_floor(grid, player_x, player_y)
-            player_x, player_y = new_x, new_y
-        # Check for combat
-        if not in_combat and not seed_input_mode:
-            if (player_x, player_y) in enemies:
-                in_combat = True
-                combat_enemy_type = "enemy"
-                combat_enemy_pos = (player_x, player_y)
-                enemy_hp = ENEMY_MAX_HP
-                enemy_max_hp = ENEMY_MAX_HP
-                combat_state = "player_turn"
-            elif enemy2 and (player_x, player_y) == enemy2:
-                in_combat = True
-                combat_enemy_type = "enemy2"
-                combat_enemy_pos = (player_x, player_y)
-                enemy_hp = ENEMY2_MAX_HP
-                enemy_max_hp = ENEMY2_MAX_HP
-                combat_state = "player_turn"
-            # Boss combat
-            elif boss_pos and (player_x, player_y) == boss_pos and floor == 5:
-                in_combat = True
-                combat_enemy_type = "boss"
-                combat_enemy_pos = boss_pos
-                enemy_hp = BOSS_MAX_HP
-                enemy_max_hp = BOSS_MAX_HP
-                combat_state = "player_turn"
-        # Move enemies every ENEMY_MOVE_DELAY frames
-        if not in_combat:
-            enemy_move_counter += 1
-            if enemy_move_counter >= ENEMY_MOVE_DELAY:
-                enemies, enemy2 = move_enemies(grid, enemies, enemy2, (player_x, player_y))
-                enemy_move_counter = 0
-        
+                        action = MOVE_KEYS.get(event.key)
+                    if action is not None:
+                        if recorder is not None:
+                            recorder.apply(action)
+                        state.apply(action)
+
+        if assets.poll():
+            atlas = TileAtlas(tile_images)
+            terrain = None
+            combat_renderer.reset()
+        if report_startup and assets.ready.is_set():
+            print(f"startup: assets ready after {(assets.ready_at - START_TIME) * 1000:.1f} ms", file=sys.stderr)
+            report_startup = False
+
+        # Advance enemy turns, stairs, combat checks and enemy movement at a fixed
+        # TICK_RATE: as many ticks as real time has passed, however long the frame took.
+        # A scheduled idle sleep is caught up in full, an unexpected stall is not.
+        # A replay runs tick_speed times as many ticks, its input comes from the recording.
+        now = perf_counter()
+        accumulator = min(accumulator + (now - last_time) * tick_speed,
+                          (MAX_TICKS_PER_FRAME * TICK_SECONDS + idle_seconds) * tick_speed)
+        idle_seconds = 0.0
+        last_time = now
+        while accumulator >= TICK_SECONDS:
+            accumulator -= TICK_SECONDS
+            if player is None:
+                state.tick(profiler)
+                if recorder is not None:
+                    recorder.tick()
+                continue
+            try:
+                if player.step(profiler):
+                    continue
+                print(f"replay finished after {state.tick_count} ticks, no divergence", file=sys.stderr)
+            except replay.ReplayDivergence as e:
+                # Stop on the first bad tick and leave it on screen
+                print(f"replay: {e}", file=sys.stderr)
+            tick_speed = 0.0
+            accumulator = 0.0
+            break
+        # Autosave on arriving at a new floor, a finished run has nothing to resume
+        if save_writer is not None:
+            if state.game_over or state.game_won:
+                if saved_key is not None:
+                    save_writer.delete()
+                    saved_key = None
+            elif (state.seed, state.floor) != saved_key and not state.in_combat:
+                save_writer.save(state)
+                saved_key = (state.seed, state.floor)
+        for cue in state.events:
+            if cue == "attack":
+                assets.play("attack")
+            elif cue == "enemy_attack":
+                assets.play("enemy_attack")
+
+        # Re-bake the terrain only when a new floor was generated
+        if terrain is None or terrain.grid is not state.grid:
+            terrain = TerrainCache(state.grid, atlas, state.explored)
+        with profiler.phase("fov"):
+            terrain.invalidate(state.update_fov())
+        camera = camera_origin(state.grid, state.player_x, state.player_y)
+        # Overlays, scrolling and UI text changes need the whole window, plain movement
+        # and the combat popup only their dirty rects
+        overlay_active = state.game_over or state.game_won
+        frame_key = (terrain, camera, state.seed, seed_input_mode, seed_input, state.floor, state.in_combat, show_profile, state.explored_version)
+        # Skip the frame entirely when nothing visible changed, the profile panel
+        # keeps frames coming so its numbers stay meaningful
+        view_key = (frame_key, state.player_x, state.player_y, tuple(state.enemies), state.enemy2, state.boss_pos,
+                    state.game_over, state.game_won, state.player_hp, state.enemy_hp, state.combat_state, state.damage_dealt)
+        if view_key == last_view_key and not show_profile:
+            # The skipped frame's phases would otherwise be billed to the next drawn one
+            profiler.discard_frame()
+            if assets.ready.is_set() and local:
+                timeout = idle_timeout(state, accumulator)
+            else:
+                # A replay's or server's input comes with the next tick, and loading
+                # assets are polled once a frame, so sleep only until that tick
+                timeout = tick_timeout(accumulator, tick_speed)
+            waited_event = pygame.event.wait(timeout) if timeout else pygame.event.wait()
+            if waited_event.type == pygame.NOEVENT:
+                waited_event = None
+            idle_seconds = timeout / 1000
+            continue
+        last_view_key = view_key
+        full_redraw = overlay_active or last_overlay_active or frame_key != last_frame_key
+        last_frame_key = frame_key
+        last_overlay_active = overlay_active
+
         # Draw everything
-        screen.fill(BLACK)
-        draw_ui(screen, ui_font, seed, seed_input_mode, seed_input, floor)
-        draw_grid(screen, grid, player_x, player_y, enemies, enemy2, tile_images, boss_pos)
-        if not game_over and not game_won:
-            if in_combat:
-                draw_combat_ui(screen, ui_font, combat_enemy_type, tile_images, player_hp, enemy_hp, player_max_hp, enemy_max_hp, combat_state, damage_dealt)
-        if game_over:
-            draw_game_over_screen(screen, ui_font)
-        if game_won:
-            draw_game_win_screen(screen, ui_font)
-        pygame.display.flip()
-        clock.tick(30)
-
-
-
-def draw_game_win_screen(screen, ui_font):
-    overlay = pygame.Surface((WINDOW_WIDTH, WINDOW_HEIGHT))
-    overlay.set_alpha(180)
-    overlay.fill((0, 0, 0))
-    screen.blit(overlay, (0, 0))
-    win_font = pygame.font.SysFont("monospace", 72)
-    win_text = win_font.render("YOU WIN!", True, (0, 255, 0))
-    win_rect = win_text.get_rect(center=(WINDOW_WIDTH // 2, WINDOW_HEIGHT // 2 - 50))
-    screen.blit(win_text, win_rect)
-    instruction_text = ui_font.render("Press SPACE to play again", True, WHITE)
-    instruction_rect = instruction_text.get_rect(center=(WINDOW_WIDTH // 2, WINDOW_HEIGHT // 2 + 50))
-    screen.blit(instruction_text, instruction_rect)
+        dirty_rects = None if full_redraw else prev_sprite_rects
+        with profiler.phase("draw_overlays"):
+            if full_redraw:
+                screen.fill(BLACK)
+                draw_ui(screen, ui_font, text_cache, state.seed, seed_input_mode, seed_input, state.floor)
+        with profiler.phase("draw_grid"):
+            sprite_rects = draw_grid(screen, terrain, camera, state.player_x, state.player_y, state.enemies, state.enemy2, state.boss_pos, dirty_rects, state.visible)
+        update_rects = prev_sprite_rects + sprite_rects
+        with profiler.phase("draw_combat_ui"):
+            if not state.game_over and not state.game_won:
+                if state.in_combat:
+                    if not assets.combat_loaded:
+                        # The first fight decodes the combat art
+                        assets.load_combat()
+                        combat_renderer.reset()
+                    update_rects.append(combat_renderer.draw(screen, state.combat_enemy_type, state.player_hp, state.enemy_hp, state.player_max_hp, state.enemy_max_hp, state.combat_state, state.damage_dealt))
+        with profiler.phase("draw_overlays"):
+            if state.game_over:
+                game_over_screen.draw(screen)
+            if state.game_won:
+                game_win_screen.draw(screen)
+            # The panel is opaque, so it covers any sprite redrawn underneath it
+            if show_profile:
+                update_rects.append(profile_overlay.draw(screen, (10, 50)))
+        with profiler.phase("flip"):
+            if full_redraw:
+                pygame.display.flip()
+            else:
+                pygame.display.update(update_rects)
+        prev_sprite_rects = sprite_rects
+        profiler.end_frame()
+        clock.tick(fps)
+
+
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main(sys.argv[1:])
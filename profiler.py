@@ -0,0 +1,64 @@
+# Per-phase frame timing for the main loop. Keeps a rolling window of samples
+# per phase for p50/p95/p99 and can append one JSON record per frame to a file.
+# No pygame dependency, so headless runs can use it too.
+import json
+from time import perf_counter_ns
+from collections import deque
+from contextlib import contextmanager
+
+PROFILE_WINDOW = 300  # Frames kept for the rolling percentiles (10 s at 30 FPS)
+PHASES = ("events", "combat", "stairs", "enemies", "fov", "draw_grid", "draw_combat_ui", "draw_overlays", "flip")
+
+def percentile(sorted_samples, fraction):
+    # Nearest-rank percentile of an already sorted list
+    if not sorted_samples:
+        return 0
+    index = min(len(sorted_samples) - 1, int(fraction * len(sorted_samples)))
+    return sorted_samples[index]
+
+class FrameProfiler:
+    def __init__(self, window=PROFILE_WINDOW, record_path=None):
+        self.samples = {name: deque(maxlen=window) for name in PHASES + ("frame",)}
+        self.current = dict.fromkeys(PHASES, 0)
+        self.frame_index = 0
+        self.record_file = open(record_path, "w") if record_path else None
+
+    @contextmanager
+    def phase(self, name):
+        start = perf_counter_ns()
+        try:
+            yield
+        finally:
+            self.current[name] += perf_counter_ns() - start
+
+    def end_frame(self):
+        # Close the frame's books: push each phase into its window and optionally log it
+        total = 0
+        for name in PHASES:
+            elapsed = self.current[name]
+            self.samples[name].append(elapsed)
+            total += elapsed
+        self.samples["frame"].append(total)
+        if self.record_file is not None:
+            record = {"frame": self.frame_index, "total_ns": total}
+            record.update((f"{name}_ns", self.current[name]) for name in PHASES)
+            self.record_file.write(json.dumps(record) + "\n")
+        self.current = dict.fromkeys(PHASES, 0)
+        self.frame_index += 1
+
+    def discard_frame(self):
+        # Drop what was timed for a frame that is skipped rather than drawn
+        self.current = dict.fromkeys(PHASES, 0)
+
+    def stats(self):
+        # {phase: (p50, p95, p99)} in milliseconds over the rolling window
+        result = {}
+        for name, samples in self.samples.items():
+            ordered = sorted(samples)
+            result[name] = tuple(percentile(ordered, q) / 1e6 for q in (0.50, 0.95, 0.99))
+        return result
+
+    def close(self):
+        if self.record_file is not None:
+            self.record_file.close()
+            self.record_file = None
@@ -0,0 +1,257 @@
+# Binary protocol between server.py and its clients. Every message is a header
+# (type, payload length) and a payload, little-endian.
+#
+# Client to server:
+#   JOIN      seed (int64), starts a new game on the connection's session
+#   ACTION    index into engine.ACTIONS
+# Server to client:
+#   SNAPSHOT  new game flag, seed, tick, floor, map size, stairs, max hp and the
+#             zlib-compressed grid as tile codes, then a delta body with every
+#             field. Sent on a new game and whenever the floor (so the grid) changes.
+#   DELTA     tick, a bitmask of the fields that changed since the last message,
+#             then those fields in bit order
+#
+# The pygame client only renders: StateMirror rebuilds the fields main() draws
+# from and RemoteState adds the socket, so main.py --connect can draw it like a
+# local GameState.
+import zlib
+import errno
+import socket
+import struct
+
+from engine import ACTIONS, TILE_CODES, TILE_SYMBOLS, ArrayGrid, GameState, check_seed
+
+JOIN, ACTION, SNAPSHOT, DELTA = 1, 2, 3, 4
+HEADER = struct.Struct("<BI")
+JOIN_BODY = struct.Struct("<q")
+ACTION_BODY = struct.Struct("<B")
+SNAPSHOT_HEAD = struct.Struct("<BqIHHHBHHBHHhI")
+DELTA_HEAD = struct.Struct("<IB")
+POSITION = struct.Struct("<HH")
+OPTIONAL_POSITION = struct.Struct("<BHH")
+HP = struct.Struct("<h")
+COUNT = struct.Struct("<H")
+COMBAT = struct.Struct("<BBBhhh")
+FLAGS = struct.Struct("<B")
+ACTION_CODES = {action: code for code, action in enumerate(ACTIONS)}
+COMBAT_STATES = ("player_turn", "enemy_turn", "victory", "defeat", "fled")
+ENEMY_TYPES = (None, "enemy", "enemy2", "boss")
+EVENTS = ("attack", "enemy_attack")
+
+# Delta field bits, also the order of the fields in a delta body
+PLAYER_POS, PLAYER_HP, ENEMIES, ENEMY2, BOSS_POS, COMBAT_FIELDS, GAME_FLAGS, EVENT_FLAGS = (1 << bit for bit in range(8))
+ALL_FIELDS = 0x7F  # Everything but events, which only exist in the tick they happened
+
+def parse_address(text):
+    # "HOST:PORT" for TCP or "unix:PATH" for a UNIX socket, as (family, address)
+    if text.startswith("unix:"):
+        return socket.AF_UNIX, text[5:]
+    host, _, port = text.rpartition(":")
+    return socket.AF_INET, (host or "127.0.0.1", int(port))
+
+def message(kind, payload=b""):
+    return HEADER.pack(kind, len(payload)) + payload
+
+def join_message(seed):
+    # ValueError for a seed JOIN_BODY can't carry
+    return message(JOIN, JOIN_BODY.pack(check_seed(seed)))
+
+def action_message(action):
+    return message(ACTION, ACTION_BODY.pack(ACTION_CODES[action]))
+
+def state_fields(state):
+    # What a client draws, in delta bit order. Compared against the last fields
+    # sent to find the changed ones.
+    return (
+        (state.player_x, state.player_y),
+        state.player_hp,
+        tuple(state.enemies),
+        state.enemy2,
+        state.boss_pos,
+        (state.in_combat, state.combat_state, state.combat_enemy_type, state.enemy_hp, state.enemy_max_hp, state.damage_dealt),
+        (state.game_over, state.game_won),
+    )
+
+def pack_position(pos):
+    return OPTIONAL_POSITION.pack(pos is not None, *(pos or (0, 0)))
+
+def delta_body(fields, mask, events=()):
+    parts = []
+    (player_pos, player_hp, enemies, enemy2, boss_pos, combat, flags) = fields
+    if events:
+        mask |= EVENT_FLAGS
+    if mask & PLAYER_POS:
+        parts.append(POSITION.pack(*player_pos))
+    if mask & PLAYER_HP:
+        parts.append(HP.pack(player_hp))
+    if mask & ENEMIES:
+        parts.append(COUNT.pack(len(enemies)))
+        parts.extend(POSITION.pack(*pos) for pos in enemies)
+    if mask & ENEMY2:
+        parts.append(pack_position(enemy2))
+    if mask & BOSS_POS:
+        parts.append(pack_position(boss_pos))
+    if mask & COMBAT_FIELDS:
+        in_combat, combat_state, enemy_type, enemy_hp, enemy_max_hp, damage = combat
+        parts.append(COMBAT.pack(in_combat, COMBAT_STATES.index(combat_state), ENEMY_TYPES.index(enemy_type),
+                                 enemy_hp, enemy_max_hp, -1 if damage is None else damage))
+    if mask & GAME_FLAGS:
+        parts.append(FLAGS.pack(flags[0] | flags[1] << 1))
+    if mask & EVENT_FLAGS:
+        parts.append(FLAGS.pack(sum(1 << EVENTS.index(cue) for cue in set(events) if cue in EVENTS)))
+    return mask, b"".join(parts)
+
+def encode_delta(previous, fields, tick, events=()):
+    # DELTA for what changed between two state_fields() tuples, None if nothing did
+    mask = 0
+    for bit, (old, new) in enumerate(zip(previous, fields)):
+        if old != new:
+            mask |= 1 << bit
+    if not mask and not events:
+        return None
+    mask, body = delta_body(fields, mask, events)
+    return message(DELTA, DELTA_HEAD.pack(tick, mask) + body)
+
+def encode_snapshot(state, fields, tick, new_game, events=()):
+    grid = state.grid
+    if isinstance(grid, ArrayGrid):
+        codes = grid.cells.tobytes()
+    else:
+        codes = bytes(TILE_CODES[cell] for row in grid for cell in row)
+    packed_grid = zlib.compress(codes)
+    up, down = state.stairs_up_pos, state.stairs_down_pos
+    head = SNAPSHOT_HEAD.pack(new_game, state.seed, tick, state.floor, len(grid[0]), len(grid),
+                              up is not None, *(up or (0, 0)), down is not None, *(down or (0, 0)),
+                              state.player_max_hp, len(packed_grid))
+    mask, body = delta_body(fields, ALL_FIELDS, events)
+    return message(SNAPSHOT, head + packed_grid + DELTA_HEAD.pack(tick, mask) + body)
+
+class StateMirror:
+    # Client-side copy of a session, updated by feed(). Field names follow
+    # GameState so the renderer reads either. The explored bitmap and the field of
+    # view are worked out here from the grid, the server never sends them.
+    update_fov = GameState.update_fov
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.grid = None
+        self.server_tick = 0
+        self.seed = None
+        self.floor = 0
+        self.events = []
+        self.visible = set()
+        self.fov_key = None
+        self.explored = bytearray()
+        self.explored_floors = {}  # (seed, floor) -> explored bitmap, the map is remembered per floor
+        self.explored_version = 0
+        self.messages = 0
+
+    def feed(self, data):
+        # Apply every complete message in data plus whatever was left over
+        self.buffer += data
+        offset = 0
+        while len(self.buffer) - offset >= HEADER.size:
+            kind, length = HEADER.unpack_from(self.buffer, offset)
+            end = offset + HEADER.size + length
+            if end > len(self.buffer):
+                break
+            payload = bytes(self.buffer[offset + HEADER.size:end])
+            if kind == SNAPSHOT:
+                self.read_snapshot(payload)
+            elif kind == DELTA:
+                self.read_delta(payload)
+            self.messages += 1
+            offset = end
+        del self.buffer[:offset]
+
+    def read_snapshot(self, payload):
+        (new_game, self.seed, _, self.floor, width, height, has_up, up_x, up_y, has_down, down_x, down_y,
+         self.player_max_hp, grid_size) = SNAPSHOT_HEAD.unpack_from(payload, 0)
+        offset = SNAPSHOT_HEAD.size
+        codes = zlib.decompress(payload[offset:offset + grid_size])
+        self.grid = [[TILE_SYMBOLS[code] for code in codes[y * width:(y + 1) * width]] for y in range(height)]
+        self.stairs_up_pos = (up_x, up_y) if has_up else None
+        self.stairs_down_pos = (down_x, down_y) if has_down else None
+        if new_game:
+            self.explored_floors.clear()
+        self.explored = self.explored_floors.setdefault((self.seed, self.floor), bytearray(width * height))
+        self.explored_version += 1
+        self.read_delta(payload[offset + grid_size:])
+
+    def read_delta(self, payload):
+        self.server_tick, mask = DELTA_HEAD.unpack_from(payload, 0)
+        offset = DELTA_HEAD.size
+        if mask & PLAYER_POS:
+            self.player_x, self.player_y = POSITION.unpack_from(payload, offset)
+            offset += POSITION.size
+        if mask & PLAYER_HP:
+            self.player_hp, = HP.unpack_from(payload, offset)
+            offset += HP.size
+        if mask & ENEMIES:
+            count, = COUNT.unpack_from(payload, offset)
+            offset += COUNT.size
+            self.enemies = [POSITION.unpack_from(payload, offset + i * POSITION.size) for i in range(count)]
+            offset += count * POSITION.size
+        if mask & ENEMY2:
+            has_pos, x, y = OPTIONAL_POSITION.unpack_from(payload, offset)
+            self.enemy2 = (x, y) if has_pos else None
+            offset += OPTIONAL_POSITION.size
+        if mask & BOSS_POS:
+            has_pos, x, y = OPTIONAL_POSITION.unpack_from(payload, offset)
+            self.boss_pos = (x, y) if has_pos else None
+            offset += OPTIONAL_POSITION.size
+        if mask & COMBAT_FIELDS:
+            in_combat, combat_state, enemy_type, self.enemy_hp, self.enemy_max_hp, damage = COMBAT.unpack_from(payload, offset)
+            self.in_combat = bool(in_combat)
+            self.combat_state = COMBAT_STATES[combat_state]
+            self.combat_enemy_type = ENEMY_TYPES[enemy_type]
+            self.damage_dealt = None if damage < 0 else damage
+            offset += COMBAT.size
+        if mask & GAME_FLAGS:
+            flags, = FLAGS.unpack_from(payload, offset)
+            self.game_over, self.game_won = bool(flags & 1), bool(flags & 2)
+            offset += FLAGS.size
+        if mask & EVENT_FLAGS:
+            flags, = FLAGS.unpack_from(payload, offset)
+            self.events.extend(cue for bit, cue in enumerate(EVENTS) if flags >> bit & 1)
+            offset += FLAGS.size
+
+class RemoteState(StateMirror):
+    # A session on a server, driven like a GameState: apply() and new_game() send
+    # input, tick() takes in whatever the server sent since the last call.
+    def __init__(self, address, seed=None):
+        super().__init__()
+        family, target = parse_address(address)
+        self.socket = socket.socket(family, socket.SOCK_STREAM)
+        self.socket.connect(target)
+        if family == socket.AF_INET:
+            self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.socket.sendall(join_message(42 if seed is None else seed))
+        # Block for the first snapshot so there is something to draw
+        while self.grid is None:
+            data = self.socket.recv(65536)
+            if not data:
+                raise ConnectionError("server closed the connection")
+            self.feed(data)
+        self.socket.setblocking(False)
+
+    def apply(self, action):
+        self.socket.sendall(action_message(action))
+
+    def new_game(self, seed=None):
+        self.socket.sendall(join_message(self.seed if seed is None else seed))
+
+    def tick(self, profiler=None):
+        while True:
+            try:
+                data = self.socket.recv(65536)
+            except OSError as e:
+                if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    return
+                raise
+            if not data:
+                raise ConnectionError("server closed the connection")
+            self.feed(data)
+
+    def close(self):
+        self.socket.close()
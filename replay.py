@@ -0,0 +1,146 @@
+# Input recordings. main() records every player action against the tick it was
+# applied before, plus the state the session started from, and replaying feeds
+# the same actions back through GameState at the same ticks. A running hash of
+# the game state is recorded after every tick, so a replay that drifts is caught
+# at the first tick that differs rather than wherever the symptoms show.
+#
+#   python replay.py last_session.replay
+#
+# Layout: header (magic, version, start size), the start state as a savegame.py
+# save, then records tagged by their first byte:
+#   0            tick ran, followed by the running state hash (uint32)
+#   1..          player action, index into engine.ACTIONS plus one
+#   255          new game, followed by the seed as length-prefixed ASCII digits,
+#                at most 20 as seeds are int64 (engine.check_seed)
+import os
+import sys
+import time
+import zlib
+import struct
+import argparse
+
+import savegame
+from engine import ACTIONS, check_seed
+
+REPLAY_MAGIC = b"RLRP"
+REPLAY_VERSION = 1
+REPLAY_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "last_session.replay")
+HEADER = struct.Struct("<4sBI")
+TICK = 0
+NEW_GAME = 255
+TICK_RECORD = struct.Struct("<BI")
+ACTION_CODES = {action: code for code, action in enumerate(ACTIONS, 1)}
+FLUSH_TICKS = 300  # Flush the recording every 10 s of game time, a crash loses at most that
+
+class ReplayDivergence(Exception):
+    def __init__(self, tick):
+        super().__init__(f"replay diverged at tick {tick}")
+        self.tick = tick
+
+def state_hash(state, running=0):
+    # Everything game logic reads back, chained onto the previous tick's hash.
+    # repr() of ints, strings and tuples is stable across processes, unlike hash().
+    key = (state.seed, state.floor, state.player_x, state.player_y, state.player_hp, state.enemies,
+           state.enemy2, state.boss_pos, state.enemy_move_counter, state.in_combat, state.combat_state,
+           state.combat_enemy_type, state.enemy_hp, state.enemy_turn_delay, state.player_defending,
+           state.damage_dealt, state.game_over, state.game_won)
+    return zlib.crc32(repr(key).encode(), running)
+
+class Recorder:
+    # Call apply()/new_game() alongside the GameState calls and tick() after each
+    # state.tick(). Must be created before the first tick of the session.
+    def __init__(self, state, path=REPLAY_PATH):
+        self.state = state
+        self.hash = 0
+        start = savegame.pack_state(state)
+        self.file = open(path, "wb")
+        self.file.write(HEADER.pack(REPLAY_MAGIC, REPLAY_VERSION, len(start)))
+        self.file.write(start)
+
+    def apply(self, action):
+        self.file.write(bytes((ACTION_CODES[action],)))
+
+    def new_game(self, seed):
+        digits = str(check_seed(seed)).encode()
+        self.file.write(bytes((NEW_GAME, len(digits))) + digits)
+
+    def tick(self):
+        self.hash = state_hash(self.state, self.hash)
+        self.file.write(TICK_RECORD.pack(TICK, self.hash))
+        if self.state.tick_count % FLUSH_TICKS == 0:
+            self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+class ReplayPlayer:
+    # Rebuilds the recorded start state, step() then runs the recording one tick
+    # at a time. kwargs go to GameState.
+    def __init__(self, path, **kwargs):
+        with open(path, "rb") as f:
+            self.data = f.read()
+        try:
+            magic, version, start_size = HEADER.unpack_from(self.data, 0)
+        except struct.error:
+            raise ValueError("not a replay file")
+        if magic != REPLAY_MAGIC or version != REPLAY_VERSION:
+            raise ValueError(f"not a version {REPLAY_VERSION} replay file")
+        self.offset = HEADER.size + start_size
+        # Same random streams as the recorded session, not the fresh ones a resume gets
+        self.state = savegame.loads(self.data[HEADER.size:self.offset], fresh_streams=False, **kwargs)
+        self.hash = 0
+        self.actions = 0
+
+    def step(self, profiler=None):
+        # Apply the actions recorded before the next tick and run it. Returns False
+        # at the end of the recording, raises ReplayDivergence if the state hash
+        # after the tick differs from the recorded one.
+        data = self.data
+        state = self.state
+        while self.offset < len(data):
+            code = data[self.offset]
+            if code == TICK:
+                if self.offset + TICK_RECORD.size > len(data):
+                    break  # Cut off by a crash mid-write
+                expected = TICK_RECORD.unpack_from(data, self.offset)[1]
+                self.offset += TICK_RECORD.size
+                state.tick(profiler)
+                self.hash = state_hash(state, self.hash)
+                if self.hash != expected:
+                    raise ReplayDivergence(state.tick_count)
+                return True
+            if code == NEW_GAME:
+                length = data[self.offset + 1] if self.offset + 1 < len(data) else 0
+                digits = data[self.offset + 2:self.offset + 2 + length]
+                if not length or len(digits) < length:
+                    break
+                self.offset += 2 + length
+                state.new_game(int(digits))
+            else:
+                self.offset += 1
+                state.apply(ACTIONS[code - 1])
+            self.actions += 1
+        return False
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay a recorded session headless at full speed and check it for divergence")
+    parser.add_argument("path", nargs="?", default=REPLAY_PATH)
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    player = ReplayPlayer(args.path)
+    try:
+        while player.step():
+            pass
+    except ReplayDivergence as e:
+        print(f"{args.path}: {e}")
+        return 1
+    elapsed = time.perf_counter() - start
+    state = player.state
+    print(f"{args.path}: {state.tick_count} ticks, {player.actions} actions replayed in {elapsed:.2f}s "
+          f"({state.tick_count / max(elapsed, 1e-9):.0f} ticks/s), no divergence")
+    print(f"  ended on floor {state.floor}, hp {state.player_hp}, game over {state.game_over}, won {state.game_won}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
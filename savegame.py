@@ -0,0 +1,163 @@
+# Compact binary saves. create_dungeon is deterministic for a (seed, floor), so a
+# save holds the seed, the player and, per floor the player has seen, only what
+# changed: surviving entities and the explored bitmap. Writes happen on a
+# background thread and replace the file atomically, loads read it through mmap
+# and regenerate just the current floor.
+#
+# Layout, little-endian:
+#   header  magic, version, seed, map width/height, floor, place_up_stairs,
+#           player x/y, player hp, enemy move counter, rng epoch, floor count,
+#           mode flags (bit 0 endless, bits 1-3 index into engine.GENERATORS;
+#           version 1 saves have none)
+#   floor   floor, place_up_stairs, enemy count, enemy2 flag/x/y, boss flag/x/y,
+#           then enemy x/y pairs and the explored bitmap packed 8 cells a byte
+import os
+import mmap
+import queue
+import struct
+import logging
+import threading
+from itertools import compress
+
+from engine import GENERATORS, GameState
+
+logger = logging.getLogger(__name__)
+
+SAVE_MAGIC = b"RLSV"
+SAVE_VERSION = 2
+SAVE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "savegame.dat")
+HEADER = struct.Struct("<4sBqHHHBHHhHHHB")
+HEADER_V1 = struct.Struct("<4sBqHHHBHHhHHH")
+ENDLESS = 1
+GENERATOR_SHIFT = 1
+GENERATOR_NAMES = list(GENERATORS)
+FLOOR = struct.Struct("<HBHBHHBHH")
+POSITION = struct.Struct("<HH")
+
+def pack_bits(cells):
+    bits = bytearray((len(cells) + 7) // 8)
+    for i in compress(range(len(cells)), cells):
+        bits[i >> 3] |= 1 << (i & 7)
+    return bits
+
+def unpack_bits(bits, count):
+    cells = bytearray(count)
+    for byte_index, byte in enumerate(bits):
+        if byte:
+            for bit in range(8):
+                if byte >> bit & 1:
+                    cells[byte_index * 8 + bit] = 1
+    return cells
+
+def mode_flags(state):
+    return (ENDLESS if state.endless else 0) | GENERATOR_NAMES.index(state.generator) << GENERATOR_SHIFT
+
+def pack_state(state):
+    # Serialise on the caller's thread so the snapshot is consistent, writing is the slow part
+    width, height = state.floor_cache.width, state.floor_cache.height
+    floors = list(state.changed_floors())
+    parts = [HEADER.pack(SAVE_MAGIC, SAVE_VERSION, state.seed, width, height, state.floor, state.place_up_stairs,
+                         state.player_x, state.player_y, state.player_hp, state.enemy_move_counter,
+                         state.rng_epoch, len(floors), mode_flags(state))]
+    for (_, floor, place_up_stairs, _), enemies, enemy2, boss_pos, explored in floors:
+        parts.append(FLOOR.pack(floor, place_up_stairs, len(enemies),
+                                enemy2 is not None, *(enemy2 or (0, 0)),
+                                boss_pos is not None, *(boss_pos or (0, 0))))
+        parts.extend(POSITION.pack(*pos) for pos in enemies)
+        parts.append(pack_bits(explored))
+    return b"".join(parts)
+
+def load(path=SAVE_PATH, **kwargs):
+    # GameState resumed from a save file, kwargs go to GameState. Raises
+    # ValueError for a file that is not a save of this or the previous version.
+    with open(path, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            return loads(data, **kwargs)
+
+def loads(data, fresh_streams=True, **kwargs):
+    # Same from a bytes-like object. fresh_streams moves the AI and combat
+    # streams on to a new epoch so reloading doesn't repeat the same rolls;
+    # replays turn it off to restart exactly where the recording started.
+    try:
+        magic, version = struct.unpack_from("<4sB", data, 0)
+        # Version 1 is the same without the mode flags, a classic game
+        header = HEADER_V1 if version == 1 else HEADER
+        (magic, version, seed, width, height, floor, place_up_stairs, player_x, player_y,
+         player_hp, enemy_move_counter, rng_epoch, floor_count, *flags) = header.unpack_from(data, 0)
+    except struct.error:
+        raise ValueError("not a save file")
+    if magic != SAVE_MAGIC or version not in (1, SAVE_VERSION):
+        raise ValueError(f"not a version {SAVE_VERSION} save file")
+    flags = flags[0] if flags else 0
+    generator = flags >> GENERATOR_SHIFT & 7
+    if generator >= len(GENERATOR_NAMES):
+        raise ValueError("save from an unknown dungeon generator")
+    offset = header.size
+    cells = width * height
+    bitmap_size = (cells + 7) // 8
+    floors = []
+    try:
+        for _ in range(floor_count):
+            (floor_number, floor_up, enemy_count, has_enemy2, enemy2_x, enemy2_y,
+             has_boss, boss_x, boss_y) = FLOOR.unpack_from(data, offset)
+            offset += FLOOR.size
+            enemies = [POSITION.unpack_from(data, offset + i * POSITION.size) for i in range(enemy_count)]
+            offset += enemy_count * POSITION.size
+            if offset + bitmap_size > len(data):
+                raise ValueError("truncated save file")
+            explored = unpack_bits(data[offset:offset + bitmap_size], cells)
+            offset += bitmap_size
+            floors.append(((seed, floor_number, bool(floor_up), True), enemies,
+                           (enemy2_x, enemy2_y) if has_enemy2 else None,
+                           (boss_x, boss_y) if has_boss else None, explored))
+    except struct.error:
+        raise ValueError("truncated save file")
+    state = GameState(seed=seed, width=width, height=height, start=False, endless=bool(flags & ENDLESS),
+                      generator=GENERATOR_NAMES[generator], **kwargs)
+    state.resume(seed, floor, bool(place_up_stairs), (player_x, player_y), player_hp,
+                 enemy_move_counter, rng_epoch + 1 if fresh_streams else rng_epoch, floors)
+    return state
+
+class SaveWriter:
+    # Writes saves on a background thread so autosave never stalls a frame. Each
+    # write goes to a temporary file that then replaces the save, so a crash
+    # mid-write leaves the previous save intact.
+    def __init__(self, path=SAVE_PATH):
+        self.path = path
+        self.jobs = queue.Queue()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def save(self, state):
+        try:
+            data = pack_state(state)
+        except struct.error as e:
+            # A state the format can't hold skips this autosave instead of ending the game
+            logger.warning("autosave failed: %s", e)
+            return
+        self.jobs.put(data)
+
+    def delete(self):
+        # Queued behind pending writes, so a late autosave can't bring the file back
+        self.jobs.put(b"")
+
+    def run(self):
+        while True:
+            data = self.jobs.get()
+            if data is None:
+                return
+            if not data:
+                if os.path.exists(self.path):
+                    os.remove(self.path)
+                continue
+            tmp = self.path + ".tmp"
+            with open(tmp, "wb") as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.path)
+
+    def close(self):
+        # Finish pending writes, called on quit
+        self.jobs.put(None)
+        self.thread.join()
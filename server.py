@@ -0,0 +1,252 @@
+# Many independent game sessions in one asyncio process. Each connection owns a
+# GameState. All sessions share one tick scheduler: a session only runs tick()
+# on the ticks where ticks_until_change() says something happens and is caught
+# up with skip_ticks() in between, so an idle session costs nothing per tick.
+# Clients get protocol.py messages, a snapshot per new floor and then only the
+# fields that changed.
+#
+#   python server.py --listen 127.0.0.1:7777
+#   python server.py --listen unix:/tmp/roguelike.sock
+import os
+import sys
+import socket
+import asyncio
+import argparse
+from time import perf_counter
+
+import protocol
+from engine import ACTIONS, GENERATORS, GRID_WIDTH, GRID_HEIGHT, TICK_RATE, GameState, parse_map_size
+
+SERVER_ADDRESS = "127.0.0.1:7777"
+TICK_SECONDS = 1 / TICK_RATE
+MAX_TICKS_PER_WAKE = 15  # Further behind than this, the server drops ticks instead of catching up
+MAX_WRITE_BUFFER = 1 << 20  # A client this far behind on reading is disconnected
+MAX_NEW_GAMES_PER_TICK = 20  # Dungeon generation is the costly part of a JOIN, a burst is spread over ticks
+STATS_SECONDS = 5
+
+class Session(asyncio.Protocol):
+    # One connection and its game. Input is queued as it arrives and applied by
+    # the scheduler before the next tick, like main() applies key presses.
+    def __init__(self, server):
+        self.server = server
+        self.transport = None
+        self.buffer = bytearray()
+        self.state = None
+        self.inputs = []
+        self.synced = 0     # Server tick the state has been advanced to
+        self.due = None     # Server tick of the next tick() that changes something
+        self.fields = None  # Last protocol.state_fields() sent
+        self.grid = None    # Grid of the last snapshot
+        self.new_game = False
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.server.sessions.add(self)
+
+    def connection_lost(self, exc):
+        self.server.drop(self)
+
+    def data_received(self, data):
+        self.buffer += data
+        offset = 0
+        header = protocol.HEADER
+        while len(self.buffer) - offset >= header.size:
+            kind, length = header.unpack_from(self.buffer, offset)
+            end = offset + header.size + length
+            if end > len(self.buffer):
+                break
+            if kind == protocol.JOIN and length == protocol.JOIN_BODY.size:
+                self.inputs.append(protocol.JOIN_BODY.unpack_from(self.buffer, offset + header.size)[0])
+            elif kind == protocol.ACTION and length == protocol.ACTION_BODY.size:
+                code = self.buffer[offset + header.size]
+                if code < len(ACTIONS):
+                    self.inputs.append(ACTIONS[code])
+            else:
+                self.transport.close()
+                return
+            offset = end
+            self.server.messages_in += 1
+        del self.buffer[:offset]
+        if self.inputs:
+            self.server.input_ready.add(self)
+
+    def catch_up(self, tick):
+        # Nothing changes before self.due, so the ticks up to there are skipped in bulk
+        if tick > self.synced:
+            self.state.skip_ticks(tick - self.synced)
+            self.synced = tick
+
+    def handle_inputs(self, tick):
+        inputs, self.inputs = self.inputs, []
+        for index, item in enumerate(inputs):
+            if isinstance(item, int):
+                # JOIN: a new game on this session, or on a later tick if this one has had enough
+                if self.server.new_games >= MAX_NEW_GAMES_PER_TICK:
+                    self.inputs = inputs[index:]
+                    break
+                self.server.new_games += 1
+                if self.state is None:
+                    self.state = GameState(seed=item, width=self.server.width, height=self.server.height, endless=self.server.endless, generator=self.server.generator)
+                    self.synced = tick
+                else:
+                    self.catch_up(tick)
+                    self.state.new_game(item)
+                self.new_game = True
+            elif self.state is not None:
+                self.catch_up(tick)
+                restart = item == "restart" and (self.state.game_over or self.state.game_won)
+                self.state.apply(item)
+                self.new_game = self.new_game or restart
+        if self.state is not None:
+            self.send_changes(tick)
+
+    def run_tick(self, tick):
+        self.catch_up(tick - 1)
+        self.state.tick()
+        self.synced = tick
+        self.send_changes(tick)
+
+    def send_changes(self, tick):
+        state = self.state
+        fields = protocol.state_fields(state)
+        if state.grid is not self.grid or self.new_game:
+            data = protocol.encode_snapshot(state, fields, tick, self.new_game, state.events)
+            self.grid = state.grid
+            self.new_game = False
+        else:
+            data = protocol.encode_delta(self.fields, fields, tick, state.events)
+        self.fields = fields
+        state.events = []
+        if data is not None:
+            self.transport.write(data)
+            self.server.messages_out += 1
+            self.server.bytes_out += len(data)
+            if self.transport.get_write_buffer_size() > MAX_WRITE_BUFFER:
+                self.transport.abort()
+
+class GameServer:
+    def __init__(self, width=GRID_WIDTH, height=GRID_HEIGHT, endless=False, generator="classic"):
+        self.width = width
+        self.height = height
+        self.endless = endless
+        self.generator = generator
+        self.tick = 0
+        self.sessions = set()
+        self.input_ready = set()
+        self.wheel = {}  # Server tick -> sessions whose state changes on it
+        self.new_games = 0
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.messages_in = 0
+        self.messages_out = 0
+        self.bytes_out = 0
+        self.ticks = 0
+        self.session_ticks = 0
+        self.dropped_ticks = 0
+        self.tick_seconds = 0.0
+        self.max_tick_seconds = 0.0
+
+    def drop(self, session):
+        self.sessions.discard(session)
+        self.input_ready.discard(session)
+        self.unschedule(session)
+
+    def unschedule(self, session):
+        if session.due is not None:
+            bucket = self.wheel.get(session.due)
+            if bucket is not None:
+                bucket.discard(session)
+            session.due = None
+
+    def schedule(self, session):
+        self.unschedule(session)
+        ticks = session.state.ticks_until_change()
+        if ticks is not None:
+            session.due = session.synced + ticks
+            self.wheel.setdefault(session.due, set()).add(session)
+
+    def run_tick(self):
+        # Input first, then every session due on the new tick. Sessions with
+        # input left over (a JOIN over the new game budget) stay ready.
+        ready, self.input_ready = self.input_ready, set()
+        self.new_games = 0
+        for session in ready:
+            if session.transport.is_closing():
+                continue
+            session.handle_inputs(self.tick)
+            if session.state is not None:
+                self.schedule(session)
+            if session.inputs:
+                self.input_ready.add(session)
+        self.tick += 1
+        due = self.wheel.pop(self.tick, ())
+        for session in due:
+            session.due = None
+            session.run_tick(self.tick)
+            self.schedule(session)
+        self.session_ticks += len(due)
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        next_time = loop.time()
+        next_stats = next_time + STATS_SECONDS
+        while True:
+            now = loop.time()
+            ticks = 0
+            while now >= next_time and ticks < MAX_TICKS_PER_WAKE:
+                start = perf_counter()
+                self.run_tick()
+                elapsed = perf_counter() - start
+                self.tick_seconds += elapsed
+                self.max_tick_seconds = max(self.max_tick_seconds, elapsed)
+                self.ticks += 1
+                ticks += 1
+                next_time += TICK_SECONDS
+            if now >= next_time:
+                # Too far behind to catch up, let game time slip
+                self.dropped_ticks += int((now - next_time) / TICK_SECONDS) + 1
+                next_time = now + TICK_SECONDS
+            if now >= next_stats:
+                self.print_stats(now - next_stats + STATS_SECONDS)
+                next_stats = now + STATS_SECONDS
+            await asyncio.sleep(next_time - loop.time())
+
+    def print_stats(self, seconds):
+        mean_ms = self.tick_seconds / max(self.ticks, 1) * 1000
+        print(f"sessions={len(self.sessions)} tick={self.tick} ticks/s={self.ticks / seconds:.1f} "
+              f"tick_ms mean={mean_ms:.2f} max={self.max_tick_seconds * 1000:.2f} "
+              f"busy={self.tick_seconds / seconds:.0%} session_ticks/s={self.session_ticks / seconds:.0f} "
+              f"dropped={self.dropped_ticks} in/s={self.messages_in / seconds:.0f} "
+              f"out/s={self.messages_out / seconds:.0f} out_kB/s={self.bytes_out / seconds / 1024:.1f}", flush=True)
+        self.reset_stats()
+
+async def serve(address, width, height, endless=False, generator="classic"):
+    server = GameServer(width, height, endless, generator)
+    loop = asyncio.get_running_loop()
+    family, target = protocol.parse_address(address)
+    if family == socket.AF_UNIX:
+        if os.path.exists(target):
+            os.remove(target)  # Left over from a previous run
+        listener = await loop.create_unix_server(lambda: Session(server), target, backlog=4096)
+    else:
+        listener = await loop.create_server(lambda: Session(server), *target, backlog=4096)
+    print(f"listening on {address}", flush=True)
+    async with listener:
+        await server.run()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Host many game sessions over TCP or a UNIX socket")
+    parser.add_argument("--listen", default=SERVER_ADDRESS, help="HOST:PORT, or unix:PATH for a UNIX socket")
+    parser.add_argument("--map-size", type=parse_map_size, default=(GRID_WIDTH, GRID_HEIGHT), help="map size as WIDTHxHEIGHT")
+    parser.add_argument("--endless", action="store_true", help="host endless games")
+    parser.add_argument("--generator", choices=list(GENERATORS), default="classic", help="dungeon layout generator")
+    args = parser.parse_args(argv)
+    width, height = args.map_size
+    try:
+        asyncio.run(serve(args.listen, width, height, args.endless, args.generator))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,99 @@
+# Sweep a range of seeds through create_dungeon on worker processes and stream
+# per-floor layout metrics to CSV or JSONL, for picking tournament seeds.
+#
+#   python sweep.py --start 0 --count 1000000 --format jsonl --output seeds.jsonl
+import sys
+import os
+import csv
+import json
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+from engine import WALL, FLOOR, LAST_FLOOR, create_dungeon
+
+FLOORS = range(1, LAST_FLOOR + 1)
+FIELDS = [
+    "seed", "floor", "rooms", "floor_cells", "stairs_distance",
+    "enemies", "enemy2", "nearest_enemy", "boss_placed",
+]
+
+def walk_distance(grid, start, goal):
+    # Steps on the shortest walkable path between two cells, None if unreachable
+    if start is None or goal is None:
+        return None
+    height, width = len(grid), len(grid[0])
+    seen = {start}
+    frontier = [start]
+    steps = 0
+    while frontier:
+        if goal in seen:
+            return steps
+        next_frontier = []
+        for (x, y) in frontier:
+            for dx, dy in [(-1,0), (1,0), (0,-1), (0,1)]:
+                nx, ny = x + dx, y + dy
+                if (0 <= nx < width and 0 <= ny < height and
+                    (nx, ny) not in seen and grid[ny][nx] != WALL):
+                    seen.add((nx, ny))
+                    next_frontier.append((nx, ny))
+        frontier = next_frontier
+        steps += 1
+    return None
+
+def floor_metrics(seed, floor):
+    # Metrics for the layout a player sees on first arriving at the floor
+    rooms = []
+    grid, player_start, stairs_up_pos, stairs_down_pos, enemies, enemy2, boss_pos = create_dungeon(seed, floor, rooms=rooms)
+    px, py = player_start
+    nearest = [abs(ex - px) + abs(ey - py) for (ex, ey) in enemies]
+    return {
+        "seed": seed,
+        "floor": floor,
+        "rooms": len(rooms),
+        "floor_cells": sum(row.count(FLOOR) for row in grid),
+        "stairs_distance": walk_distance(grid, stairs_up_pos, stairs_down_pos),
+        "enemies": len(enemies),
+        "enemy2": enemy2 is not None,
+        "nearest_enemy": min(nearest) if nearest else None,
+        "boss_placed": boss_pos is not None if floor == LAST_FLOOR else None,
+    }
+
+def sweep_chunk(seeds):
+    return [floor_metrics(seed, floor) for seed in seeds for floor in FLOORS]
+
+def chunked(start, count, chunk_size):
+    for first in range(start, start + count, chunk_size):
+        yield range(first, min(first + chunk_size, start + count))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Collect create_dungeon metrics over a range of seeds")
+    parser.add_argument("--start", type=int, default=0, help="first seed")
+    parser.add_argument("--count", type=int, default=10000, help="number of seeds")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="worker processes")
+    parser.add_argument("--chunk-size", type=int, default=500, help="seeds per worker task")
+    parser.add_argument("--format", choices=["csv", "jsonl"], default="csv")
+    parser.add_argument("--output", default="-", help="output file, - for stdout")
+    args = parser.parse_args(argv)
+
+    out = sys.stdout if args.output == "-" else open(args.output, "w", newline="")
+    if args.format == "csv":
+        writer = csv.DictWriter(out, fieldnames=FIELDS)
+        writer.writeheader()
+        write_row = writer.writerow
+    else:
+        write_row = lambda row: out.write(json.dumps(row) + "\n")
+
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        # map() hands chunks back in seed order as they finish, so rows stream out
+        for rows in executor.map(sweep_chunk, chunked(args.start, args.count, args.chunk_size)):
+            for row in rows:
+                write_row(row)
+    elapsed = time.perf_counter() - start
+    if out is not sys.stdout:
+        out.close()
+    print(f"{args.count} seeds in {elapsed:.2f}s ({args.count / elapsed:.0f} seeds/s, {args.workers} workers)", file=sys.stderr)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,76 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import random
+
+from engine import ENEMY_MOVE_DELAY, FLOOR, GameState, Occupancy, DistanceMap, choose_step
+
+def kill_enemy(state, pos):
+    # Walk onto the enemy and win the fight, whatever the rolls
+    state.set_player_pos(*pos)
+    state.tick()
+    assert state.in_combat
+    state.enemy_hp = 1
+    state.apply("attack")
+    state.apply("continue")
+    assert state.combat_state == "victory"
+    state.apply("continue")
+    assert not state.in_combat
+
+def take_stairs(state, pos):
+    state.set_player_pos(*pos)
+    state.tick()
+
+def test_floor_one_keeps_its_state_across_stairs():
+    # Regression: floor 1 was cached under a different key on the way back up,
+    # so it was regenerated with its enemies alive and nothing explored
+    state = GameState(seed=3)
+    enemy = state.enemies[0]
+    kill_enemy(state, enemy)
+    state.update_fov()
+    explored = bytes(state.explored)
+    survivors = list(state.enemies)
+
+    take_stairs(state, state.stairs_down_pos)
+    assert state.floor == 2
+    take_stairs(state, state.stairs_up_pos)
+    assert state.floor == 1
+
+    assert enemy not in state.enemies
+    assert state.enemies == survivors
+    assert bytes(state.explored) == explored
+    assert [key[1] for key in state.floor_cache.floors].count(1) == 1
+
+def test_enemies_keep_out_of_the_whole_boss_footprint():
+    # Regression: only the boss's top-left cell was occupied, so an enemy could
+    # step into the other three cells of its 2x2 footprint
+    grid = [[FLOOR] * 6 for _ in range(4)]
+    occupancy = Occupancy.from_floor([(2, 1)], None, (0, 0), (5, 3))
+    distances = DistanceMap()
+    distances.update(grid, (5, 3))
+    steps = {choose_step(grid, distances, occupancy, (2, 1), "wander", rng=random.Random(n)) for n in range(50)}
+    assert (1, 1) not in steps
+    assert steps == {(3, 1), (2, 0), (2, 2)}
+    # The boss itself still moves over its own footprint
+    boss_steps = {choose_step(grid, distances, occupancy, (0, 0), "wander", 2, random.Random(n)) for n in range(50)}
+    assert boss_steps == {(0, 1)}
+    occupancy.move((0, 0), (0, 1))
+    assert occupancy.blocked((1, 2)) and not occupancy.blocked((1, 0))
+
+def test_nothing_happens_after_the_game_ends():
+    # Regression: enemies kept moving after game over and stepped onto the player,
+    # starting fights behind the end screen
+    for ending in ("game_over", "game_won"):
+        state = GameState(seed=3)
+        setattr(state, ending, True)
+        enemies = list(state.enemies)
+        state.set_player_pos(*enemies[0])
+        assert state.ticks_until_change() is None
+        for _ in range(ENEMY_MOVE_DELAY * 3):
+            state.tick()
+        assert not state.in_combat
+        assert state.enemies == enemies
+        state.skip_ticks(ENEMY_MOVE_DELAY * 3)
+        assert state.enemy_move_counter == 0
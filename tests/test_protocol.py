@@ -0,0 +1,43 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+import protocol
+from engine import SEED_MAX, SEED_MIN, GameState
+
+def test_snapshot_and_delta_round_trip():
+    state = GameState(seed=3)
+    mirror = protocol.StateMirror()
+    mirror.feed(protocol.encode_snapshot(state, protocol.state_fields(state), 1, True))
+    assert mirror.grid == [list(row) for row in state.grid]
+    assert (mirror.seed, mirror.floor, mirror.server_tick) == (3, 1, 1)
+    assert (mirror.stairs_up_pos, mirror.stairs_down_pos) == (state.stairs_up_pos, state.stairs_down_pos)
+    assert protocol.state_fields(mirror) == protocol.state_fields(state)
+
+    before = protocol.state_fields(state)
+    state.set_player_pos(*state.enemies[0])
+    state.tick()
+    assert state.in_combat
+    data = protocol.encode_delta(before, protocol.state_fields(state), 2, ["attack"])
+    # Messages split across reads are put back together
+    mirror.feed(data[:3])
+    mirror.feed(data[3:])
+    assert protocol.state_fields(mirror) == protocol.state_fields(state)
+    assert mirror.events == ["attack"]
+    assert protocol.encode_delta(before, before, 3) is None
+
+def test_join_round_trip():
+    for seed in (SEED_MIN, -1, 0, SEED_MAX):
+        data = protocol.join_message(seed)
+        kind, length = protocol.HEADER.unpack_from(data, 0)
+        assert (kind, length) == (protocol.JOIN, protocol.JOIN_BODY.size)
+        assert protocol.JOIN_BODY.unpack_from(data, protocol.HEADER.size)[0] == seed
+
+def test_join_rejects_out_of_range_seeds():
+    # Regression: a seed past int64 raised struct.error under main.py --connect
+    for seed in (SEED_MAX + 1, SEED_MIN - 1, 10 ** 20):
+        with pytest.raises(ValueError):
+            protocol.join_message(seed)
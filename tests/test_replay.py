@@ -0,0 +1,46 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+import replay
+from engine import SEED_MAX, SEED_MIN, GameState
+
+def record(path, script):
+    # Run script's (action, ticks) steps on a recorded session
+    state = GameState(seed=3)
+    recorder = replay.Recorder(state, path)
+    for action, ticks in script:
+        if isinstance(action, int):
+            recorder.new_game(action)
+            state.new_game(action)
+        elif action is not None:
+            recorder.apply(action)
+            state.apply(action)
+        for _ in range(ticks):
+            state.tick()
+            recorder.tick()
+    recorder.close()
+    return state
+
+def test_replay_reproduces_the_session(tmp_path):
+    path = str(tmp_path / "session.replay")
+    script = [(None, 10), ("right", 60), ("down", 60), (SEED_MAX, 5), ("left", 60), (SEED_MIN, 5), ("up", 60)]
+    recorded = record(path, script)
+    player = replay.ReplayPlayer(path)
+    while player.step():
+        pass
+    assert player.state.seed == SEED_MIN
+    assert replay.state_hash(player.state) == replay.state_hash(recorded)
+    assert player.actions == len(script) - 1
+
+def test_new_game_rejects_out_of_range_seeds(tmp_path):
+    # Regression: the one-byte length prefix raised on seeds of more than 255 digits
+    recorder = replay.Recorder(GameState(seed=3), str(tmp_path / "session.replay"))
+    with pytest.raises(ValueError):
+        recorder.new_game(10 ** 300)
+    with pytest.raises(ValueError):
+        recorder.new_game(SEED_MAX + 1)
+    recorder.close()
@@ -0,0 +1,50 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+import savegame
+from engine import SEED_MAX, GameState, check_seed
+
+def played_state(seed):
+    # A game with something to save: floor 1 partly explored, floor 2 entered
+    state = GameState(seed=seed, generator="bsp")
+    state.update_fov()
+    state.set_player_pos(*state.stairs_down_pos)
+    state.tick()
+    state.update_fov()
+    state.enemies.pop()
+    state.player_hp -= 7
+    return state
+
+def test_save_round_trip():
+    state = played_state(SEED_MAX)
+    loaded = savegame.loads(savegame.pack_state(state), fresh_streams=False)
+    assert (loaded.seed, loaded.floor, loaded.generator) == (SEED_MAX, 2, "bsp")
+    assert (loaded.player_x, loaded.player_y, loaded.player_hp) == (state.player_x, state.player_y, state.player_hp)
+    assert loaded.enemies == state.enemies
+    assert bytes(loaded.explored) == bytes(state.explored)
+    assert [(floor[0], floor[1], bytes(floor[4])) for floor in loaded.changed_floors()] == \
+           [(floor[0], floor[1], bytes(floor[4])) for floor in state.changed_floors()]
+
+def test_save_rejects_other_files():
+    with pytest.raises(ValueError):
+        savegame.loads(b"RLSV\x09" + bytes(40))
+    with pytest.raises(ValueError):
+        savegame.loads(savegame.pack_state(played_state(3))[:-1])
+
+def test_out_of_range_seed_is_rejected():
+    with pytest.raises(ValueError):
+        check_seed(SEED_MAX + 1)
+    assert check_seed(-SEED_MAX - 1) == -SEED_MAX - 1
+
+def test_failed_autosave_does_not_raise(tmp_path):
+    # Regression: a seed past int64 raised struct.error out of the frame loop
+    state = played_state(3)
+    state.seed = 10 ** 20
+    writer = savegame.SaveWriter(str(tmp_path / "save.dat"))
+    writer.save(state)
+    writer.close()
+    assert not (tmp_path / "save.dat").exists()